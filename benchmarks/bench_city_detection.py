@@ -0,0 +1,89 @@
+# benchmarks/bench_city_detection.py
+"""Compare the old substring/regex city detection with cityner.
+
+Run from the repo root:  python benchmarks/bench_city_detection.py [n_saved]
+
+``n_saved`` synthetic saved-city names are added to both detectors to show
+how each scales with the number of downloaded cities.
+"""
+import os
+import random
+import re
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.geo.cityner import CityMatcher, build_names, detect_city  # noqa: E402
+from services.storage.bundle import BUILTIN_CITIES, compile_entries, entry_names  # noqa: E402
+
+OFFLINE_KEYS = ["bengaluru", "mysuru", "mangaluru", "udupi", "coorg", "chikmagalur", "hampi", "gokarna"]
+
+# (message, expected city key or None)
+CASES = [
+    ("Tell me about Mysuru", "mysuru"),
+    ("tell me about mysore palace", "mysuru"),
+    ("best food in bangalore tomorrow please", "bengaluru"),
+    ("places to see in udupi", "udupi"),
+    ("what to do around kodagu this weekend", "coorg"),
+    ("hotels in chikkamagaluru", "chikmagalur"),
+    ("is hampi crowded in december", "hampi"),
+    ("beaches near gokarna", "gokarna"),
+    ("planning a trip to mangalore", "mangaluru"),
+    ("visit mysoore", "mysuru"),
+    ("good cafes in pune today", "pune"),
+    ("what's the weather like", None),
+]
+
+
+def legacy_detect(lower: str, folders):
+    """The pre-cityner logic from streamlit_app.py, verbatim."""
+    detected_city = None
+    for k in OFFLINE_KEYS:
+        if k in lower:
+            detected_city = k
+            break
+    if not detected_city:
+        m = re.search(r"\b(?:in|at|around)\s+([a-z\s]+)", lower)
+        if m:
+            detected_city = m.group(1).strip()
+    if not detected_city:
+        for f in folders:
+            if f in lower:
+                detected_city = f
+                break
+    return detected_city
+
+
+def main():
+    n_saved = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rng = random.Random(7)
+    folders = sorted({"".join(rng.choices(string.ascii_lowercase, k=8)) for _ in range(n_saved)})
+    records = [{"key": f, "city": f, "meta": {}} for f in folders]
+    data_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "offline_data.json")
+
+    t0 = timeit.default_timer()
+    matcher = CityMatcher(build_names(entry_names(compile_entries(BUILTIN_CITIES, data_path, records))))
+    build_ms = (timeit.default_timer() - t0) * 1e3
+
+    messages = [m.lower() for m, _ in CASES]
+    legacy_ok = sum(legacy_detect(m.lower(), folders) == exp for m, exp in CASES)
+    new_ok = sum(detect_city(m.lower(), matcher) == exp for m, exp in CASES)
+
+    reps = 200
+    legacy_t = timeit.timeit(lambda: [legacy_detect(m, folders) for m in messages], number=reps)
+    new_t = timeit.timeit(lambda: [detect_city(m, matcher) for m in messages], number=reps)
+    exact_t = timeit.timeit(lambda: [matcher.find_all(m) for m in messages], number=reps)
+    per = reps * len(messages)
+
+    print(f"saved cities: {len(folders)}  matcher build: {build_ms:.1f} ms")
+    print(f"legacy : {legacy_t / per * 1e6:8.1f} us/msg   correct {legacy_ok}/{len(CASES)}")
+    print(f"cityner: {new_t / per * 1e6:8.1f} us/msg   correct {new_ok}/{len(CASES)}")
+    print(f"  (Aho-Corasick pass alone: {exact_t / per * 1e6:.1f} us/msg; the rest is the fuzzy fallback)")
+    for m, exp in CASES:
+        print(f"  {m!r:45} legacy={legacy_detect(m.lower(), folders)!r:30} cityner={detect_city(m.lower(), matcher)!r}")
+
+
+if __name__ == "__main__":
+    main()
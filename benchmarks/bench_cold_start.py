@@ -0,0 +1,104 @@
+# benchmarks/bench_cold_start.py
+"""Measure app cold start: module imports and the first script run.
+
+Run from the repo root:  python benchmarks/bench_cold_start.py [--rev REV] [--runs N]
+
+Every measurement uses a fresh interpreter so nothing is already in
+``sys.modules``. "imports" times the module-level imports of
+``streamlit_app.py`` (parsed from the script, so any layout works);
+"first run" / "rerun" time the whole script under Streamlit's AppTest.
+With ``--rev`` the same numbers are taken for a git revision (exported to a
+temp dir with ``git archive``) for a before/after comparison.
+"""
+import argparse
+import ast
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORTS_SNIPPET = """
+import time
+t = time.perf_counter()
+{imports}
+print(time.perf_counter() - t)
+"""
+
+APPTEST_SNIPPET = """
+import time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("streamlit_app.py", default_timeout=120)
+t = time.perf_counter()
+at.run()
+first = time.perf_counter() - t
+t = time.perf_counter()
+at.run()
+print(first, time.perf_counter() - t)
+"""
+
+
+def script_imports(tree_root: str) -> str:
+    """Module-level import statements of streamlit_app.py, as source."""
+    with open(os.path.join(tree_root, "streamlit_app.py"), "r", encoding="utf-8") as f:
+        source = f.read()
+    lines = []
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            lines.append(ast.get_source_segment(source, node))
+        elif isinstance(node, ast.Try) and any(isinstance(n, (ast.Import, ast.ImportFrom)) for n in node.body):
+            # optional imports wrapped in try/except
+            lines.append(ast.get_source_segment(source, node))
+    return "\n".join(lines)
+
+
+def run_python(tree_root: str, code: str, data_dir: str) -> list:
+    env = dict(os.environ, DATA_DIR=data_dir, PYTHONDONTWRITEBYTECODE="1")
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=tree_root, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()
+    return [float(x) for x in out[-1].split()]
+
+
+def measure(tree_root: str, runs: int) -> dict:
+    code = IMPORTS_SNIPPET.format(imports=script_imports(tree_root))
+    imports, first, rerun = [], [], []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as data_dir:
+            shutil.copy(os.path.join(ROOT, "data", "offline_data.json"), data_dir)
+            imports += run_python(tree_root, code, data_dir)
+            a, b = run_python(tree_root, APPTEST_SNIPPET, data_dir)
+            first.append(a)
+            rerun.append(b)
+    return {"imports": imports, "first run": first, "rerun": rerun}
+
+
+def export_rev(rev: str, dest: str):
+    archive = subprocess.run(["git", "archive", rev], cwd=ROOT, capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", dest], input=archive, check=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rev", help="git revision to compare against (e.g. HEAD~1)")
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    results = {"working tree": measure(ROOT, args.runs)}
+    if args.rev:
+        with tempfile.TemporaryDirectory() as tree:
+            export_rev(args.rev, tree)
+            results[args.rev] = measure(tree, args.runs)
+
+    print(f"median of {args.runs} fresh interpreters (ms)")
+    print(f"{'':16}" + "".join(f"{k:>14}" for k in ("imports", "first run", "rerun")))
+    for label, r in results.items():
+        print(f"{label:16}" + "".join(f"{statistics.median(r[k]) * 1e3:14.0f}" for k in ("imports", "first run", "rerun")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# benchmarks/bench_e2e.py
+"""End-to-end latency benchmark against local stand-ins for every upstream.
+
+Run from the repo root:
+
+    python benchmarks/bench_e2e.py [--iterations N] [--sessions S] [--messages M]
+                                   [--latency-scale X] [--failure-rate P]
+                                   [--save FILE] [--compare FILE] [--tolerance T]
+
+Google, OpenAI, Nominatim, Unsplash, gTTS and the tile server are replaced
+by :mod:`fake_upstreams` (fixed per-route latency, optional injected 503s),
+and the app's data goes to a temporary ``DATA_DIR``, so runs are
+repeatable offline. Three groups of stages are timed:
+
+- services: ``gpt_reply``, ``gpt_reply_stream`` (first chunk and total),
+  ``geocode_city``, ``fetch_unsplash_urls``, ``download_image``,
+  ``synthesize`` and ``download_city``, each on cold keys so caches miss;
+- app: the first script run, a chat message with its gallery/map, a
+  "what's near me" message and the sidebar download flow, driven headlessly
+  through Streamlit's AppTest;
+- concurrency: S sessions, each in its own thread and AppTest, sending M
+  distinct messages at once; reports per-message latency and throughput.
+
+p50/p95/max are printed per stage. ``--save`` writes them as JSON and
+``--compare`` exits with status 1 when a stage's p95 is more than
+``--tolerance`` (default 25%) slower than the saved run.
+"""
+import argparse
+import ast
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_upstreams import FakeUpstreams  # noqa: E402
+
+# AppTest compiles the script on every run, and CPython 3.11 keeps the AST
+# builder's recursion counter per interpreter, so sessions compiling at the
+# same moment can fail each other's parse; the server compiles once and is
+# not affected
+_parse, _parse_lock = ast.parse, threading.Lock()
+
+
+def _serial_parse(*args, **kwargs):
+    with _parse_lock:
+        return _parse(*args, **kwargs)
+
+
+ast.parse = _serial_parse
+
+CITIES = ["Pune", "Goa", "Ooty", "Kochi", "Madurai", "Hyderabad", "Jaipur", "Varanasi"]
+QUESTIONS = ["Tell me about {city}", "What should I eat in {city}", "Hidden gems in {city}",
+             "Best time to visit {city}", "One day plan for {city}"]
+
+samples = defaultdict(list)
+_samples_lock = threading.Lock()
+
+
+def record(stage: str, seconds: float):
+    with _samples_lock:
+        samples[stage].append(seconds)
+
+
+def timed(stage: str, fn, *args, **kwargs):
+    t = time.perf_counter()
+    result = fn(*args, **kwargs)
+    record(stage, time.perf_counter() - t)
+    return result
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile (q in 0..100)."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+# -- stages ----------------------------------------------------------------
+
+def bench_services(iterations: int, scratch: str):
+    from services.ai import gpt_reply, gpt_reply_stream
+    from services.geo.geocoding import geocode_city
+    from services.storage.downloader import download_city, download_image, fetch_unsplash_urls
+    from services.tts import synthesize
+
+    for i in range(iterations):
+        city = CITIES[i % len(CITIES)]
+        # distinct questions / names so the reply and geocode caches miss
+        timed("service: gpt_reply", gpt_reply, city, f"What to do in {city} on day {i}?")
+        t = time.perf_counter()
+        first = None
+        for _ in gpt_reply_stream(city, f"Where to eat in {city} on day {i}?"):
+            first = first or time.perf_counter() - t
+        record("service: gpt_reply_stream (first chunk)", first or time.perf_counter() - t)
+        record("service: gpt_reply_stream (total)", time.perf_counter() - t)
+        timed("service: geocode_city", geocode_city, f"{city} bench {i}")
+        urls = timed("service: fetch_unsplash_urls", fetch_unsplash_urls, f"{city} {i}", n=3)
+        if urls:
+            timed("service: download_image", download_image, urls[0], os.path.join(scratch, f"img-{i}.jpg"))
+        timed("service: synthesize", synthesize, f"{city} is lovely in winter ({i}).")
+    for i in range(max(1, iterations // 4)):
+        timed("service: download_city", download_city, f"benchtown{i}", info="Bench town.", spots=["Fort"])
+
+
+def new_app():
+    from streamlit.testing.v1 import AppTest
+
+    return AppTest.from_file(os.path.join(ROOT, "streamlit_app.py"), default_timeout=120)
+
+
+def send(at, text: str, stage: str):
+    t = time.perf_counter()
+    at.chat_input[0].set_value(text).run()
+    record(stage, time.perf_counter() - t)
+    if at.exception:
+        raise RuntimeError(f"{stage}: {at.exception[0].value}")
+
+
+def bench_app(iterations: int):
+    from services.jobs import get_job_queue
+
+    at = new_app()
+    timed("app: first run", at.run)
+    for i in range(iterations):
+        city = CITIES[i % len(CITIES)]
+        send(at, f"Tell me about {city}, visit {i}", "app: chat message + gallery/map")
+        send(at, f"what's near me in {city}", "app: nearby message")
+    jobs = get_job_queue()
+    for i in range(max(1, iterations // 4)):
+        at.sidebar.text_input[0].set_value(f"benchcity{i}").run()
+        t = time.perf_counter()
+        [b for b in at.sidebar.button if b.label == "Download for offline"][0].click().run()
+        record("app: download click", time.perf_counter() - t)
+        for job_id in at.session_state["jobs"]:
+            jobs.wait(job_id, 120)
+        record("app: download until saved", time.perf_counter() - t)
+
+
+def bench_concurrency(sessions: int, messages: int) -> float:
+    """Returns messages per second across all sessions."""
+    errors = []
+    apps = [new_app() for _ in range(sessions)]
+    for at in apps:
+        at.run()
+    start = threading.Barrier(sessions)
+
+    def session(s: int, at):
+        try:
+            start.wait()
+            for m in range(messages):
+                city = CITIES[(s + m) % len(CITIES)]
+                text = QUESTIONS[m % len(QUESTIONS)].format(city=city) + f" (session {s})"
+                send(at, text, f"concurrent: message ({sessions} sessions)")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=session, args=(s, at)) for s, at in enumerate(apps)]
+    t = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    wall = time.perf_counter() - t
+    if errors:
+        raise errors[0]
+    return sessions * messages / wall
+
+
+# -- reporting -------------------------------------------------------------
+
+def summarize() -> dict:
+    return {
+        stage: {"n": len(v), "p50": percentile(v, 50), "p95": percentile(v, 95), "max": max(v)}
+        for stage, v in samples.items()
+    }
+
+
+def report(summary: dict, throughput: float, requests: dict, baseline: dict = None):
+    print(f"{'stage':48}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}" + ("   p95 vs base" if baseline else ""))
+    for stage, s in summary.items():
+        line = f"{stage:48}{s['n']:5d}{s['p50'] * 1e3:10.1f}{s['p95'] * 1e3:10.1f}{s['max'] * 1e3:10.1f}"
+        base = (baseline or {}).get("stages", {}).get(stage)
+        if base:
+            line += f"   {(s['p95'] / base['p95'] - 1) * 100:+6.1f}%"
+        print(line)
+    print(f"\nthroughput: {throughput:.2f} messages/s")
+    print("upstream requests: " + ", ".join(f"{k}={v}" for k, v in sorted(requests.items())))
+
+
+def regressions(summary: dict, baseline: dict, tolerance: float) -> list:
+    out = []
+    for stage, base in baseline.get("stages", {}).items():
+        cur = summary.get(stage)
+        if cur and cur["p95"] > base["p95"] * (1 + tolerance):
+            out.append(f"{stage}: p95 {base['p95'] * 1e3:.1f} -> {cur['p95'] * 1e3:.1f} ms")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=8)
+    ap.add_argument("--sessions", type=int, default=4)
+    ap.add_argument("--messages", type=int, default=3)
+    ap.add_argument("--latency-scale", type=float, default=1.0, help="multiply every upstream latency")
+    ap.add_argument("--failure-rate", type=float, default=0.0, help="fraction of upstream requests answered 503")
+    ap.add_argument("--save", help="write the results as JSON")
+    ap.add_argument("--compare", help="JSON from an earlier --save; exit 1 on p95 regressions")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args()
+
+    fake = FakeUpstreams(latency_scale=args.latency_scale, failure_rate=args.failure_rate).start()
+    data_dir = tempfile.mkdtemp(prefix="bench-e2e-")
+    shutil.copy(os.path.join(ROOT, "data", "offline_data.json"), data_dir)
+    # must be set before config is imported
+    os.environ.update(fake.env(), DATA_DIR=data_dir, TILE_SERVER_PORT="0", NETWORK_PROBE_TTL="3600")
+    os.chdir(ROOT)
+    try:
+        bench_services(args.iterations, data_dir)
+        bench_app(args.iterations)
+        throughput = bench_concurrency(args.sessions, args.messages)
+    finally:
+        fake.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    summary = summarize()
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(summary, throughput, fake.requests, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"stages": summary, "throughput": throughput, "args": vars(args)}, f, indent=2)
+    if baseline:
+        slower = regressions(summary, baseline, args.tolerance)
+        if slower:
+            print("\nregressions:\n  " + "\n  ".join(slower))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
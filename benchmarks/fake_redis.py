@@ -0,0 +1,182 @@
+# benchmarks/fake_redis.py
+"""A small in-memory Redis stand-in (RESP2 over TCP) for multi-replica runs.
+
+Implements the commands the ``redis`` storage backend uses: PING, AUTH,
+SELECT, GET, SET (with PX/EX), DEL, INCR, RPUSH, LRANGE, LLEN, SCAN and
+KEYS. Expired keys are dropped lazily. Not a Redis replacement; it exists
+so several app processes can share state on a machine without a server.
+
+    python benchmarks/fake_redis.py --port 6390
+    STORAGE_BACKEND=redis://127.0.0.1:6390/0 streamlit run streamlit_app.py --server.port 8501
+    STORAGE_BACKEND=redis://127.0.0.1:6390/0 streamlit run streamlit_app.py --server.port 8502
+"""
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+
+
+class _Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}  # key -> bytes | list
+        self.expires = {}
+
+    def live(self, key):
+        exp = self.expires.get(key)
+        if exp is not None and exp < time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # inline command (e.g. from telnet)
+        args = []
+        for _ in range(int(line[1:])):
+            n = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(n + 2)[:-2])
+        return args
+
+    def _reply(self, value):
+        if value is None:
+            out = b"$-1\r\n"
+        elif isinstance(value, bool):
+            out = b"+OK\r\n"
+        elif isinstance(value, int):
+            out = b":%d\r\n" % value
+        elif isinstance(value, Exception):
+            out = b"-ERR %s\r\n" % str(value).encode()
+        elif isinstance(value, list):
+            self.wfile.write(b"*%d\r\n" % len(value))
+            for v in value:
+                self._reply(v)
+            return
+        else:
+            out = b"$%d\r\n%s\r\n" % (len(value), value)
+        self.wfile.write(out)
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            try:
+                args = self._read_command()
+            except (OSError, ValueError):
+                return
+            if not args:
+                return
+            cmd = args[0].upper().decode()
+            with store.lock:
+                try:
+                    result = getattr(self, f"cmd_{cmd}", self.cmd_unknown)(store, args[1:])
+                except Exception as e:
+                    result = e
+            self._reply(result)
+
+    # -- commands ------------------------------------------------------
+    def cmd_unknown(self, store, args):
+        return ValueError("unknown command")
+
+    def cmd_PING(self, store, args):
+        return True
+
+    def cmd_AUTH(self, store, args):
+        return True
+
+    def cmd_SELECT(self, store, args):
+        return True
+
+    def cmd_GET(self, store, args):
+        return store.data[args[0]] if store.live(args[0]) else None
+
+    def cmd_SET(self, store, args):
+        key, value = args[0], args[1]
+        store.data[key] = value
+        store.expires.pop(key, None)
+        opts = [a.upper() for a in args[2:]]
+        if b"PX" in opts:
+            store.expires[key] = time.time() + int(args[2 + opts.index(b"PX") + 1]) / 1000
+        elif b"EX" in opts:
+            store.expires[key] = time.time() + int(args[2 + opts.index(b"EX") + 1])
+        return True
+
+    def cmd_DEL(self, store, args):
+        n = 0
+        for key in args:
+            if store.live(key):
+                n += 1
+            store.data.pop(key, None)
+            store.expires.pop(key, None)
+        return n
+
+    def cmd_INCR(self, store, args):
+        value = int(store.data[args[0]]) + 1 if store.live(args[0]) else 1
+        store.data[args[0]] = str(value).encode()
+        return value
+
+    def cmd_RPUSH(self, store, args):
+        if not store.live(args[0]):
+            store.data[args[0]] = []
+        lst = store.data[args[0]]
+        lst.extend(args[1:])
+        return len(lst)
+
+    def cmd_LRANGE(self, store, args):
+        lst = store.data.get(args[0], []) if store.live(args[0]) else []
+        start, stop = int(args[1]), int(args[2])
+        stop = len(lst) if stop == -1 else stop + 1
+        return list(lst[start:stop])
+
+    def cmd_LLEN(self, store, args):
+        return len(store.data.get(args[0], [])) if store.live(args[0]) else 0
+
+    def _match(self, store, pattern):
+        pattern = pattern.decode()
+        return [k for k in list(store.data) if store.live(k) and fnmatch.fnmatchcase(k.decode(), pattern)]
+
+    def cmd_KEYS(self, store, args):
+        return self._match(store, args[0])
+
+    def cmd_SCAN(self, store, args):
+        opts = [a.upper() for a in args]
+        pattern = args[opts.index(b"MATCH") + 1] if b"MATCH" in opts else b"*"
+        return [b"0", self._match(store, pattern)]  # everything in one page
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0, host: str = "127.0.0.1"):
+        super().__init__((host, port), _Handler)
+        self.store = _Store()
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-redis", daemon=True).start()
+        return self
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=6390)
+    args = ap.parse_args()
+    server = FakeRedis(args.port)
+    print(f"STORAGE_BACKEND={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# benchmarks/fake_upstreams.py
+"""Local stand-ins for every external service the app talks to.
+
+One threaded HTTP server on 127.0.0.1 answers for:
+
+- ``/v1/chat/completions``  OpenAI chat completions (plain and SSE streaming)
+- ``/nominatim/search``     Nominatim geocoding (deterministic coordinates)
+- ``/unsplash/search/photos`` Unsplash search, pointing at ``/img/...``
+- ``/img/<name>.jpg``       generated JPEG photos (with ETags, 304 on If-None-Match)
+- ``/tiles/{z}/{x}/{y}.png`` raster map tiles
+- ``/tts``                  MP3-ish bytes for the ``TTS_URL`` hook
+
+Each route sleeps for a configurable latency and fails with HTTP 503 at a
+configurable rate, so benchmarks can reproduce slow or flaky upstreams.
+:meth:`FakeUpstreams.env` returns the environment variables that point the
+app at the server (set them before ``config`` is imported).
+
+Run standalone to use the app against it by hand:
+
+    python benchmarks/fake_upstreams.py --port 9000
+    # then export the printed variables and: streamlit run streamlit_app.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image, ImageDraw
+
+# seconds per request; "openai" is time to first token, "openai_token" per streamed token
+DEFAULT_LATENCY = {
+    "openai": 0.40,
+    "openai_token": 0.01,
+    "nominatim": 0.25,
+    "unsplash": 0.30,
+    "image": 0.15,
+    "tile": 0.03,
+    "tts": 0.30,
+}
+
+REPLY = (
+    "1. Food: try the local thali at a busy family restaurant near the market. "
+    "2. Sights: start early at the main palace or temple before the crowds arrive. "
+    "3. Hidden gem: walk the old quarter lanes in the evening for street snacks and crafts. "
+    "Would you like a one-day plan for the city?"
+)
+
+
+def _stable(text: str) -> int:
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real upstreams
+
+    def log_message(self, *args):
+        pass
+
+    # -- plumbing ------------------------------------------------------
+    def _send(self, status: int, body: bytes, ctype: str, etag: str = None):
+        if etag and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, obj, status: int = 200):
+        self._send(status, json.dumps(obj).encode("utf-8"), "application/json")
+
+    def _delay(self, route: str) -> bool:
+        """Sleep for the route's latency; False (and a 503 sent) if this request should fail."""
+        fake = self.server.fake
+        fake.count(route)
+        time.sleep(fake.latency.get(route, 0.0) * fake.latency_scale)
+        if fake.failure_rate and fake.rng.random() < fake.failure_rate:
+            self._json({"error": "injected failure"}, status=503)
+            return False
+        return True
+
+    # -- routes --------------------------------------------------------
+    def do_GET(self):
+        url = urlsplit(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        path = url.path
+        if path == "/nominatim/search":
+            if self._delay("nominatim"):
+                h = _stable(q.get("q", "").lower())
+                # somewhere in south India, stable per query
+                self._json([{"lat": str(8.0 + (h % 1000) / 100.0), "lon": str(74.0 + (h // 1000 % 600) / 100.0)}])
+        elif path == "/unsplash/search/photos":
+            if self._delay("unsplash"):
+                base = self.server.fake.url
+                name = "".join(c for c in q.get("query", "city").lower() if c.isalnum()) or "city"
+                n = int(q.get("per_page", 3))
+                self._json({"results": [{"urls": {"regular": f"{base}/img/{name}-{i}.jpg"}} for i in range(n)]})
+        elif path.startswith("/img/"):
+            if self._delay("image"):
+                self._send(200, self.server.fake.photo(path), "image/jpeg", etag=f'"{_stable(path):x}"')
+        elif path.startswith("/tiles/"):
+            if self._delay("tile"):
+                self._send(200, self.server.fake.tile(), "image/png")
+        elif path == "/tts":
+            if self._delay("tts"):
+                # a fixed-size stand-in for an MP3 clip; players aren't exercised
+                self._send(200, b"ID3" + bytes(4000 + len(q.get("text", ""))), "audio/mpeg")
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if urlsplit(self.path).path != "/v1/chat/completions":
+            self._json({"error": "not found"}, status=404)
+            return
+        if not self._delay("openai"):
+            return
+        req = json.loads(body or b"{}")
+        model = req.get("model", "gpt-3.5-turbo")
+        if not req.get("stream"):
+            self._json({
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        per_token = self.server.fake.latency.get("openai_token", 0.0) * self.server.fake.latency_scale
+        words = REPLY.split(" ")
+        for i, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            self._chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            time.sleep(per_token)
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients dropping keep-alive connections at exit is expected
+
+
+class FakeUpstreams:
+    """Threaded stand-in server. Use as a context manager or call start()/stop()."""
+
+    def __init__(self, port: int = 0, latency: dict = None, latency_scale: float = 1.0,
+                 failure_rate: float = 0.0, seed: int = 0):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.latency_scale = latency_scale
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._photos = {}
+        self._tile = None
+        self._server = _Server(("127.0.0.1", port), _Handler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def env(self) -> dict:
+        """Environment variables that route every upstream call to this server."""
+        return {
+            "NETWORK_PROBE_URL": self.url,
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "NOMINATIM_URL": f"{self.url}/nominatim/search",
+            "UNSPLASH_ACCESS_KEY": "bench",
+            "UNSPLASH_API_URL": f"{self.url}/unsplash/search/photos",
+            "TILE_URL": self.url + "/tiles/{z}/{x}/{y}.png",
+            "TTS_URL": f"{self.url}/tts",
+        }
+
+    def count(self, route: str):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def photo(self, path: str) -> bytes:
+        with self._lock:
+            if path not in self._photos:
+                h = _stable(path)
+                img = Image.new("RGB", (1080, 720), (h % 200, h // 200 % 200, h // 40000 % 200))
+                ImageDraw.Draw(img).text((40, 40), path, fill=(255, 255, 255))
+                buf = BytesIO()
+                img.save(buf, format="JPEG", quality=85)
+                self._photos[path] = buf.getvalue()
+            return self._photos[path]
+
+    def tile(self) -> bytes:
+        with self._lock:
+            if self._tile is None:
+                buf = BytesIO()
+                Image.new("RGB", (256, 256), (236, 234, 228)).save(buf, format="PNG")
+                self._tile = buf.getvalue()
+            return self._tile
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-upstreams", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=9000)
+    ap.add_argument("--latency-scale", type=float, default=1.0)
+    ap.add_argument("--failure-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    fake = FakeUpstreams(args.port, latency_scale=args.latency_scale, failure_rate=args.failure_rate).start()
+    for k, v in fake.env().items():
+        print(f"export {k}='{v}'")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,18 @@ load_dotenv()
 class Config:
     # API Keys
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    UNSPLASH_ACCESS_KEY = os.getenv('UNSPLASH_ACCESS_KEY', '')
     
     # App Configuration
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key')
+    DATA_DIR = os.getenv('DATA_DIR', 'data')
+    CITIES_DIR = os.path.join(DATA_DIR, 'cities')
     
+    # Shared Storage (sessions, saved-city index, TTS and reply caches)
+    # fs | sqlite | sqlite:///path | redis://host:6379/0 — share one across replicas
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'fs')
+    STORAGE_NAMESPACE = os.getenv('STORAGE_NAMESPACE', 'tourguide:')
+
     # Feature Flags
     ENABLE_VOICE = True
     ENABLE_GPS = True
@@ -19,11 +27,91 @@ class Config:
     AI_MODEL = "gpt-3.5-turbo"
     MAX_TOKENS = 1000
     TEMPERATURE = 0.7
+    REPLY_MAX_TOKENS = int(os.getenv('REPLY_MAX_TOKENS', '300'))
+    GROUNDING_PASSAGES = 3
     
     # Voice Settings
     VOICE_RATE = 150
     VOICE_VOLUME = 0.8
+    TTS_CACHE_MAX_BYTES = int(os.getenv('TTS_CACHE_MAX_BYTES', str(50 * 1024 * 1024)))
     
     # GPS Settings
     DEFAULT_LATITUDE = 40.7128
     DEFAULT_LONGITUDE = -74.0060
+
+    # Upstream Endpoints (point these at local stand-ins for benchmarks)
+    NETWORK_PROBE_URL = os.getenv('NETWORK_PROBE_URL', 'https://www.google.com')
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+    NOMINATIM_URL = os.getenv('NOMINATIM_URL', 'https://nominatim.openstreetmap.org/search')
+    UNSPLASH_API_URL = os.getenv('UNSPLASH_API_URL', 'https://api.unsplash.com/search/photos')
+    TTS_URL = os.getenv('TTS_URL', '')  # optional HTTP TTS (GET ?text=&lang= -> MP3) instead of gTTS
+
+    # HTTP Client
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+    HTTP_BACKOFF = 0.5  # seconds, doubled per retry (full jitter)
+    HTTP_BACKOFF_CAP = 8.0
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))  # keep-alive connections per host
+    NOMINATIM_RATE = float(os.getenv('NOMINATIM_RATE', '1'))  # requests/second (usage policy)
+    UNSPLASH_RATE = float(os.getenv('UNSPLASH_RATE', '10'))
+    TILE_RATE = float(os.getenv('TILE_RATE', '20'))
+
+    # Connectivity Settings
+    NETWORK_PROBE_TTL = float(os.getenv('NETWORK_PROBE_TTL', '30'))
+    NETWORK_PROBE_TIMEOUT = float(os.getenv('NETWORK_PROBE_TIMEOUT', '1.0'))
+    BREAKER_FAILURE_THRESHOLD = 3
+    BREAKER_COOLDOWN = 60.0
+
+    # Geocoding Cache
+    GEOCODE_TTL = 30 * 86400
+    GEOCODE_NEGATIVE_TTL = 86400
+
+    # Offline Downloads
+    DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '6'))
+    DOWNLOAD_IMAGES_PER_CITY = 4
+    REFRESH_AFTER = float(os.getenv('REFRESH_AFTER', str(7 * 86400)))  # saved assets older than this are revalidated
+
+    # Storage Quota (saved cities + cached audio, LRU-evicted; 0 = unlimited)
+    STORAGE_QUOTA_BYTES = int(os.getenv('STORAGE_QUOTA_BYTES', '0'))
+
+    # Reply Cache
+    REPLY_CACHE_SIZE = int(os.getenv('REPLY_CACHE_SIZE', '512'))
+    REPLY_CACHE_TTL = float(os.getenv('REPLY_CACHE_TTL', str(6 * 3600)))
+
+    # Conversation Log
+    CHAT_WINDOW = int(os.getenv('CHAT_WINDOW', '50'))
+    CHAT_PAGE_SIZE = int(os.getenv('CHAT_PAGE_SIZE', '20'))
+
+    # Gallery Thumbnails
+    THUMB_WIDTH = int(os.getenv('THUMB_WIDTH', '480'))
+    THUMB_CACHE_MAX_BYTES = int(os.getenv('THUMB_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+    # Metrics
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # serve Prometheus /metrics when set
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')  # 0.0.0.0 for scrapers on other hosts
+
+    # Background Jobs
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+    CITY_MEDIA_REUSE = 3600
+
+    # Nearby Places
+    POI_GRID_CELL_DEG = 0.25
+    NEARBY_RESULTS = int(os.getenv('NEARBY_RESULTS', '5'))
+
+    # Itinerary Planner
+    ITINERARY_SPEED_KMH = float(os.getenv('ITINERARY_SPEED_KMH', '20'))  # average in-city travel speed
+    ITINERARY_VISIT_MINUTES = 60  # time spent at each stop
+    ITINERARY_CACHE_SIZE = 256
+
+    # Offline Map Tiles
+    TILE_URL = os.getenv('TILE_URL', 'https://a.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png')
+    TILE_ATTRIBUTION = '&copy; OpenStreetMap contributors &copy; CARTO'
+    TILE_MIN_ZOOM = 10
+    TILE_MAX_ZOOM = 14
+    TILE_RADIUS_KM = float(os.getenv('TILE_RADIUS_KM', '6'))
+    STATIC_MAP_ZOOM = 13
+    STATIC_MAP_SIZE = (900, 480)
+    # the tile server binds to 127.0.0.1; browsers on other machines need TILE_PUBLIC_URL
+    # (a proxy in front of it), so it is only on by default when that is set
+    TILE_PUBLIC_URL = os.getenv('TILE_PUBLIC_URL', '')
+    LOCAL_TILE_SERVER = os.getenv('LOCAL_TILE_SERVER', '1' if TILE_PUBLIC_URL else '0') == '1'
+    TILE_SERVER_PORT = int(os.getenv('TILE_SERVER_PORT', '8765'))
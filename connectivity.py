@@ -0,0 +1,268 @@
+# connectivity.py
+"""Shared network status: a background prober with a TTL cache and
+per-service circuit breakers.
+
+Streamlit re-executes ``streamlit_app.py`` on every interaction, but imported
+modules stay cached in ``sys.modules``, so the monitor below is created once
+per process and shared by every session.
+"""
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from config import Config
+from tracing import span
+
+
+def endpoint(url: str):
+    """(host, port) of an upstream URL."""
+    parts = urlsplit(url)
+    return parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)
+
+
+# Upstreams tracked separately. "internet" decides the global Online/Offline badge.
+SERVICES = {
+    "internet": endpoint(Config.NETWORK_PROBE_URL),
+    "openai": endpoint(Config.OPENAI_BASE_URL),
+    "unsplash": endpoint(Config.UNSPLASH_API_URL),
+    "nominatim": endpoint(Config.NOMINATIM_URL),
+}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+# (host, port) -> [done event, addrinfo list or OSError]; one lookup in flight per endpoint
+_lookups = {}
+_lookups_lock = threading.Lock()
+
+
+def _lookup(key, job):
+    try:
+        job[1] = socket.getaddrinfo(*key, type=socket.SOCK_STREAM)
+    except OSError as e:
+        job[1] = e
+    finally:
+        with _lookups_lock:
+            _lookups.pop(key, None)
+        job[0].set()
+
+
+def resolve(host: str, port: int, timeout: float):
+    """getaddrinfo() with a bounded wait.
+
+    The system resolver has no timeout of its own and can block for 5-30 s
+    when DNS is down, so the lookup runs on a daemon thread. A lookup that is
+    still hanging is joined by later callers rather than started again.
+    """
+    key = (host, port)
+    with _lookups_lock:
+        job = _lookups.get(key)
+        if job is None:
+            job = _lookups[key] = [threading.Event(), None]
+            threading.Thread(target=_lookup, args=(key, job), name=f"resolve-{host}", daemon=True).start()
+    if not job[0].wait(timeout):
+        raise TimeoutError(f"no answer within {timeout:g}s")
+    if isinstance(job[1], OSError):
+        raise job[1]
+    return job[1]
+
+
+def probe(host: str, port: int, timeout: float = 1.0):
+    """Fast-fail reachability check (DNS + TCP connect). Returns (ok, reason)."""
+    try:
+        infos = resolve(host, port, timeout)
+    except OSError as e:  # TimeoutError included
+        return False, f"dns: {e}"
+    last_err = "no address"
+    for family, socktype, proto, _, addr in infos:
+        s = socket.socket(family, socktype, proto)
+        s.settimeout(timeout)
+        try:
+            s.connect(addr)
+            return True, ""
+        except OSError as e:
+            last_err = f"connect: {e}"
+        finally:
+            s.close()
+    return False, last_err
+
+
+class ServiceHealth:
+    """Reachability + circuit breaker for a single upstream service."""
+
+    def __init__(self, name: str, host: str, port: int, failure_threshold: int = 3, cooldown: float = 60.0):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.reachable = None  # unknown until first probe
+        self.checked_at = 0.0
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = ""
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def check(self, timeout: float):
+        with span(f"probe.{self.name}") as s:
+            ok, reason = probe(self.host, self.port, timeout)
+            if not ok:
+                s.fail(reason, outcome="unreachable")
+        self.update_probe(ok, reason)
+
+    def update_probe(self, ok: bool, reason: str = ""):
+        with self._lock:
+            self.reachable = ok
+            self.checked_at = time.time()
+            if not ok:
+                self.last_error = reason
+
+    def allow(self) -> bool:
+        """True if a real call may be attempted now (closed, or a half-open trial)."""
+        with self._lock:
+            if self.reachable is False:
+                return False
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, reason: str = ""):
+        with self._lock:
+            self.failures += 1
+            self.last_error = reason or self.last_error
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def release(self):
+        """End a half-open trial without an outcome (the call was abandoned)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "reachable": self.reachable,
+                "state": self.state,
+                "failures": self.failures,
+                "checked_at": self.checked_at,
+                "last_error": self.last_error,
+            }
+
+
+class ConnectivityMonitor:
+    """Probes all services in a daemon thread every ``ttl`` seconds.
+
+    Readers never block on the network, except the very first call in a
+    process, which waits at most ``probe_timeout`` for the initial probe.
+    """
+
+    def __init__(self, services: dict = None, ttl: float = 30.0, probe_timeout: float = 1.0,
+                 failure_threshold: int = 3, cooldown: float = 60.0):
+        services = services or SERVICES
+        self.ttl = ttl
+        self.probe_timeout = probe_timeout
+        self.services = {
+            name: ServiceHealth(name, host, port, failure_threshold, cooldown)
+            for name, (host, port) in services.items()
+        }
+        self._first_probe = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="connectivity-probe", daemon=True)
+                self._thread.start()
+
+    def refresh(self):
+        """Ask the prober to re-check immediately (non-blocking)."""
+        self._wake.set()
+
+    def probe_all(self):
+        threads = []
+        for svc in self.services.values():
+            t = threading.Thread(target=svc.check, args=(self.probe_timeout,), daemon=True)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join(self.probe_timeout * 2 + 1.0)
+        self._first_probe.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.probe_all()
+            except Exception:
+                self._first_probe.set()
+            self._wake.wait(self.ttl)
+            self._wake.clear()
+
+    def _ensure_started(self):
+        self.start()
+        self._first_probe.wait(self.probe_timeout * 2)
+
+    def is_online(self) -> bool:
+        with span("is_online"):
+            self._ensure_started()  # only the first call in a process can wait
+            return bool(self.services["internet"].reachable)
+
+    def available(self, service: str) -> bool:
+        """True if ``service`` is reachable and its circuit breaker lets a call through."""
+        self._ensure_started()
+        svc = self.services.get(service)
+        return svc.allow() if svc else self.is_online()
+
+    def record_success(self, service: str):
+        svc = self.services.get(service)
+        if svc:
+            svc.record_success()
+
+    def record_failure(self, service: str, reason: str = ""):
+        svc = self.services.get(service)
+        if svc:
+            svc.record_failure(reason)
+
+    def release(self, service: str):
+        svc = self.services.get(service)
+        if svc:
+            svc.release()
+
+    def status(self) -> dict:
+        return {name: svc.snapshot() for name, svc in self.services.items()}
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_monitor() -> ConnectivityMonitor:
+    """Process-wide monitor shared across Streamlit sessions."""
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = ConnectivityMonitor(
+                ttl=Config.NETWORK_PROBE_TTL,
+                probe_timeout=Config.NETWORK_PROBE_TIMEOUT,
+                failure_threshold=Config.BREAKER_FAILURE_THRESHOLD,
+                cooldown=Config.BREAKER_COOLDOWN,
+            )
+        return _monitor
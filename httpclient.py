@@ -0,0 +1,177 @@
+# httpclient.py
+"""The app's one HTTP client: pooled keep-alive sessions, per-upstream rate
+limits, retries with jittered backoff and conditional GETs.
+
+- One ``requests.Session`` per host, so connections to Nominatim, Unsplash,
+  the image CDN and the tile server are each reused across calls and
+  threads.
+- Token buckets keyed by upstream URL prefix (Nominatim's usage policy is
+  one request per second). A request that would wait longer than its
+  timeout for a token fails with :class:`RateLimited` instead.
+- Connection errors, timeouts, 429 and 5xx are retried with full-jitter
+  exponential backoff; ``Retry-After`` is honoured up to the backoff cap.
+- ``validators`` (from :func:`validators_of` on an earlier response) make a
+  GET conditional (``If-None-Match`` / ``If-Modified-Since``), so re-downloads
+  of unchanged files come back as an empty 304.
+
+``requests`` is imported on first use so reruns that never touch the
+network don't pay for it. HTTP/2 is not used: ``requests`` has no support
+for it and the upstreams are served fine over keep-alive HTTP/1.1.
+"""
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from config import Config
+from tracing import observe
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RateLimited(Exception):
+    """No rate-limit token became available within the request timeout."""
+
+
+class TokenBucket:
+    """``rate`` tokens per second, at most ``burst`` saved up."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> float:
+        """Take a token; returns how long to sleep before using it, or -1 if that exceeds ``max_wait``."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if wait > max_wait:
+                return -1.0
+            self.tokens -= 1  # may go negative: later callers queue behind this one
+            return wait
+
+
+def validators_of(response) -> dict:
+    """ETag / Last-Modified of a response, for a later conditional GET."""
+    out = {}
+    if response.headers.get("ETag"):
+        out["etag"] = response.headers["ETag"]
+    if response.headers.get("Last-Modified"):
+        out["last_modified"] = response.headers["Last-Modified"]
+    return out
+
+
+def _retry_after(response, cap: float):
+    try:
+        return min(float(response.headers.get("Retry-After", "")), cap)
+    except ValueError:
+        return None
+
+
+class HttpClient:
+    def __init__(self, limits: dict = None, retries: int = 2, backoff: float = 0.5,
+                 backoff_cap: float = 8.0, pool_size: int = 16):
+        # url prefix -> (name, bucket); longest prefix wins
+        self.limits = sorted(
+            ((prefix, name, TokenBucket(rate, burst)) for name, (prefix, rate, burst) in (limits or {}).items()),
+            key=lambda t: -len(t[0]),
+        )
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str):
+        """Keep-alive session for the URL's host."""
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            s = self._sessions.get(host)
+            if s is None:
+                import requests
+
+                s = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                s.mount(host, adapter)
+                s.headers["User-Agent"] = "ai-tour-guide"
+                self._sessions[host] = s
+            return s
+
+    def _throttle(self, url: str, max_wait: float):
+        for prefix, name, bucket in self.limits:
+            if url.startswith(prefix):
+                wait = bucket.reserve(max_wait)
+                if wait < 0:
+                    raise RateLimited(f"{name}: rate limit")
+                if wait:
+                    observe(f"http.rate_wait.{name}", wait)
+                    time.sleep(wait)
+                return
+
+    def _sleep_before_retry(self, attempt: int, response=None):
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff * 2 ** attempt))
+        if response is not None:
+            delay = max(delay, _retry_after(response, self.backoff_cap) or 0.0)
+        time.sleep(delay)
+
+    def get(self, url: str, params: dict = None, headers: dict = None, timeout: float = 10,
+            validators: dict = None, retries: int = None):
+        """GET with rate limiting and retries. Returns the last response; raises on transport errors."""
+        import requests
+
+        headers = dict(headers or {})
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        retries = self.retries if retries is None else retries
+        session = self.session(url)
+        for attempt in range(retries + 1):
+            self._throttle(url, timeout)
+            try:
+                r = session.get(url, params=params, headers=headers, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+                self._sleep_before_retry(attempt)
+                continue
+            if r.status_code in RETRY_STATUS and attempt < retries:
+                self._sleep_before_retry(attempt, r)
+                continue
+            return r
+
+
+def _prefix(url: str) -> str:
+    """Fixed part of an upstream URL (tile templates stop at the first placeholder)."""
+    return url.split("{", 1)[0]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """Process-wide client shared by every service module and worker thread."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(
+                limits={
+                    "nominatim": (_prefix(Config.NOMINATIM_URL), Config.NOMINATIM_RATE, 1),
+                    "unsplash": (_prefix(Config.UNSPLASH_API_URL), Config.UNSPLASH_RATE, Config.UNSPLASH_RATE),
+                    "tiles": (_prefix(Config.TILE_URL), Config.TILE_RATE, Config.TILE_RATE),
+                },
+                retries=Config.HTTP_RETRIES,
+                backoff=Config.HTTP_BACKOFF,
+                backoff_cap=Config.HTTP_BACKOFF_CAP,
+                pool_size=Config.HTTP_POOL_SIZE,
+            )
+        return _client
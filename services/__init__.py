@@ -0,0 +1,12 @@
+# services/__init__.py
+"""Service layer behind ``streamlit_app.py``.
+
+- ``services.ai``       OpenAI chat replies + reply cache
+- ``services.tts``      gTTS synthesis and the audio cache
+- ``services.geo``      geocoding, city recognition, POIs, map tiles and images
+- ``services.storage``  saved cities, downloads, thumbnails, conversation logs
+
+Nothing is imported here on purpose: the app imports the modules it needs,
+and heavy third-party packages (openai, gTTS, requests, folium) are only
+imported inside the functions that use them.
+"""
@@ -0,0 +1,323 @@
+# services/ai.py
+"""OpenAI replies with a shared client, an LRU/TTL reply cache and
+request coalescing.
+
+Identical questions ("Tell me about Mysuru" asked by many tourists) are
+answered from the cache; when several sessions ask the same question at the
+same moment only one upstream completion is made and the others wait for it.
+The in-memory LRU is backed by the shared storage backend, so replicas
+reuse each other's answers.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from config import Config
+from connectivity import get_monitor
+from services.retrieval import grounding
+from services.storage.backend import get_backend
+from tracing import observe, span
+from utils import safe_key
+
+
+def normalize_intent(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+
+class ReplyCache:
+    """Thread-safe LRU cache with per-entry TTL and hit/miss counters.
+
+    With a ``backend`` misses fall through to it and puts are written
+    through, so answers made by other processes are reused.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 6 * 3600, backend=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _shared_key(key) -> str:
+        return "replies/" + hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()[:32]
+
+    def get(self, key, count: bool = True):
+        """Cached value or None; ``count=False`` leaves the hit/miss counters alone (re-checks)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] >= time.time():
+                self._data.move_to_end(key)
+                self.hits += count
+                return entry[1]
+            self._data.pop(key, None)
+        value = self._get_shared(key)
+        with self._lock:
+            if value is None:
+                self.misses += count
+                return None
+            self.hits += count
+            self._remember(key, value)
+            return value
+
+    def note_coalesced(self):
+        with self._lock:
+            self.coalesced += 1
+
+    def _get_shared(self, key):
+        if self.backend is None:
+            return None
+        try:
+            raw = self.backend.get(self._shared_key(key))
+        except Exception:
+            return None  # a shared-cache outage only costs a completion
+        return raw.decode("utf-8") if raw else None
+
+    def _remember(self, key, value):
+        self._data[key] = (time.time() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        if self.backend is not None:
+            try:
+                self.backend.set(self._shared_key(key), value.encode("utf-8"), ttl=self.ttl)
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_inflight = {}  # key -> Future
+_inflight_lock = threading.Lock()
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Module-level OpenAI client; its underlying HTTP pool is reused across calls.
+
+    ``openai`` takes about half a second to import, so that happens here on
+    the first online request rather than at app start.
+    """
+    global _client
+    if not Config.OPENAI_API_KEY:
+        return None
+    with _client_lock:
+        if _client is None:
+            # Optional import (graceful fallback)
+            try:
+                from openai import OpenAI
+            except Exception:
+                return None
+            _client = OpenAI(
+                api_key=Config.OPENAI_API_KEY, base_url=Config.OPENAI_BASE_URL, max_retries=1, timeout=30.0
+            )
+        return _client
+
+
+def get_reply_cache() -> ReplyCache:
+    """Process-wide reply cache, created (with its storage backend) on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ReplyCache(maxsize=Config.REPLY_CACHE_SIZE, ttl=Config.REPLY_CACHE_TTL, backend=get_backend())
+        return _cache
+
+
+def cache_stats() -> dict:
+    return get_reply_cache().stats()
+
+
+def _messages(city: str, user_text: str):
+    # grounding passages from the offline index keep the prompt short and factual
+    prompt = (
+        f"Local tour guide for {city}. Question: '{user_text}'. "
+        "Give 3 concise, actionable tips (food, sights, a hidden gem), then one short follow-up question."
+    )
+    notes = grounding(city, user_text)
+    if notes:
+        prompt += f"\nUse these local notes where relevant:\n{notes}"
+    return [{"role": "user", "content": prompt}]
+
+
+def _complete(client, city: str, user_text: str, model: str):
+    resp = client.chat.completions.create(
+        model=model,
+        messages=_messages(city, user_text),
+        max_tokens=Config.REPLY_MAX_TOKENS,
+        temperature=0.8,
+    )
+    try:
+        return resp.choices[0].message.content.strip()
+    except Exception:
+        try:
+            return resp.choices[0].text.strip()
+        except Exception:
+            return str(resp)
+
+
+def _claim(key):
+    """Return (future, owner). Non-owners should wait on the owner's future."""
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        if fut is None:
+            fut = Future()
+            _inflight[key] = fut
+            return fut, True
+    get_reply_cache().note_coalesced()
+    return fut, False
+
+
+def _release(key, fut, reply, store: bool = True):
+    if reply and store:
+        get_reply_cache().put(key, reply)
+    with _inflight_lock:
+        _inflight.pop(key, None)
+    fut.set_result(reply)
+
+
+def _wait(fut):
+    try:
+        return fut.result(timeout=60)
+    except Exception:
+        return None
+
+
+def gpt_reply(city: str, user_text: str, model: str = "gpt-3.5-turbo"):
+    """Call OpenAI ChatCompletion (if available). Returns string or None."""
+    client = get_client()
+    if client is None:
+        return None
+    key = (safe_key(city or ""), normalize_intent(user_text), model)
+    with span("openai") as s:
+        cached = get_reply_cache().get(key)
+        if cached is not None:
+            s.set("cache_hit")
+            return cached
+
+        fut, owner = _claim(key)
+        if not owner:
+            s.set("coalesced")
+            return _wait(fut)
+        # the previous owner may have cached its answer between our miss and the claim
+        cached = get_reply_cache().get(key, count=False)
+        if cached is not None:
+            _release(key, fut, cached, store=False)
+            s.set("cache_hit")
+            return cached
+
+        reply = None
+        try:
+            monitor = get_monitor()
+            if not monitor.available("openai"):
+                s.set("unavailable")
+            else:
+                try:
+                    reply = _complete(client, city, user_text, model)
+                    monitor.record_success("openai")
+                except Exception as e:
+                    monitor.record_failure("openai", str(e))
+                    s.fail(e)
+        finally:
+            _release(key, fut, reply)
+        return reply
+
+
+def gpt_reply_stream(city: str, user_text: str, model: str = "gpt-3.5-turbo"):
+    """Streaming variant of gpt_reply(): yields text chunks as they arrive.
+
+    Cached or coalesced answers are yielded as a single chunk. Yields nothing
+    if the model is unavailable, so callers can fall back to offline info.
+    """
+    client = get_client()
+    if client is None:
+        return
+    key = (safe_key(city or ""), normalize_intent(user_text), model)
+    # the span includes time the caller spends rendering chunks;
+    # openai.first_chunk is the upstream's share
+    with span("openai.stream") as s:
+        cached = get_reply_cache().get(key)
+        if cached is not None:
+            s.set("cache_hit")
+            yield cached
+            return
+
+        fut, owner = _claim(key)
+        if not owner:
+            s.set("coalesced")
+            reply = _wait(fut)
+            if reply:
+                yield reply
+            return
+        # the previous owner may have cached its answer between our miss and the claim
+        cached = get_reply_cache().get(key, count=False)
+        if cached is not None:
+            _release(key, fut, cached, store=False)
+            s.set("cache_hit")
+            yield cached
+            return
+
+        parts = []
+        reply = None  # only a fully received answer is cached
+        try:
+            monitor = get_monitor()
+            if not monitor.available("openai"):
+                s.set("unavailable")
+                return
+            recorded = False
+            try:
+                started = time.perf_counter()
+                stream = client.chat.completions.create(
+                    model=model,
+                    messages=_messages(city, user_text),
+                    max_tokens=Config.REPLY_MAX_TOKENS,
+                    temperature=0.8,
+                    stream=True,
+                )
+                for event in stream:
+                    try:
+                        delta = event.choices[0].delta.content
+                    except Exception:
+                        delta = None
+                    if delta:
+                        if not parts:
+                            observe("openai.first_chunk", time.perf_counter() - started)
+                        parts.append(delta)
+                        yield delta
+                monitor.record_success("openai")
+                recorded = True
+                reply = "".join(parts).strip() or None
+            except Exception as e:
+                monitor.record_failure("openai", str(e))
+                recorded = True
+                s.fail(e)
+            finally:
+                if not recorded:
+                    # the caller stopped reading (GeneratorExit): free a half-open trial
+                    monitor.release("openai")
+                    s.set("abandoned")
+        finally:
+            _release(key, fut, reply)
@@ -0,0 +1,2 @@
+# services/geo/__init__.py
+"""Geocoding, city recognition, nearby places, offline map tiles and static maps."""
@@ -0,0 +1,185 @@
+# services/geo/cityner.py
+"""City recognition for chat messages.
+
+All known names (built-in, bundled and saved cities with their aliases, as
+collected by the offline bundle) are compiled once into an Aho–Corasick
+automaton, so a message is scanned in a single pass regardless of how many
+cities exist. Common transliteration variants (Mysore/Mysuru,
+Bangalore/Bengaluru, ...) are added as aliases, and a fuzzy pass catches
+near-misses such as "mysoore". Unknown places still fall back to an
+"in/at/around <place>" pattern, trimmed at filler words.
+"""
+import difflib
+import re
+import threading
+from collections import deque
+
+# spelling variant -> canonical key
+VARIANTS = {
+    "bangalore": "bengaluru",
+    "bengalooru": "bengaluru",
+    "mysore": "mysuru",
+    "mangalore": "mangaluru",
+    "kodagu": "coorg",
+    "madikeri": "coorg",
+    "chikkamagaluru": "chikmagalur",
+    "chikmagaluru": "chikmagalur",
+    "chickmagalur": "chikmagalur",
+}
+
+# words that end a free-form "in <place>" capture
+STOPWORDS = {
+    "today", "tomorrow", "tonight", "please", "now", "for", "with", "and", "or",
+    "this", "next", "during", "on", "the", "a", "an", "to", "from", "near", "by",
+    "weekend", "week", "morning", "evening", "night", "trip", "visit", "me", "us",
+}
+
+PLACE_PATTERN = re.compile(r"\b(?:in|at|around)\s+([a-z][a-z\s]*)")
+
+
+def normalize(text: str) -> str:
+    """Lowercase and collapse everything that is not a letter/digit into single spaces."""
+    return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+
+class AhoCorasick:
+    """Minimal Aho–Corasick automaton over characters."""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pat in patterns:
+            self._add(pat)
+        self._build()
+
+    def _add(self, pat: str):
+        node = 0
+        for ch in pat:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(pat)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter(self, text: str):
+        """Yield (end_index, pattern) for every occurrence."""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for pat in self._out[node]:
+                yield i, pat
+
+
+class CityMatcher:
+    """Gazetteer matcher mapping any known name/alias to its canonical key."""
+
+    def __init__(self, names: dict, fuzzy_cutoff: float = 0.82):
+        # names: normalized alias -> canonical key
+        self.names = {normalize(k): v for k, v in names.items() if normalize(k)}
+        self.fuzzy_cutoff = fuzzy_cutoff
+        # pad with spaces so only whole words match
+        self._automaton = AhoCorasick(f" {n} " for n in self.names)
+        # fuzzy candidates bucketed by first letter; only similar lengths are compared
+        self._fuzzy_pool = {}
+        for n in self.names:
+            if len(n) >= 4:
+                self._fuzzy_pool.setdefault(n[0], []).append(n)
+
+    def find_all(self, text: str):
+        """Return [(start, end, canonical, alias)] over the normalized text."""
+        padded = f" {normalize(text)} "
+        hits = []
+        for end, pat in self._automaton.iter(padded):
+            alias = pat.strip()
+            start = end - len(pat) + 1
+            hits.append((start, end, self.names[alias], alias))
+        return hits
+
+    def fuzzy(self, text: str):
+        words = [w for w in normalize(text).split() if len(w) >= 4 and w not in STOPWORDS]
+        grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        best, best_score = None, self.fuzzy_cutoff
+        sm = difflib.SequenceMatcher()
+        for g in grams:
+            sm.set_seq2(g)
+            for cand in self._fuzzy_pool.get(g[0], ()):
+                if abs(len(cand) - len(g)) > 2:
+                    continue
+                sm.set_seq1(cand)
+                if sm.real_quick_ratio() < best_score or sm.quick_ratio() < best_score:
+                    continue
+                score = sm.ratio()
+                if score >= best_score:
+                    best, best_score = self.names[cand], score
+        return best
+
+    def match(self, text: str):
+        """Canonical key of the best city in ``text`` (longest exact hit, then fuzzy)."""
+        hits = self.find_all(text)
+        if hits:
+            # longest alias wins; ties go to the earliest mention
+            hits.sort(key=lambda h: (-len(h[3]), h[0]))
+            return hits[0][2]
+        return self.fuzzy(text)
+
+
+def extract_place(text: str):
+    """Free-form "in/at/around <place>" capture, stopped at filler words (max 3 words)."""
+    m = PLACE_PATTERN.search(normalize(text))
+    if not m:
+        return None
+    words = []
+    for w in m.group(1).split():
+        if w in STOPWORDS or len(words) == 3:
+            break
+        words.append(w)
+    return " ".join(words) or None
+
+
+def build_names(known: dict = None) -> dict:
+    """alias -> canonical key: the offline bundle's names plus the spelling variants."""
+    names = dict(known or {})
+    for variant, canonical in VARIANTS.items():
+        names[variant] = canonical
+    return names
+
+
+def detect_city(text: str, matcher: CityMatcher):
+    """Known city from the gazetteer, else the free-form "in <place>" capture."""
+    return matcher.match(text) or extract_place(text)
+
+
+_matcher = None
+_matcher_version = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher(bundle) -> CityMatcher:
+    """Process-wide matcher over ``bundle`` (built-in, bundled and saved cities),
+    rebuilt only when the bundle version changes."""
+    global _matcher, _matcher_version
+    version = bundle.version
+    with _matcher_lock:
+        if _matcher is None or _matcher_version != version:
+            _matcher = CityMatcher(build_names(bundle.names()))
+            _matcher_version = version
+        return _matcher
@@ -0,0 +1,142 @@
+# services/geo/geocoding.py
+"""Nominatim geocoding behind a persistent SQLite cache.
+
+Positive results are kept for ``GEOCODE_TTL`` seconds, "no such place" answers
+for ``GEOCODE_NEGATIVE_TTL``; coordinates from the offline bundle are seeded
+without expiry so the built-in cities resolve with no network. Lookups are
+served from an in-memory mirror of the table.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+from connectivity import get_monitor
+from httpclient import RateLimited, get_http_client
+from services.storage.bundle import get_bundle
+from tracing import span
+from utils import safe_key
+
+
+class GeocodeCache:
+    """SQLite-backed (lat, lon) cache keyed by ``safe_key(city)``."""
+
+    def __init__(self, path: str, ttl: float = 30 * 86400, negative_ttl: float = 86400):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            " key TEXT PRIMARY KEY, lat REAL, lon REAL,"
+            " source TEXT, updated_at REAL, expires_at REAL)"
+        )
+        self._db.commit()
+        # key -> (lat, lon, expires_at); lat/lon are None for negative entries
+        self._mem = {
+            k: (lat, lon, exp)
+            for k, lat, lon, exp in self._db.execute("SELECT key, lat, lon, expires_at FROM geocode")
+        }
+
+    def get(self, key: str):
+        """Return (hit, (lat, lon)). Expired entries count as misses."""
+        entry = self._mem.get(key)
+        if entry is None:
+            return False, (None, None)
+        lat, lon, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            return False, (None, None)
+        return True, (lat, lon)
+
+    def put(self, key: str, lat, lon, source: str = "nominatim", permanent: bool = False):
+        now = time.time()
+        if permanent:
+            expires_at = None
+        else:
+            expires_at = now + (self.ttl if lat is not None else self.negative_ttl)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO geocode (key, lat, lon, source, updated_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, lat, lon, source, now, expires_at),
+            )
+            self._db.commit()
+            self._mem[key] = (lat, lon, expires_at)
+
+    def seed_from_bundle(self, entries):
+        """Load offline-bundle coordinates (key, display name and aliases)."""
+        seeded = 0
+        for entry in entries:
+            lat, lon = entry.get("lat"), entry.get("lon")
+            if lat is None or lon is None:
+                continue
+            for name in {entry["key"], entry.get("name", ""), *entry.get("aliases", [])}:
+                key = safe_key(name)
+                if key and key not in self._mem:
+                    self.put(key, float(lat), float(lon), source="bundled", permanent=True)
+                    seeded += 1
+        return seeded
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_geocode_cache() -> GeocodeCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GeocodeCache(
+                os.path.join(Config.DATA_DIR, "geocode.sqlite"),
+                ttl=Config.GEOCODE_TTL,
+                negative_ttl=Config.GEOCODE_NEGATIVE_TTL,
+            )
+            _cache.seed_from_bundle(get_bundle().entries())
+        return _cache
+
+
+def geocode_city(city: str):
+    """Return (lat, lon), from cache or Nominatim. Returns (None, None) on failure."""
+    key = safe_key(city or "")
+    if not key:
+        return None, None
+    with span("geocode") as s:
+        cache = get_geocode_cache()
+        hit, coords = cache.get(key)
+        if hit:
+            s.set("cache_hit")
+            return coords
+        monitor = get_monitor()
+        if not monitor.available("nominatim"):
+            s.set("unavailable")
+            return None, None
+        try:
+            r = get_http_client().get(
+                Config.NOMINATIM_URL,
+                params={"q": city, "format": "json", "limit": 1},
+                headers={"User-Agent": "ai-tour-guide"},
+                timeout=8,
+            )
+            r.raise_for_status()
+            data = r.json()
+            monitor.record_success("nominatim")
+        except RateLimited as e:
+            # our own request budget, not an upstream fault: leave the breaker alone
+            s.fail(e, outcome="rate_limited")
+            monitor.release("nominatim")  # a half-open trial was never made
+            return None, None
+        except Exception as e:
+            # transient failure: don't cache, let the breaker decide when to retry
+            monitor.record_failure("nominatim", str(e))
+            s.fail(e)
+            return None, None
+        if data:
+            lat, lon = float(data[0]["lat"]), float(data[0]["lon"])
+            cache.put(key, lat, lon)
+            return lat, lon
+        s.set("not_found")
+        cache.put(key, None, None)
+        return None, None
@@ -0,0 +1,273 @@
+# services/geo/itinerary.py
+"""Offline itinerary planner over the places in the offline bundle.
+
+Each city's places (``data/offline_data.json`` plus saved cities, as flattened
+by :func:`services.geo.poi.load_records`) are packed into arrays and their
+pairwise great-circle distance matrix is computed once, vectorized, and kept
+until the bundle version changes. :func:`plan_itinerary` then orders a
+selection of places into day routes:
+
+- nearest-neighbour from the start point, improved with 2-opt (each pass
+  scores every segment reversal for one position as a single NumPy
+  expression) until no reversal shortens the route; routes of up to
+  ``EXACT_MAX_STOPS`` stops (a typical day) are instead solved exactly by
+  scoring every ordering at once;
+- with several days the tour is cut into contiguous, similarly sized legs
+  (neighbouring stops stay together) and each day is re-optimized from the
+  start point (the hotel, the user's position or the city centre);
+- plans are cached per (bundle version, city, start, selection, days).
+
+Distances are straight-line, so legs are estimates; durations assume
+``ITINERARY_SPEED_KMH`` plus ``ITINERARY_VISIT_MINUTES`` per stop.
+"""
+import itertools
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import Config
+from services.geo.poi import EARTH_RADIUS_KM, bearing, haversine_km, load_records
+from services.storage.bundle import get_bundle
+from tracing import span
+from utils import safe_key
+
+ITINERARY_PATTERN = re.compile(
+    r"\b(itinerary|itineraries|route|plan (?:my|a|the|our) (?:day|days|trip|visit|tour)|day plan|\d+[- ]?days?)\b"
+)
+DAYS_PATTERN = re.compile(r"\b(\d+|one|two|three|four|five)[- ]?days?\b")
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5}
+MAX_DAYS = 7
+EXACT_MAX_STOPS = 7  # 7! = 5040 orderings, scored in one pass
+
+
+def distance_matrix(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Pairwise great-circle distances in km (all points against all, one broadcast)."""
+    la, lo = np.radians(lats), np.radians(lons)
+    dlat = la[:, None] - la[None, :]
+    dlon = lo[:, None] - lo[None, :]
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(la)[:, None] * np.cos(la)[None, :] * np.sin(dlon / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def route_length(route: list, dist: np.ndarray) -> float:
+    return float(dist[route[:-1], route[1:]].sum()) if len(route) > 1 else 0.0
+
+
+def nearest_neighbour(dist: np.ndarray, start: int = 0) -> list:
+    """Open path from ``start`` that always moves to the closest unvisited node."""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    route = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[route[-1]])
+        nxt = int(np.argmin(row))
+        route.append(nxt)
+        visited[nxt] = True
+    return route
+
+
+def two_opt(route: list, dist: np.ndarray, max_passes: int = 50) -> list:
+    """Improve an open path (first node fixed) by reversing segments while that shortens it."""
+    route = np.array(route, dtype=np.int64)
+    n = len(route)
+    if n < 4:
+        return route.tolist()
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            # reverse route[i..j] for every j > i at once: edges (a,b) and (c,e) become (a,c) and (b,e)
+            a, b = route[i - 1], route[i]
+            c = route[i + 1:]
+            e = np.append(route[i + 2:], -1)
+            has_e = e >= 0
+            e = np.where(has_e, e, 0)
+            delta = dist[a, c] - dist[a, b] + np.where(has_e, dist[b, e] - dist[c, e], 0.0)
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-9:
+                j += i + 1
+                route[i:j + 1] = route[i:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return route.tolist()
+
+
+def exact_route(dist: np.ndarray, start: int = 0) -> list:
+    """Shortest open path from ``start`` by scoring every ordering of the other nodes."""
+    others = [i for i in range(len(dist)) if i != start]
+    if len(others) < 2:
+        return [start] + others
+    perms = np.array(list(itertools.permutations(others)), dtype=np.int64)
+    lengths = dist[start, perms[:, 0]] + dist[perms[:, :-1], perms[:, 1:]].sum(axis=1)
+    return [start] + perms[int(np.argmin(lengths))].tolist()
+
+
+def solve_route(dist: np.ndarray, start: int = 0) -> list:
+    if len(dist) - 1 <= EXACT_MAX_STOPS:
+        return exact_route(dist, start)
+    return two_opt(nearest_neighbour(dist, start), dist)
+
+
+class CityPlaces:
+    """One city's places and their precomputed distance matrix."""
+
+    def __init__(self, key: str, records: list):
+        self.key = key
+        self.centre = next((r for r in records if r["category"] == "city"), None)
+        self.places = [r for r in records if r["category"] != "city"]
+        self.lats = np.array([r["lat"] for r in self.places], dtype=np.float64)
+        self.lons = np.array([r["lon"] for r in self.places], dtype=np.float64)
+        self.matrix = distance_matrix(self.lats, self.lons)
+
+    def select(self, selection=None) -> np.ndarray:
+        """Row indices for place names and/or categories in ``selection`` (all places if empty)."""
+        if not selection:
+            return np.arange(len(self.places), dtype=np.int64)
+        wanted = {s.lower() for s in selection}
+        return np.array([i for i, p in enumerate(self.places)
+                         if p["name"].lower() in wanted or p["category"].lower() in wanted], dtype=np.int64)
+
+    def with_origin(self, idx: np.ndarray, lat: float, lon: float) -> np.ndarray:
+        """Distance matrix over ``idx`` with the start point prepended as node 0."""
+        sub = self.matrix[np.ix_(idx, idx)]
+        origin = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        full = np.zeros((len(idx) + 1, len(idx) + 1))
+        full[1:, 1:] = sub
+        full[0, 1:] = full[1:, 0] = origin
+        return full
+
+
+class ItineraryPlanner:
+    def __init__(self, cache_size: int = 256):
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cities = {}
+        self._version = None
+        self._plans = OrderedDict()
+
+    def _places(self, bundle, key: str):
+        with self._lock:
+            if bundle.version != self._version:
+                self._cities, self._version = {}, bundle.version
+                self._plans.clear()
+            if key not in self._cities:
+                entry = bundle.city(key)
+                records = load_records([entry]) if entry else []
+                self._cities[key] = CityPlaces(entry["key"], records) if entry else None
+            return self._cities[key]
+
+    def plan(self, city: str, start=None, selection=None, days: int = 1):
+        """Day routes over ``city``'s places, or None if the city has no places with coordinates.
+
+        ``start`` is ``(lat, lon, label)`` (defaults to the city centre);
+        ``selection`` limits the stops to those place names or categories.
+        """
+        bundle = get_bundle()
+        places = self._places(bundle, safe_key(city))
+        if places is None or not places.places:
+            return None
+        if start is None:
+            centre = places.centre or places.places[0]
+            start = (centre["lat"], centre["lon"], centre["name"])
+        lat, lon, label = start
+        days = max(1, min(int(days or 1), MAX_DAYS))
+        sel = tuple(sorted(s.lower() for s in selection)) if selection else None
+        cache_key = (bundle.version, places.key, round(lat, 4), round(lon, 4), sel, days)
+        with self._lock:
+            cached = self._plans.get(cache_key)
+            if cached is not None:
+                self._plans.move_to_end(cache_key)
+        with span("itinerary") as s:
+            if cached is not None:
+                s.set("cache_hit")
+                return cached
+            idx = places.select(sel)
+            if not len(idx):
+                s.set("empty")
+                return None
+            result = self._solve(places, idx, lat, lon, label, days)
+        with self._lock:
+            self._plans[cache_key] = result
+            while len(self._plans) > self.cache_size:
+                self._plans.popitem(last=False)
+        return result
+
+    def _solve(self, places: CityPlaces, idx: np.ndarray, lat: float, lon: float, label: str, days: int) -> dict:
+        full = places.with_origin(idx, lat, lon)
+        tour = solve_route(full)[1:]  # drop the start node
+        days = min(days, len(tour))
+        out = []
+        for chunk in np.array_split(np.array(tour, dtype=np.int64), days):
+            nodes = [0] + chunk.tolist()
+            sub = full[np.ix_(nodes, nodes)]
+            order = [nodes[k] for k in solve_route(sub)]
+            stops, prev, km = [], 0, 0.0
+            for node in order[1:]:
+                place = places.places[int(idx[node - 1])]
+                leg = float(full[prev, node])
+                km += leg
+                here = (lat, lon) if prev == 0 else (stops[-1]["lat"], stops[-1]["lon"])
+                stops.append(dict(place, leg_km=leg, bearing=bearing(here[0], here[1], place["lat"], place["lon"])))
+                prev = node
+            out.append({"stops": stops, "km": km, "minutes": self._minutes(km, len(stops))})
+        total = sum(d["km"] for d in out)
+        return {
+            "city": places.key,
+            "start": {"name": label, "lat": lat, "lon": lon},
+            "days": out,
+            "km": total,
+            "minutes": sum(d["minutes"] for d in out),
+        }
+
+    @staticmethod
+    def _minutes(km: float, stops: int) -> int:
+        return int(round(km / Config.ITINERARY_SPEED_KMH * 60 + stops * Config.ITINERARY_VISIT_MINUTES))
+
+
+_planner = None
+_planner_lock = threading.Lock()
+
+
+def get_planner() -> ItineraryPlanner:
+    global _planner
+    with _planner_lock:
+        if _planner is None:
+            _planner = ItineraryPlanner(cache_size=Config.ITINERARY_CACHE_SIZE)
+        return _planner
+
+
+def plan_itinerary(city: str, start=None, selection=None, days: int = 1):
+    return get_planner().plan(city, start=start, selection=selection, days=days)
+
+
+def is_itinerary_query(text: str) -> bool:
+    return bool(ITINERARY_PATTERN.search((text or "").lower()))
+
+
+def parse_days(text: str) -> int:
+    m = DAYS_PATTERN.search((text or "").lower())
+    if not m:
+        return 1
+    word = m.group(1)
+    return max(1, min(NUMBER_WORDS.get(word) or int(word), MAX_DAYS))
+
+
+def _fmt_km(km: float) -> str:
+    return f"{km * 1000:.0f} m" if km < 1 else f"{km:.1f} km"
+
+
+def describe_itinerary(plan: dict, city_label: str) -> str:
+    """Chat-ready markdown for a plan from :func:`plan_itinerary`."""
+    lines = [f"Route for {city_label} from {plan['start']['name']} "
+             f"(about {_fmt_km(plan['km'])} straight-line):"]
+    for n, day in enumerate(plan["days"], start=1):
+        if len(plan["days"]) > 1:
+            lines.append(f"\n**Day {n}** — {_fmt_km(day['km'])}, about {day['minutes'] // 60} h {day['minutes'] % 60} min")
+        for i, stop in enumerate(day["stops"], start=1):
+            tip = f" — {stop['tip']}" if stop.get("tip") else ""
+            leg = "at the start" if stop["leg_km"] < 0.05 else f"{_fmt_km(stop['leg_km'])} {stop['bearing']}"
+            lines.append(f"{i}. **{stop['name']}** ({leg}){tip}")
+    return "\n".join(lines)
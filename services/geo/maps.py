@@ -0,0 +1,148 @@
+# services/geo/maps.py
+"""Static map images for offline display."""
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+from config import Config
+from services.geo.tiles import TILE_SIZE, deg2num, get_tile_store, viewport_tiles
+
+
+@lru_cache(maxsize=8)
+def _font(size: int):
+    """Load the label font once per size (None -> PIL's default bitmap font)."""
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except Exception:
+        return None
+
+
+def make_placeholder_map_image(city: str, lat=None, lon=None, dest_path: str = None, w=900, h=480) -> Image.Image:
+    """Create a simple placeholder 'map' image and optionally save it."""
+    img = Image.new("RGB", (w, h), (245, 245, 245))
+    draw = ImageDraw.Draw(img)
+    font = _font(22)
+    draw.text((20, 20), f"{city.title()}", fill=(30, 30, 30), font=font)
+    if lat is not None and lon is not None:
+        draw.text((20, 60), f"Coordinates: {lat:.5f}, {lon:.5f}", fill=(80, 80, 80), font=font)
+    # grid background to resemble a map
+    for x in range(20, w - 20, 60):
+        draw.line(((x, 120), (x, h - 20)), fill=(230, 230, 230))
+    for y in range(120, h - 20, 60):
+        draw.line(((20, y), (w - 20, y)), fill=(230, 230, 230))
+    if dest_path:
+        try:
+            img.save(dest_path)
+        except Exception:
+            pass
+    return img
+
+
+def render_static_map(city: str, lat: float, lon: float, zoom: int = None, w: int = None, h: int = None):
+    """Stitch cached tiles around (lat, lon) into an image with a marker.
+
+    Tries ``zoom`` first, then lower zoom levels, and uses the first one whose
+    centre tile is cached (gaps are left light grey). Returns None if nothing
+    is cached, so callers can use :func:`make_placeholder_map_image`.
+    """
+    zoom = zoom or Config.STATIC_MAP_ZOOM
+    dw, dh = Config.STATIC_MAP_SIZE
+    w, h = w or dw, h or dh
+    store = get_tile_store()
+    for z in range(zoom, Config.TILE_MIN_ZOOM - 1, -1):
+        cx, cy = deg2num(lat, lon, z)
+        if store.get(z, int(cx), int(cy)) is None:
+            continue
+        tiles, left, top = viewport_tiles(lat, lon, z, w, h)
+        img = Image.new("RGB", (w, h), (235, 235, 235))
+        for tz, x, y in tiles:
+            data = store.get(tz, x, y)
+            if data is None:
+                continue
+            try:
+                tile = Image.open(BytesIO(data)).convert("RGB")
+            except Exception:
+                continue
+            img.paste(tile, (int(x * TILE_SIZE - left), int(y * TILE_SIZE - top)))
+        draw = ImageDraw.Draw(img)
+        mx, my = w // 2, h // 2
+        draw.ellipse((mx - 9, my - 9, mx + 9, my + 9), fill=(220, 50, 50), outline=(255, 255, 255), width=3)
+        font = _font(18)
+        draw.rectangle((0, 0, w, 30), fill=(255, 255, 255))
+        draw.text((10, 5), f"{city.title()}  ({lat:.4f}, {lon:.4f})", fill=(30, 30, 30), font=font)
+        draw.text((w - 260, h - 18), "© OpenStreetMap © CARTO", fill=(90, 90, 90))
+        return img
+    return None
+
+
+ROUTE_COLOURS = [(40, 90, 200), (30, 150, 90), (200, 120, 20), (150, 60, 170)]
+
+
+def render_route_map(title: str, start, days: list, w: int = None, h: int = None) -> Image.Image:
+    """Numbered day routes over cached tiles (plain background where none are cached).
+
+    ``start`` is ``(lat, lon)`` and ``days`` a list of ``[(lat, lon), ...]``
+    stop lists, each drawn as its own line from the start. The highest zoom
+    that fits every point in the view is used.
+    """
+    w, h = (w, h) if w and h else Config.STATIC_MAP_SIZE
+    points = [start] + [p for day in days for p in day]
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    clat, clon = (min(lats) + max(lats)) / 2, (min(lons) + max(lons)) / 2
+    zoom = Config.TILE_MIN_ZOOM
+    for z in range(Config.TILE_MAX_ZOOM, Config.TILE_MIN_ZOOM - 1, -1):
+        x0, y0 = deg2num(max(lats), min(lons), z)
+        x1, y1 = deg2num(min(lats), max(lons), z)
+        if (x1 - x0) * TILE_SIZE <= w - 80 and (y1 - y0) * TILE_SIZE <= h - 100:
+            zoom = z
+            break
+    store = get_tile_store()
+    tiles, left, top = viewport_tiles(clat, clon, zoom, w, h)
+    img = Image.new("RGB", (w, h), (240, 240, 236))
+    for tz, x, y in tiles:
+        data = store.get(tz, x, y)
+        if data is None:
+            continue
+        try:
+            tile = Image.open(BytesIO(data)).convert("RGB")
+        except Exception:
+            continue
+        img.paste(tile, (int(x * TILE_SIZE - left), int(y * TILE_SIZE - top)))
+    draw = ImageDraw.Draw(img)
+
+    def px(p):
+        x, y = deg2num(p[0], p[1], zoom)
+        return x * TILE_SIZE - left, y * TILE_SIZE - top
+
+    font = _font(14)
+    n = 0
+    for d, day in enumerate(days):
+        colour = ROUTE_COLOURS[d % len(ROUTE_COLOURS)]
+        xy = [px(start)] + [px(p) for p in day]
+        draw.line(xy, fill=colour, width=4)
+        for x, y in xy[1:]:
+            n += 1
+            draw.ellipse((x - 11, y - 11, x + 11, y + 11), fill=colour, outline=(255, 255, 255), width=2)
+            draw.text((x - 4 * len(str(n)), y - 8), str(n), fill=(255, 255, 255), font=font)
+    x, y = px(start)
+    draw.ellipse((x - 11, y - 11, x + 11, y + 11), fill=(220, 50, 50), outline=(255, 255, 255), width=2)
+    draw.text((x - 4, y - 8), "S", fill=(255, 255, 255), font=font)
+    draw.rectangle((0, 0, w, 30), fill=(255, 255, 255))
+    draw.text((10, 5), title, fill=(30, 30, 30), font=_font(18))
+    draw.text((w - 260, h - 18), "© OpenStreetMap © CARTO", fill=(90, 90, 90))
+    return img
+
+
+def city_map_image(city: str, lat=None, lon=None, dest_path: str = None):
+    """Real static map from cached tiles when possible, else the placeholder."""
+    img = render_static_map(city, lat, lon) if lat is not None and lon is not None else None
+    if img is None:
+        return make_placeholder_map_image(city, lat, lon, dest_path=dest_path)
+    if dest_path:
+        try:
+            img.save(dest_path)
+        except Exception:
+            pass
+    return img
@@ -0,0 +1,192 @@
+# services/geo/poi.py
+"""Server-side points of interest with a spatial grid index.
+
+Cities and their places from the offline bundle (``data/offline_data.json``
+plus saved cities that have coordinates) are packed into NumPy arrays. A
+uniform lat/lon grid maps cells to row indices, so "nearest N" and radius
+queries only run the vectorized haversine over nearby cells instead of over
+the whole dataset.
+"""
+import math
+import re
+import threading
+
+import numpy as np
+
+from config import Config
+from services.storage.bundle import get_bundle
+
+EARTH_RADIUS_KM = 6371.0088
+DIRECTIONS = ["North", "North-East", "East", "South-East", "South", "South-West", "West", "North-West"]
+
+NEARBY_PATTERN = re.compile(r"\b(near me|nearby|around me|close to me|closest|nearest|what'?s near)\b")
+RADIUS_PATTERN = re.compile(r"\bwithin\s+(\d+(?:\.\d+)?)\s*(?:km|kilomet(?:er|re)s?)\b")
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Great-circle distance from one point to many (all in degrees)."""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bearing(lat1: float, lon1: float, lat2: float, lon2: float) -> str:
+    """Compass direction from point 1 to point 2 (same scheme as static/js/gps.js)."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dl = math.radians(lon2 - lon1)
+    y = math.sin(dl) * math.cos(p2)
+    x = math.cos(p1) * math.sin(p2) - math.sin(p1) * math.cos(p2) * math.cos(dl)
+    deg = (math.degrees(math.atan2(y, x)) + 360.0) % 360.0
+    return DIRECTIONS[int(round(deg / 45.0)) % 8]
+
+
+class POIIndex:
+    """Array-backed POIs plus a grid of ``cell_deg`` x ``cell_deg`` cells."""
+
+    # below this many rows one vectorized pass is cheaper than walking cells
+    SCAN_THRESHOLD = 512
+
+    def __init__(self, records: list, cell_deg: float = 0.25):
+        self.records = records
+        self.cell_deg = cell_deg
+        self._all = np.arange(len(records), dtype=np.int64)
+        self.lats = np.array([r["lat"] for r in records], dtype=np.float64)
+        self.lons = np.array([r["lon"] for r in records], dtype=np.float64)
+        self.categories = np.array([r["category"] for r in records], dtype=object)
+        cells = {}
+        for i, (la, lo) in enumerate(zip(self.lats, self.lons)):
+            cells.setdefault(self._cell(la, lo), []).append(i)
+        self.cells = {k: np.array(v, dtype=np.int64) for k, v in cells.items()}
+        rows, cols = zip(*self.cells) if self.cells else ((0,), (0,))
+        self._extent = (min(rows), max(rows), min(cols), max(cols))
+
+    def __len__(self):
+        return len(self.records)
+
+    def _cell(self, lat: float, lon: float):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def _ring_candidates(self, lat: float, lon: float, rings: int) -> np.ndarray:
+        ci, cj = self._cell(lat, lon)
+        parts = [self.cells[(i, j)]
+                 for i in range(ci - rings, ci + rings + 1)
+                 for j in range(cj - rings, cj + rings + 1)
+                 if (i, j) in self.cells]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def _cell_km(self, lat: float, rings: int) -> float:
+        # cells are narrowest in longitude at the poleward edge of the window
+        edge = min(abs(lat) + (rings + 1) * self.cell_deg, 89.0)
+        return self.cell_deg * 111.32 * max(math.cos(math.radians(edge)), 0.01)
+
+    def _filter(self, idx: np.ndarray, category: str) -> np.ndarray:
+        if not category or not len(idx):
+            return idx
+        return idx[self.categories[idx] == category]
+
+    def _closest(self, lat: float, lon: float, idx: np.ndarray, n: int) -> list:
+        dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        order = np.argsort(dist, kind="stable")[:n]
+        return self._result(lat, lon, idx[order], dist[order])
+
+    def _result(self, lat: float, lon: float, idx: np.ndarray, dist: np.ndarray) -> list:
+        out = []
+        for i, d in zip(idx.tolist(), dist.tolist()):
+            rec = dict(self.records[i])
+            rec["distance_km"] = d
+            rec["bearing"] = bearing(lat, lon, rec["lat"], rec["lon"])
+            out.append(rec)
+        return out
+
+    def within(self, lat: float, lon: float, radius_km: float, category: str = None) -> list:
+        """All POIs within ``radius_km``, nearest first."""
+        if not len(self):
+            return []
+        if len(self) <= self.SCAN_THRESHOLD:
+            idx = self._all
+        else:
+            idx = self._ring_candidates(lat, lon, int(math.ceil(radius_km / self._cell_km(lat, 1))) + 1)
+        idx = self._filter(idx, category)
+        dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        keep = dist <= radius_km
+        idx, dist = idx[keep], dist[keep]
+        order = np.argsort(dist, kind="stable")
+        return self._result(lat, lon, idx[order], dist[order])
+
+    def nearest(self, lat: float, lon: float, n: int = 5, category: str = None) -> list:
+        """The ``n`` closest POIs, widening the grid window until the answer is exact."""
+        if not len(self):
+            return []
+        if len(self) <= self.SCAN_THRESHOLD:
+            return self._closest(lat, lon, self._filter(self._all, category), n)
+        ci, cj = self._cell(lat, lon)
+        r0, r1, c0, c1 = self._extent
+        max_rings = max(ci - r0, r1 - ci, cj - c0, c1 - cj, 0)
+        rings = 1
+        while True:
+            idx = self._filter(self._ring_candidates(lat, lon, rings), category)
+            if len(idx) >= n or rings >= max_rings:
+                dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+                order = np.argsort(dist, kind="stable")[:n]
+                # anything outside the window is at least `rings` cells away
+                if rings >= max_rings or dist[order[-1]] <= rings * self._cell_km(lat, rings):
+                    return self._result(lat, lon, idx[order], dist[order])
+            rings = min(rings * 2, max_rings)
+
+
+def load_records(entries) -> list:
+    """Flatten offline-bundle entries (city centres and their places) into POI records."""
+    records = []
+    for entry in entries:
+        key = entry["key"]
+        if entry.get("lat") is not None and entry.get("lon") is not None:
+            records.append({"name": entry["name"], "city": key, "category": "city",
+                            "lat": float(entry["lat"]), "lon": float(entry["lon"]),
+                            "description": "", "tip": ""})
+        for category, places in (entry.get("places") or {}).items():
+            for place in places:
+                if place.get("lat") is None or place.get("lon") is None:
+                    continue
+                records.append({"name": place["name"], "city": key, "category": category,
+                                "lat": float(place["lat"]), "lon": float(place["lon"]),
+                                "description": place.get("description", ""), "tip": place.get("tip", "")})
+    return records
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_poi_index() -> POIIndex:
+    """Process-wide index, rebuilt when the offline bundle changes."""
+    global _index, _index_version
+    bundle = get_bundle()
+    version = bundle.version
+    with _index_lock:
+        if _index is None or _index_version != version:
+            _index = POIIndex(load_records(bundle.entries()), cell_deg=Config.POI_GRID_CELL_DEG)
+            _index_version = version
+        return _index
+
+
+def is_nearby_query(text: str) -> bool:
+    return bool(NEARBY_PATTERN.search((text or "").lower()))
+
+
+def parse_radius_km(text: str):
+    m = RADIUS_PATTERN.search((text or "").lower())
+    return float(m.group(1)) if m else None
+
+
+def describe_nearby(results: list, origin_label: str) -> str:
+    """Chat-ready markdown list for nearest()/within() results."""
+    if not results:
+        return f"I couldn't find any saved places near {origin_label}."
+    lines = [f"Places near {origin_label}:"]
+    for r in results:
+        dist = f"{r['distance_km'] * 1000:.0f} m" if r["distance_km"] < 1 else f"{r['distance_km']:.1f} km"
+        tip = f" — {r['tip']}" if r.get("tip") else ""
+        lines.append(f"- **{r['name']}** ({dist} {r['bearing']}){tip}")
+    return "\n".join(lines)
@@ -0,0 +1,217 @@
+# services/geo/tiles.py
+"""Offline raster map tiles.
+
+Tiles are kept in one MBTiles (SQLite) file shared by every city, keyed by
+(zoom, column, row), so tiles that overlap between nearby cities are stored
+and downloaded once. "Download for offline" prefetches a city's bounding box
+over a zoom range; a small local HTTP server exposes the store to folium
+(read-through: misses are fetched upstream and cached when online), and
+:func:`services.geo.maps.render_static_map` stitches cached tiles into a PNG.
+"""
+import math
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import Config
+from connectivity import get_monitor
+from httpclient import get_http_client
+
+TILE_SIZE = 256
+
+
+def deg2num(lat: float, lon: float, zoom: int):
+    """Fractional XYZ tile coordinates for a point (Web Mercator)."""
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2 ** zoom
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return x, y
+
+
+def bbox_tiles(lat: float, lon: float, radius_km: float, zoom: int):
+    """XYZ tiles covering a square of ``radius_km`` around the point."""
+    dlat = radius_km / 111.32
+    dlon = radius_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+    x0, y0 = deg2num(lat + dlat, lon - dlon, zoom)
+    x1, y1 = deg2num(lat - dlat, lon + dlon, zoom)
+    n = 2 ** zoom
+    for x in range(max(int(x0), 0), min(int(x1), n - 1) + 1):
+        for y in range(max(int(y0), 0), min(int(y1), n - 1) + 1):
+            yield zoom, x, y
+
+
+def viewport_tiles(lat: float, lon: float, zoom: int, w: int, h: int):
+    """XYZ tiles needed for a ``w`` x ``h`` pixel view centred on the point.
+
+    Returns (tiles, left, top): pixel offsets of the view in world coordinates.
+    """
+    cx, cy = deg2num(lat, lon, zoom)
+    left = cx * TILE_SIZE - w / 2
+    top = cy * TILE_SIZE - h / 2
+    n = 2 ** zoom
+    tiles = [
+        (zoom, x, y)
+        for x in range(int(left // TILE_SIZE), int((left + w) // TILE_SIZE) + 1)
+        for y in range(int(top // TILE_SIZE), int((top + h) // TILE_SIZE) + 1)
+        if 0 <= x < n and 0 <= y < n
+    ]
+    return tiles, left, top
+
+
+class TileStore:
+    """MBTiles file. Rows use the TMS scheme (y flipped), as the spec requires."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER,"
+            " tile_row INTEGER, tile_data BLOB, PRIMARY KEY (zoom_level, tile_column, tile_row));"
+        )
+        self._db.executemany(
+            "INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)",
+            [("name", "ai-tour-guide offline tiles"), ("format", "png"), ("type", "baselayer")],
+        )
+        self._db.commit()
+
+    @staticmethod
+    def _row(z: int, y: int) -> int:
+        return (2 ** z - 1) - y
+
+    def get(self, z: int, x: int, y: int):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, self._row(z, y)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def missing(self, tiles) -> list:
+        """Subset of XYZ ``tiles`` not in the store yet."""
+        tiles = list(tiles)
+        have = set()
+        with self._lock:
+            for z in sorted({t[0] for t in tiles}):
+                for x, row in self._db.execute(
+                    "SELECT tile_column, tile_row FROM tiles WHERE zoom_level = ?", (z,)
+                ):
+                    have.add((z, x, self._row(z, row)))
+        return [t for t in tiles if t not in have]
+
+    def put(self, z: int, x: int, y: int, data: bytes):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                (z, x, self._row(z, y), sqlite3.Binary(data)),
+            )
+            self._db.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tiles")
+
+
+def get_tile_store() -> TileStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TileStore(os.path.join(Config.DATA_DIR, "tiles.mbtiles"))
+        return _store
+
+
+def fetch_tile(z: int, x: int, y: int):
+    """Fetch one tile from the upstream server and cache it. Returns bytes or None."""
+    try:
+        r = get_http_client().get(Config.TILE_URL.format(z=z, x=x, y=y), timeout=8)
+        r.raise_for_status()
+    except Exception:
+        return None
+    get_tile_store().put(z, x, y, r.content)
+    return r.content
+
+
+def prefetch_tiles(lat: float, lon: float, radius_km: float = None, zooms=None, progress=None) -> dict:
+    """Download the tiles around a point that are not cached yet.
+
+    ``progress(done, total)`` is called from the calling thread.
+    """
+    radius_km = radius_km or Config.TILE_RADIUS_KM
+    zooms = zooms or range(Config.TILE_MIN_ZOOM, Config.TILE_MAX_ZOOM + 1)
+    wanted = [t for z in zooms for t in bbox_tiles(lat, lon, radius_km, z)]
+    # plus everything the static offline map needs at its zoom
+    static, _, _ = viewport_tiles(lat, lon, Config.STATIC_MAP_ZOOM, *Config.STATIC_MAP_SIZE)
+    seen = set(wanted)
+    wanted += [t for t in static if t not in seen]
+    todo = get_tile_store().missing(wanted)
+    fetched = 0
+    if todo and get_monitor().is_online():
+        futures = [_executor.submit(fetch_tile, *t) for t in todo]
+        for i, fut in enumerate(as_completed(futures), start=1):
+            if fut.result():
+                fetched += 1
+            if progress:
+                progress(i, len(todo))
+    return {"wanted": len(wanted), "cached": len(wanted) - len(todo), "fetched": fetched}
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        try:
+            _, z, x, y = parts
+            z, x, y = int(z), int(x), int(y.split(".")[0])
+        except ValueError:
+            self.send_error(404)
+            return
+        data = get_tile_store().get(z, x, y)
+        if data is None and get_monitor().is_online():
+            data = fetch_tile(z, x, y)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "public, max-age=86400")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def tile_url_template():
+    """URL template for folium, starting the local tile server on first use.
+
+    Falls back to ``TILE_URL`` when the local server is disabled (the default
+    unless ``TILE_PUBLIC_URL`` is set) or cannot bind.
+    """
+    global _server
+    if not Config.LOCAL_TILE_SERVER:
+        return Config.TILE_URL
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("127.0.0.1", Config.TILE_SERVER_PORT), _TileHandler)
+            except OSError:
+                return Config.TILE_URL
+            threading.Thread(target=_server.serve_forever, name="tile-server", daemon=True).start()
+    base = Config.TILE_PUBLIC_URL or f"http://127.0.0.1:{_server.server_address[1]}"
+    return base.rstrip("/") + "/tiles/{z}/{x}/{y}.png"
@@ -0,0 +1,284 @@
+# services/jobs.py
+"""Background jobs with a persistent SQLite queue.
+
+Slow work (offline downloads and refreshes, Unsplash/geocode lookups for the
+gallery and map, TTS pre-rendering, storage cleanup) is submitted here
+instead of running inside the Streamlit rerun. Jobs live in
+``data/jobs.sqlite``, so a status survives reruns and page reloads, and a
+job left ``running`` by a dead process is re-queued on the next start.
+
+- ``submit(kind, args, key)`` deduplicates: while a job with the same kind
+  and key is queued or running (or finished less than ``reuse_for`` seconds
+  ago) its id is returned instead of a new job, so many sessions asking for
+  the same city share one download.
+- Workers are threads: the work is network and disk bound, and handlers
+  share the process-wide caches (tiles, thumbnails, stores).
+- Handlers report ``progress(done, total, message)`` into the row; the UI
+  polls :meth:`JobQueue.get`.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import Config
+from connectivity import get_monitor
+from tracing import span
+
+ACTIVE = ("queued", "running")
+
+_handlers = {}
+
+
+def handler(kind: str):
+    """Register ``fn(args, progress)`` as the runner for ``kind`` jobs."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except (OSError, TypeError, ValueError):
+        return False
+    return True
+
+
+class JobQueue:
+    def __init__(self, path: str, workers: int = 2, retention: float = 86400):
+        self.path = path
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._wake = threading.Condition()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT, key TEXT, args TEXT, status TEXT,"
+            " progress REAL, message TEXT, result TEXT, error TEXT, owner INTEGER,"
+            " created_at REAL, started_at REAL, finished_at REAL);"
+            "CREATE INDEX IF NOT EXISTS jobs_key ON jobs (kind, key, status);"
+            "CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, created_at);"
+        )
+        self._recover()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True) for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _recover(self):
+        """Re-queue jobs orphaned by a dead process; drop old finished ones."""
+        with self._lock:
+            for job_id, owner in self._db.execute("SELECT id, owner FROM jobs WHERE status = 'running'").fetchall():
+                if owner == os.getpid() or not _pid_alive(owner):
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'queued', owner = NULL, message = 'restarted' WHERE id = ?", (job_id,)
+                    )
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - self.retention,),
+            )
+            self._db.commit()
+
+    # -- submit / status -----------------------------------------------
+    def submit(self, kind: str, args: dict = None, key: str = None, reuse_for: float = 0) -> str:
+        """Queue a job (or return the id of an equivalent one). ``key`` defaults to the args."""
+        if kind not in _handlers:
+            raise ValueError(f"unknown job kind: {kind!r}")
+        args = args or {}
+        key = key if key is not None else json.dumps(args, sort_keys=True)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND key = ?"
+                " AND (status IN ('queued', 'running') OR (status = 'done' AND finished_at >= ?))"
+                " ORDER BY created_at DESC LIMIT 1",
+                (kind, key, now - reuse_for),
+            ).fetchone()
+            if row:
+                return row[0]
+            job_id = uuid.uuid4().hex
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, key, args, status, progress, message, created_at)"
+                " VALUES (?, ?, ?, ?, 'queued', 0, 'queued', ?)",
+                (job_id, kind, key, json.dumps(args, ensure_ascii=False), now),
+            )
+            self._db.commit()
+        with self._wake:
+            self._wake.notify()
+        return job_id
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, kind, key, status, progress, message, result, error, created_at, finished_at"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "kind", "key", "status", "progress", "message", "result", "error", "created_at", "finished_at")
+        job = dict(zip(keys, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def wait(self, job_id: str, timeout: float):
+        """Poll until the job leaves the queue or ``timeout`` passes; returns the job."""
+        deadline = time.time() + timeout
+        job = self.get(job_id)
+        while job is not None and job["status"] in ACTIVE and time.time() < deadline:
+            time.sleep(0.05)
+            job = self.get(job_id)
+        return job
+
+    # -- workers -------------------------------------------------------
+    def _claim(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, kind, args FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            cur = self._db.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, started_at = ?, message = 'started'"
+                " WHERE id = ? AND status = 'queued'",
+                (os.getpid(), time.time(), row[0]),
+            )
+            self._db.commit()
+            return row if cur.rowcount else None
+
+    def _update(self, job_id: str, **fields):
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+            self._db.commit()
+
+    def _run(self, job_id: str, kind: str, args: str):
+        last = [0.0]
+
+        def progress(done, total, message=""):
+            now = time.time()
+            if now - last[0] < 0.25 and done < total:
+                return  # throttle row updates
+            last[0] = now
+            self._update(job_id, progress=min(done / max(total, 1), 1.0), message=message)
+
+        try:
+            result = _handlers[kind](json.loads(args or "{}"), progress)
+        except Exception as e:
+            self._update(job_id, status="failed", error=str(e) or type(e).__name__, finished_at=time.time())
+            return
+        self._update(
+            job_id, status="done", progress=1.0, message="done",
+            result=json.dumps(result, ensure_ascii=False, default=str), finished_at=time.time(),
+        )
+
+    def _work(self):
+        failures = 0
+        while True:
+            try:
+                job = self._claim()
+                if job is None:
+                    with self._wake:
+                        self._wake.wait(timeout=1.0)  # also picks up jobs queued by other processes
+                    continue
+                self._run(*job)
+                failures = 0
+            except Exception as e:
+                # the queue database itself failed (locked, disk full): keep the worker alive and back off
+                with span("jobs.worker") as s:
+                    s.fail(e)
+                failures += 1
+                time.sleep(min(2 ** failures, 30))
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(os.path.join(Config.DATA_DIR, "jobs.sqlite"), workers=Config.JOB_WORKERS)
+        return _queue
+
+
+# -- job kinds -----------------------------------------------------------
+# service imports are deferred so importing the queue stays cheap
+
+@handler("download_city")
+def _download_city(args, progress):
+    from services.retrieval import overview
+    from services.storage.downloader import download_city
+    from services.tts import prerender
+
+    result = download_city(args["city"], info=args.get("info"), spots=args.get("spots"),
+                           online=get_monitor().is_online(), progress=progress, refresh=args.get("refresh", False))
+    # pre-render the spoken part of the offline answer so playback needs no network later
+    prerender([overview(args["city"])], lang=args.get("lang", "en"))
+    return result
+
+
+@handler("prefetch_cities")
+def _prefetch_cities(args, progress):
+    from services.retrieval import overview
+    from services.storage.downloader import prefetch_cities
+    from services.tts import prerender
+
+    cities = [(c["city"], c.get("info"), c.get("spots")) for c in args["cities"]]
+    results = prefetch_cities(cities, online=get_monitor().is_online(), progress=progress)
+    progress(len(cities), len(cities), "Pre-rendering offline audio…")
+    prerender([overview(c["city"]) for c in args["cities"]], lang=args.get("lang", "en"))
+    return {"cities": len(results), "images": sum(r["images"] for r in results),
+            "skipped": sum(1 for r in results if r.get("skipped"))}
+
+
+@handler("refresh_stale")
+def _refresh_stale(args, progress):
+    from services.storage.downloader import refresh_stale
+
+    results = refresh_stale(online=get_monitor().is_online(), max_age=args.get("max_age"), progress=progress)
+    return {"cities": len(results), "fetched": sum(r["fetched"] for r in results),
+            "unchanged": sum(r["unchanged"] for r in results)}
+
+
+@handler("storage_cleanup")
+def _storage_cleanup(args, progress):
+    """Compact leftovers, then evict down to the quota."""
+    from services.storage.quota import get_storage_manager
+
+    manager = get_storage_manager()
+    compacted = manager.compact()
+    progress(1, 2, "compacted")
+    evicted = manager.enforce()
+    return {"freed": compacted["freed"] + evicted["freed"], "files": compacted["files"],
+            "cities": evicted["cities"], "clips": evicted["clips"]}
+
+
+@handler("city_media")
+def _city_media(args, progress):
+    """Coordinates and gallery images for a city that is not saved offline."""
+    from services.geo.geocoding import geocode_city
+    from services.storage.downloader import fetch_unsplash_urls
+    from services.storage.thumbnails import fetch_thumbnails
+
+    lat, lon = geocode_city(args["city"])
+    progress(1, 3, "located")
+    urls = fetch_unsplash_urls(args["city"], n=args.get("n", 3)) if get_monitor().is_online() else []
+    progress(2, 3, "images found")
+    fetch_thumbnails(urls)  # warms the in-memory thumbnail cache for the next rerun
+    return {"lat": lat, "lon": lon, "urls": urls}
+
+
+@handler("tts_prerender")
+def _tts_prerender(args, progress):
+    from services.tts import prerender
+
+    return {"clips": prerender(args["texts"], lang=args.get("lang", "en"))}
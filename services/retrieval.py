@@ -0,0 +1,201 @@
+# services/retrieval.py
+"""Local passage retrieval (BM25) over the offline bundle.
+
+Every city in the bundle is split into short passages: its overview, one
+passage per place (name, description and tip) and its remaining spot
+names. An inverted index with BM25 scoring picks the passages relevant to a
+question in well under a millisecond. Offline, :func:`answer_offline`
+replies from those passages instead of a fixed sentence. Online,
+:func:`grounding` provides the same passages as compact context for the
+OpenAI prompt.
+"""
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from config import Config
+from services.storage.bundle import get_bundle
+from utils import safe_key
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "about", "an", "and", "any", "are", "at", "be", "best", "can", "do", "does", "for", "from",
+    "good", "how", "i", "in", "is", "it", "me", "my", "near", "of", "on", "or", "please", "some",
+    "should", "tell", "the", "there", "to", "visit", "we", "what", "when", "where", "which", "with",
+    "you",
+}
+
+# question words -> words that appear in the passages that answer them
+EXPANSIONS = {
+    "eat": ["food", "cuisine", "restaurant", "cafe", "seafood"],
+    "food": ["cuisine", "restaurant", "cafe", "seafood", "eat"],
+    "beach": ["beaches", "coast", "sea", "island"],
+    "temple": ["temples", "shrine", "matha", "church", "chapel"],
+    "trek": ["trekking", "hill", "hills", "peak", "hike"],
+    "waterfall": ["falls", "waterfalls"],
+    "nature": ["garden", "gardens", "park", "falls", "hill", "wildlife"],
+    "history": ["heritage", "palace", "ruins", "unesco", "fort", "temple"],
+    "sunset": ["sunset", "evening", "view"],
+    "sunrise": ["sunrise", "morning", "early"],
+}
+
+
+def _singular(tok: str) -> str:
+    """Light plural folding: beaches -> beach, temples -> temple."""
+    if len(tok) <= 3 or not tok.endswith("s") or tok.endswith("ss"):
+        return tok
+    if tok.endswith(("ches", "shes", "sses", "xes")):
+        return tok[:-2]
+    return tok[:-1]
+
+
+def tokenize(text: str) -> list:
+    out = []
+    for tok in TOKEN.findall((text or "").lower()):
+        if tok in STOPWORDS:
+            continue
+        out.append(_singular(tok))
+    return out
+
+
+def build_passages(entries) -> list:
+    """Split bundle entries into passages ``{"city", "kind", "title", "text"}``."""
+    passages = []
+    for e in entries:
+        city, name = e["key"], e["name"]
+        if e.get("info"):
+            passages.append({"city": city, "kind": "info", "title": name, "text": e["info"]})
+        described = set()
+        for category, places in (e.get("places") or {}).items():
+            for p in places:
+                text = p.get("description", "")
+                if p.get("tip"):
+                    text = f"{text} Tip: {p['tip']}".strip()
+                passages.append({"city": city, "kind": category, "title": p["name"], "text": text})
+                described.add(p["name"])
+        rest = [s for s in e.get("spots", []) if s not in described]
+        if rest:
+            passages.append({"city": city, "kind": "spots", "title": f"More in {name}",
+                             "text": ", ".join(rest)})
+    return passages
+
+
+class BM25Index:
+    """Inverted index over passages with Okapi BM25 scoring."""
+
+    def __init__(self, passages: list, k1: float = 1.2, b: float = 0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(doc id, term frequency)]
+        self.lengths = []
+        self.by_city = defaultdict(list)
+        for i, p in enumerate(passages):
+            # the title counts twice: a place named in the question is a strong match
+            tokens = tokenize(p["title"]) * 2 + tokenize(p["text"]) + [p["city"]]
+            self.lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((i, tf))
+            self.by_city[p["city"]].append(i)
+        n = len(passages)
+        self.avg_len = (sum(self.lengths) / n) if n else 0.0
+        self.idf = {t: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5)) for t, docs in self.postings.items()}
+
+    def _terms(self, query: str) -> list:
+        terms = tokenize(query)
+        for t in list(terms):
+            terms += [tokenize(x)[0] for x in EXPANSIONS.get(t, [])]
+        return [t for t in dict.fromkeys(terms) if t in self.postings]
+
+    def search(self, query: str, city: str = None, k: int = 3) -> list:
+        """Top ``k`` ``(score, passage)`` pairs, optionally limited to one city."""
+        scores = defaultdict(float)
+        allowed = set(self.by_city.get(city, ())) if city else None
+        for term in self._terms(query):
+            idf = self.idf[term]
+            for doc, tf in self.postings[term]:
+                if allowed is not None and doc not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc] / self.avg_len)
+                scores[doc] += idf * tf * (self.k1 + 1) / (tf + norm)
+        top = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+        return [(score, self.passages[doc]) for doc, score in top]
+
+    def city_passages(self, city: str) -> list:
+        return [self.passages[i] for i in self.by_city.get(city, ())]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_retrieval_index() -> BM25Index:
+    """Process-wide index, rebuilt when the offline bundle changes."""
+    global _index, _index_version
+    bundle = get_bundle()
+    version = bundle.version
+    with _index_lock:
+        if _index is None or _index_version != version:
+            _index = BM25Index(build_passages(bundle.entries()))
+            _index_version = version
+        return _index
+
+
+def retrieve(city: str, question: str, k: int = None) -> list:
+    """Passages for ``question`` about ``city``.
+
+    The city's overview comes first, then BM25 hits, topped up with the
+    city's other passages. The city's own names are dropped from the query
+    since every one of its passages would match them.
+    """
+    k = k or Config.GROUNDING_PASSAGES
+    entry = get_bundle().city(city or "")
+    key = entry["key"] if entry else safe_key(city or "")
+    index = get_retrieval_index()
+    own = index.city_passages(key)
+    if entry:
+        names = set(tokenize(" ".join([entry["name"], key] + entry["aliases"])))
+        question = " ".join(t for t in tokenize(question) if t not in names)
+    out = [p for p in own if p["kind"] == "info"][:1]
+    for p in [p for _, p in index.search(question, city=key, k=k + 1)] + own:
+        if len(out) >= k + 1:
+            break
+        if p not in out:
+            out.append(p)
+    return out
+
+
+def _line(p: dict) -> str:
+    if p["kind"] == "info":
+        return p["text"]
+    if p["kind"] == "spots":
+        return f"{p['title']}: {p['text']}"
+    return f"**{p['title']}** — {p['text']}" if p["text"] else f"**{p['title']}**"
+
+
+def answer_offline(city: str, question: str, k: int = None):
+    """Offline reply built from the passages that match the question; None if the city is unknown."""
+    passages = retrieve(city, question, k)
+    if not passages:
+        return None
+    return "\n".join(_line(p) if p["kind"] == "info" else f"- {_line(p)}" for p in passages)
+
+
+def overview(city: str):
+    """The city's overview passage: what an offline reply opens with and what is spoken."""
+    entry = get_bundle().city(city or "")
+    if entry is None:
+        return None
+    info = [p for p in get_retrieval_index().city_passages(entry["key"]) if p["kind"] == "info"]
+    return info[0]["text"] if info else None
+
+
+def grounding(city: str, question: str, k: int = None) -> str:
+    """Compact plain-text notes for the model prompt ('' if nothing is known)."""
+    return "\n".join(
+        f"- {p['title']}: {p['text']}" if p["kind"] != "info" else f"- {p['text']}"
+        for p in retrieve(city, question, k)
+    )
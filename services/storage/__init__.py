@@ -0,0 +1,2 @@
+# services/storage/__init__.py
+"""Saved-city index, offline downloads, gallery thumbnails and conversation logs."""
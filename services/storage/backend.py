@@ -0,0 +1,472 @@
+# services/storage/backend.py
+"""Pluggable storage for state that several app processes must share.
+
+Conversation logs, the saved-city index, the TTS clip cache and the reply
+cache go through one small key/value + append-only-list interface, so
+running several Streamlit replicas (processes on one machine, or nodes
+behind a load balancer) only needs them to point at the same backend:
+
+- ``fs``     files under ``DATA_DIR`` (default; the same layout as before,
+             fine for several processes on one machine)
+- ``sqlite`` one SQLite file (``sqlite:///path/to/store.sqlite``)
+- ``redis``  any Redis-compatible server (``redis://host:6379/0``), spoken
+             to over RESP directly so no client library is needed
+
+Keys are ``/``-separated paths (``sessions/<id>.jsonl``, ``tts/<hash>.mp3``).
+Values and list items are bytes; list items must not contain newlines.
+Image files and map tiles stay on the local disk (put ``data/cities`` on a
+shared volume for multi-node setups).
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+try:
+    import fcntl
+except ImportError:  # Windows: counters are only atomic within one process
+    fcntl = None
+
+from config import Config
+
+
+class StorageBackend:
+    """Interface; see the implementations below."""
+
+    name = "base"
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def keys(self, prefix: str) -> list:
+        raise NotImplementedError
+
+    def incr(self, key: str) -> int:
+        raise NotImplementedError
+
+    def append(self, key: str, item: bytes):
+        raise NotImplementedError
+
+    def lrange(self, key: str, start: int = 0, end: int = None) -> list:
+        """List items ``[start, end)``."""
+        raise NotImplementedError
+
+    def llen(self, key: str) -> int:
+        raise NotImplementedError
+
+    def touch(self, key: str):
+        """Mark a key as recently used (for :meth:`usage`-based eviction)."""
+
+    def usage(self, prefix: str):
+        """``[(key, size, last_used)]`` under ``prefix``, or None if the backend evicts by itself."""
+        return None
+
+
+class FileBackend(StorageBackend):
+    name = "fs"
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._lists = {}  # list key -> (inode, bytes scanned, line offsets)
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        parts = key.split("/")
+        if any(p in ("", ".", "..") for p in parts):
+            raise ValueError(f"bad storage key: {key!r}")
+        return os.path.join(self.root, *parts)
+
+    def _expired(self, path: str) -> bool:
+        try:
+            with open(path + ".exp", "r") as f:
+                return float(f.read() or 0) < time.time()
+        except (OSError, ValueError):
+            return False
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            if self._expired(path):
+                self.delete(key)
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(value)
+        os.replace(tmp, path)
+        if ttl:
+            with open(path + ".exp", "w") as f:
+                f.write(str(time.time() + ttl))
+        elif os.path.exists(path + ".exp"):
+            os.remove(path + ".exp")
+
+    def delete(self, key: str):
+        path = self._path(key)
+        for p in (path, path + ".exp"):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def keys(self, prefix: str) -> list:
+        base = self._path(prefix.rstrip("/")) if prefix.strip("/") else self.root
+        if not os.path.isdir(base):
+            base = os.path.dirname(base)
+        out = []
+        for dirpath, _, files in os.walk(base):
+            for fn in files:
+                if fn.endswith((".exp", ".tmp", ".lock")):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, fn), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    out.append(key)
+        return sorted(out)
+
+    def incr(self, key: str) -> int:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock, open(path + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # released when the file closes
+            try:
+                with open(path, "r") as f:
+                    value = int(f.read() or 0) + 1
+            except (OSError, ValueError):
+                value = 1
+            self.set(key, str(value).encode())
+            return value
+
+    def append(self, key: str, item: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # one write() on an O_APPEND file: concurrent writers never interleave a line
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, item + b"\n")
+        finally:
+            os.close(fd)
+
+    def _scan(self, key: str):
+        """``(path, line offsets, bytes scanned)`` for a list file.
+
+        Offsets are kept per key and only the bytes appended since the last
+        call are read, so checking a long list for new items stays cheap. A
+        line counts once its newline is written; a file that shrank or was
+        replaced is rescanned from the start.
+        """
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._lists.pop(key, None)
+            return path, [], 0
+        with self._lock:
+            ino, scanned, offsets = self._lists.get(key, (None, 0, []))
+            if ino != st.st_ino or st.st_size < scanned:
+                scanned, offsets = 0, []
+            if st.st_size > scanned:
+                try:
+                    with open(path, "rb") as f:
+                        f.seek(scanned)
+                        tail = f.read()
+                except OSError:
+                    tail = b""
+                pos = 0
+                while True:
+                    nl = tail.find(b"\n", pos)
+                    if nl < 0:
+                        break
+                    if nl > pos:
+                        offsets.append(scanned + pos)
+                    pos = nl + 1
+                scanned += pos
+            self._lists[key] = (st.st_ino, scanned, offsets)
+            return path, offsets, scanned
+
+    def lrange(self, key: str, start: int = 0, end: int = None) -> list:
+        path, offsets, scanned = self._scan(key)
+        lines = offsets[start:end]
+        if not lines:
+            return []
+        stop = offsets[end] if end is not None and end < len(offsets) else scanned
+        try:
+            with open(path, "rb") as f:
+                f.seek(lines[0])
+                data = f.read(stop - lines[0])
+        except OSError:
+            return []
+        return [line for line in data.split(b"\n") if line]
+
+    def llen(self, key: str) -> int:
+        return len(self._scan(key)[1])
+
+    def touch(self, key: str):
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def usage(self, prefix: str):
+        out = []
+        for key in self.keys(prefix):
+            try:
+                st = os.stat(self._path(key))
+            except OSError:
+                continue
+            out.append((key, st.st_size, st.st_mtime))
+        return out
+
+
+class SQLiteBackend(StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, expires_at REAL, used_at REAL);"
+            "CREATE TABLE IF NOT EXISTS list (seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, value BLOB);"
+            "CREATE INDEX IF NOT EXISTS list_key ON list (key, seq);"
+        )
+        self._db.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+            ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), now + ttl if ttl else None, now),
+            )
+            self._db.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM kv WHERE key = ?", (key,))
+            self._db.execute("DELETE FROM list WHERE key = ?", (key,))
+            self._db.commit()
+
+    def keys(self, prefix: str) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key FROM kv WHERE substr(key, 1, ?) = ? AND (expires_at IS NULL OR expires_at > ?)"
+                " UNION SELECT DISTINCT key FROM list WHERE substr(key, 1, ?) = ?",
+                (len(prefix), prefix, time.time(), len(prefix), prefix),
+            ).fetchall()
+        return sorted(r[0] for r in rows)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")  # serializes with other processes
+            row = self._db.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+            value = int(bytes(row[0]) or 0) + 1 if row else 1
+            self._db.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at, used_at) VALUES (?, ?, NULL, ?)",
+                (key, sqlite3.Binary(str(value).encode()), time.time()),
+            )
+            self._db.commit()
+            return value
+
+    def append(self, key: str, item: bytes):
+        with self._lock:
+            self._db.execute("INSERT INTO list (key, value) VALUES (?, ?)", (key, sqlite3.Binary(item)))
+            self._db.commit()
+
+    def lrange(self, key: str, start: int = 0, end: int = None) -> list:
+        limit = -1 if end is None else max(0, end - start)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT value FROM list WHERE key = ? ORDER BY seq LIMIT ? OFFSET ?", (key, limit, start)
+            ).fetchall()
+        return [bytes(r[0]) for r in rows]
+
+    def llen(self, key: str) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM list WHERE key = ?", (key,)).fetchone()[0]
+
+    def touch(self, key: str):
+        with self._lock:
+            self._db.execute("UPDATE kv SET used_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+
+    def usage(self, prefix: str):
+        with self._lock:
+            return self._db.execute(
+                "SELECT key, length(value), used_at FROM kv WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            ).fetchall()
+
+
+class RedisError(Exception):
+    pass
+
+
+class _RespConnection:
+    """Minimal RESP2 client: one socket, request/response."""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: str = None, timeout: float = 5.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.file = self.sock.makefile("rb")
+        if password:
+            self.call("AUTH", password)
+        if db:
+            self.call("SELECT", db)
+
+    def call(self, *args):
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            a = a if isinstance(a, bytes) else str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(a), a))
+        self.sock.sendall(b"".join(out))
+        return self._read()
+
+    def _read(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise RedisError(rest.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self.file.read(n + 2)
+            return data[:-2]
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read() for _ in range(n)]
+        raise RedisError(f"bad reply: {line!r}")
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisBackend(StorageBackend):
+    """Redis (or any RESP-compatible server); one connection per thread.
+
+    Keys are namespaced so several apps can share a server. Eviction is left
+    to Redis (TTL / ``maxmemory-policy``), so :meth:`usage` returns None.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, namespace: str = "tourguide:"):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.db = int(parts.path.strip("/") or 0)
+        self.password = unquote(parts.password) if parts.password else None
+        self.namespace = namespace
+        self._local = threading.local()
+
+    def _call(self, *args):
+        for attempt in (0, 1):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = _RespConnection(self.host, self.port, self.db, self.password)
+            try:
+                return conn.call(*args)
+            except (OSError, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def _k(self, key: str) -> str:
+        return self.namespace + key
+
+    def get(self, key: str):
+        return self._call("GET", self._k(key))
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        if ttl:
+            self._call("SET", self._k(key), value, "PX", int(ttl * 1000))
+        else:
+            self._call("SET", self._k(key), value)
+
+    def delete(self, key: str):
+        self._call("DEL", self._k(key))
+
+    def keys(self, prefix: str) -> list:
+        pattern = "".join("\\" + c if c in "*?[]\\" else c for c in self._k(prefix)) + "*"
+        cursor, out = b"0", []
+        while True:
+            cursor, batch = self._call("SCAN", cursor, "MATCH", pattern, "COUNT", 500)
+            out += [k.decode("utf-8")[len(self.namespace):] for k in batch]
+            if cursor in (b"0", 0):
+                return sorted(set(out))
+
+    def incr(self, key: str) -> int:
+        return self._call("INCR", self._k(key))
+
+    def append(self, key: str, item: bytes):
+        self._call("RPUSH", self._k(key), item)
+
+    def lrange(self, key: str, start: int = 0, end: int = None) -> list:
+        stop = -1 if end is None else end - 1
+        if end is not None and end <= start:
+            return []
+        return self._call("LRANGE", self._k(key), start, stop) or []
+
+    def llen(self, key: str) -> int:
+        return self._call("LLEN", self._k(key))
+
+
+def open_backend(url: str) -> StorageBackend:
+    """Backend for a ``STORAGE_BACKEND`` value: ``fs``, ``sqlite[:///path]`` or ``redis://...``."""
+    if url in ("", "fs"):
+        return FileBackend(Config.DATA_DIR)
+    if url.startswith("fs://"):
+        return FileBackend(url[len("fs://"):])
+    if url == "sqlite":
+        return SQLiteBackend(os.path.join(Config.DATA_DIR, "store.sqlite"))
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith("redis://"):
+        return RedisBackend(url, namespace=Config.STORAGE_NAMESPACE)
+    raise ValueError(f"unknown STORAGE_BACKEND: {url!r}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StorageBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = open_backend(Config.STORAGE_BACKEND)
+        return _backend
@@ -0,0 +1,345 @@
+# services/storage/bundle.py
+"""Versioned offline knowledge bundle.
+
+Offline city knowledge used to live in three places: the built-in
+``BUILTIN_CITIES`` below (formerly hard-coded in ``streamlit_app.py``),
+``data/offline_data.json`` (places, tips, coordinates, images; only the JS
+client read it) and each saved city's ``meta.json``. :func:`compile_entries`
+merges them into one record per city and :class:`OfflineBundle` stores the
+records in ``data/bundle.sqlite``:
+
+- every row carries a content digest and the bundle version that last
+  changed it, so a sync (e.g. after a city is re-downloaded) only rewrites
+  rows whose digest changed and bumps the version once;
+- lookups are single-row queries, nothing is loaded up front;
+- after each version bump ``data/bundle.json`` (full) and
+  ``data/bundle.delta.json`` (rows changed by the last bump) are exported
+  for ``static/js/offline.js``, which applies the delta to its cached copy
+  when it can.
+
+Build from the command line:  python -m services.storage.bundle
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+from services.geo.cityner import VARIANTS
+from services.storage.citystore import get_city_store
+from tracing import span
+from utils import safe_key
+
+BUILTIN_CITIES = {
+    "bengaluru": {
+        "info": "Bengaluru — the tech capital of India, known for gardens, cafés, and a lively startup scene.",
+        "spots": ["Cubbon Park", "Lalbagh Botanical Garden", "Vidhana Soudha", "Church Street"]
+    },
+    "mysuru": {
+        "info": "Mysuru — royal city famous for the Mysore Palace, Dasara festival, and sandalwood crafts.",
+        "spots": ["Mysore Palace", "Chamundi Hills", "Brindavan Gardens"]
+    },
+    "mangaluru": {
+        "info": "Mangaluru — coastal city known for beaches, temples and seafood.",
+        "spots": ["Panambur Beach", "Kadri Manjunatha Temple", "St. Aloysius Chapel"]
+    },
+    "udupi": {
+        "info": "Udupi — temple town famous for Krishna Matha and coastal cuisine.",
+        "spots": ["Sri Krishna Matha", "Malpe Beach", "St. Mary's Island"]
+    },
+    "coorg": {
+        "info": "Coorg (Kodagu) — hill station known for coffee estates and waterfalls.",
+        "spots": ["Abbey Falls", "Dubare Elephant Camp", "Raja's Seat"]
+    },
+    "chikmagalur": {
+        "info": "Chikmagalur — coffee country and trekking destination.",
+        "spots": ["Mullayanagiri", "Hebbe Falls", "Baba Budangiri"]
+    },
+    "hampi": {
+        "info": "Hampi — UNESCO World Heritage site with ruins of the Vijayanagara Empire.",
+        "spots": ["Virupaksha Temple", "Vittala Temple", "Matanga Hill"]
+    },
+    "gokarna": {
+        "info": "Gokarna — relaxed beaches and spiritual temples.",
+        "spots": ["Om Beach", "Kudle Beach", "Mahabaleshwar Temple"]
+    }
+}
+
+
+def _canonical(key: str) -> str:
+    return VARIANTS.get(key, key)
+
+
+def _entry(key: str) -> dict:
+    return {"key": key, "name": key.title(), "info": None, "spots": [], "aliases": [],
+            "lat": None, "lon": None, "places": {}, "images": [], "map_image": None,
+            "saved_at": None, "sources": []}
+
+
+def _relpath(path: str) -> str:
+    """Image paths relative to the app root, as the JS client requests them."""
+    root = os.path.dirname(os.path.abspath(Config.DATA_DIR))
+    return os.path.relpath(os.path.abspath(path), root).replace(os.sep, "/")
+
+
+def compile_entries(builtin: dict, offline_data_path: str = None, saved_records=()) -> dict:
+    """Merge every source into ``{key: entry}``.
+
+    Built-in text wins for ``info``; offline_data.json contributes the display
+    name, coordinates, places and bundled images; saved meta fills whatever is
+    still missing and adds the downloaded images.
+    """
+    entries = {}
+
+    def get(key):
+        key = _canonical(key)
+        if key not in entries:
+            entries[key] = _entry(key)
+        return entries[key]
+
+    for key, city in builtin.items():
+        e = get(key)
+        e["info"] = city.get("info")
+        e["spots"] = list(city.get("spots", []))
+        e["sources"].append("builtin")
+
+    data = {}
+    if offline_data_path:
+        try:
+            data = json.load(open(offline_data_path, "r", encoding="utf-8"))
+        except Exception:
+            data = {}
+    for key, city in data.items():
+        e = get(key)
+        e["name"] = city.get("city") or e["name"]
+        e["aliases"].append(key)
+        if city.get("lat") is not None and city.get("lon") is not None:
+            e["lat"], e["lon"] = float(city["lat"]), float(city["lon"])
+        e["places"] = city.get("categories") or {}
+        e["images"] = list(city.get("images", []))
+        e["map_image"] = city.get("map_image")
+        for places in e["places"].values():
+            for place in places:
+                if place.get("name") and place["name"] not in e["spots"]:
+                    e["spots"].append(place["name"])
+        e["sources"].append("offline_data")
+
+    for rec in saved_records:
+        meta = rec.get("meta") or {}
+        e = get(rec["key"])
+        e["aliases"] += [rec["key"], safe_key(rec.get("city") or "")] + list(meta.get("aliases", []))
+        if not e["info"]:
+            e["info"] = meta.get("info")
+        if not e["spots"]:
+            e["spots"] = list(meta.get("spots", []))
+        if e["lat"] is None and rec.get("lat") is not None:
+            e["lat"], e["lon"] = rec["lat"], rec["lon"]
+        if "offline_data" not in e["sources"]:
+            e["name"] = meta.get("city") or rec.get("city") or e["name"]
+        e["images"] = [_relpath(p) for p in rec.get("images", [])] + e["images"]
+        if rec.get("folder"):
+            e["map_image"] = _relpath(os.path.join(rec["folder"], "map.png"))
+        e["saved_at"] = rec.get("saved_at")
+        e["sources"].append("saved")
+
+    for key, e in entries.items():
+        aliases = {safe_key(a) for a in e["aliases"] + [e["name"]]} | {v for v, c in VARIANTS.items() if c == key}
+        aliases.discard("")
+        aliases.discard(key)
+        e["aliases"] = sorted(aliases)
+    return entries
+
+
+def entry_names(entries: dict) -> dict:
+    """Display name / alias -> key, as :meth:`OfflineBundle.names` returns it."""
+    names = {}
+    for key, e in entries.items():
+        names.update(dict.fromkeys(e["aliases"], key))
+    for key, e in entries.items():
+        names[e["name"]] = key
+        names[key] = key
+    return names
+
+
+def digest(entry: dict) -> str:
+    return hashlib.sha1(json.dumps(entry, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def js_entry(entry: dict) -> dict:
+    """Shape one record the way ``static/js/offline.js`` reads destinations."""
+    places = [p for ps in entry["places"].values() for p in ps]
+    return {
+        "name": entry["name"],
+        "basic_info": entry["info"] or f"{entry['name']} — saved offline.",
+        "attractions": [f"{p['name']} - {p['description']}" if p.get("description") else p["name"] for p in places]
+        or list(entry["spots"]),
+        "tips": [p["tip"] for p in places if p.get("tip")],
+        "lat": entry["lat"],
+        "lon": entry["lon"],
+        "places": entry["places"],
+        "images": entry["images"],
+        "map_image": entry["map_image"],
+        "aliases": entry["aliases"],
+    }
+
+
+class OfflineBundle:
+    """SQLite-backed bundle with per-row versions for delta exports."""
+
+    def __init__(self, path: str, export_dir: str = None):
+        self.path = path
+        self.export_dir = export_dir
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS cities (key TEXT PRIMARY KEY, name TEXT, version INTEGER, digest TEXT, data TEXT);"
+            "CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, key TEXT);"
+            "CREATE TABLE IF NOT EXISTS removed (key TEXT PRIMARY KEY, version INTEGER);"
+        )
+        self._db.commit()
+
+    # -- reads ---------------------------------------------------------
+    @property
+    def version(self) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _resolve(self, query: str):
+        key = safe_key(query or "")
+        if not key:
+            return None
+        row = self._db.execute(
+            "SELECT key FROM cities WHERE key = ? UNION ALL SELECT key FROM aliases WHERE alias = ? LIMIT 1",
+            (key, key),
+        ).fetchone()
+        return row[0] if row else None
+
+    def city(self, query: str):
+        """Entry for a key, alias or display name; None if unknown."""
+        with span("bundle.city") as s:
+            with self._lock:
+                key = self._resolve(query)
+                row = self._db.execute("SELECT data FROM cities WHERE key = ?", (key,)).fetchone() if key else None
+            if row is None:
+                s.set("miss")
+                return None
+            return json.loads(row[0])
+
+    def keys(self, source: str = None) -> list:
+        with self._lock:
+            rows = self._db.execute("SELECT key, data FROM cities ORDER BY key").fetchall()
+        if source is None:
+            return [k for k, _ in rows]
+        return [k for k, data in rows if source in json.loads(data)["sources"]]
+
+    def names(self) -> dict:
+        """Display name / alias -> key for every city (keys map to themselves)."""
+        with self._lock:
+            names = dict(self._db.execute("SELECT alias, key FROM aliases"))
+            for key, name in self._db.execute("SELECT key, name FROM cities"):
+                names[name] = key
+                names[key] = key
+        return names
+
+    def entries(self) -> list:
+        with self._lock:
+            return [json.loads(d) for (d,) in self._db.execute("SELECT data FROM cities ORDER BY key")]
+
+    def changes_since(self, version: int) -> dict:
+        """Rows changed and keys removed after ``version``."""
+        with self._lock:
+            changed = {k: json.loads(d) for k, d in self._db.execute(
+                "SELECT key, data FROM cities WHERE version > ?", (version,))}
+            removed = [k for (k,) in self._db.execute("SELECT key FROM removed WHERE version > ?", (version,))]
+        return {"base": version, "version": self.version, "cities": changed, "removed": removed}
+
+    # -- writes --------------------------------------------------------
+    def sync(self, entries: dict) -> dict:
+        """Store ``entries``, touching only rows whose digest changed.
+
+        Bumps the bundle version (and re-exports the JSON files) when
+        anything changed. Returns ``{"version", "changed", "removed"}``.
+        """
+        with self._lock:
+            current = dict(self._db.execute("SELECT key, digest FROM cities"))
+            digests = {k: digest(e) for k, e in entries.items()}
+            changed = [k for k in entries if current.get(k) != digests[k]]
+            removed = [k for k in current if k not in entries]
+            row = self._db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+            version = int(row[0]) if row else 0
+            if changed or removed or row is None:
+                version += 1
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO cities (key, name, version, digest, data) VALUES (?, ?, ?, ?, ?)",
+                    [(k, entries[k]["name"], version, digests[k], json.dumps(entries[k], ensure_ascii=False))
+                     for k in changed],
+                )
+                for k in removed:
+                    self._db.execute("DELETE FROM cities WHERE key = ?", (k,))
+                    self._db.execute("INSERT OR REPLACE INTO removed (key, version) VALUES (?, ?)", (k, version))
+                self._db.execute("DELETE FROM removed WHERE key IN (SELECT key FROM cities)")
+                self._db.execute("DELETE FROM aliases")
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO aliases (alias, key) VALUES (?, ?)",
+                    [(a, k) for k, e in sorted(entries.items()) for a in e["aliases"]],
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                    [("version", str(version)), ("built_at", str(time.time()))],
+                )
+                self._db.commit()
+        if self.export_dir and (changed or removed or not os.path.exists(os.path.join(self.export_dir, "bundle.json"))):
+            self.export_json(self.export_dir)
+        return {"version": version, "changed": changed, "removed": removed}
+
+    def export_json(self, folder: str):
+        """Write ``bundle.json`` and ``bundle.delta.json`` (changes of the last version)."""
+        version = self.version
+        full = {"version": version, "destinations": {e["key"]: js_entry(e) for e in self.entries()}}
+        delta = self.changes_since(version - 1)
+        delta["destinations"] = {k: js_entry(e) for k, e in delta.pop("cities").items()}
+        for name, payload in (("bundle.json", full), ("bundle.delta.json", delta)):
+            path = os.path.join(folder, name)
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp, path)
+
+
+_bundle = None
+_bundle_sources = None
+_bundle_lock = threading.Lock()
+
+
+def get_bundle() -> OfflineBundle:
+    """Process-wide bundle, re-synced when its sources change.
+
+    Sources are fingerprinted by the offline_data.json mtime and the saved-city
+    store version, so a re-downloaded city becomes a one-row delta.
+    """
+    global _bundle, _bundle_sources
+    data_path = os.path.join(Config.DATA_DIR, "offline_data.json")
+    store = get_city_store()
+    try:
+        mtime = os.path.getmtime(data_path)
+    except OSError:
+        mtime = None
+    sources = (mtime, store.current_version())
+    with _bundle_lock:
+        if _bundle is None:
+            _bundle = OfflineBundle(os.path.join(Config.DATA_DIR, "bundle.sqlite"), export_dir=Config.DATA_DIR)
+        if _bundle_sources != sources:
+            _bundle.sync(compile_entries(BUILTIN_CITIES, data_path, store.all()))
+            _bundle_sources = sources
+        return _bundle
+
+
+if __name__ == "__main__":
+    b = get_bundle()
+    print(f"bundle v{b.version}: {len(b.keys())} cities -> {b.path}")
@@ -0,0 +1,183 @@
+# services/storage/citystore.py
+"""Indexed store of saved offline cities.
+
+Each saved city's record (key, aliases, meta.json contents, image paths and
+coordinates) is one ``index/cities/<key>.json`` entry in the storage
+backend, and every write bumps a shared ``index/cities.version`` counter.
+The whole index is loaded into memory once per process and reloaded only
+when that counter moves, so replicas sharing a backend see each other's
+downloads. Lookups are dict hits (exact key / alias) or a bisect over the
+sorted alias list (prefix), never directory scans. The download pipeline
+calls :meth:`CityStore.index_folder` after each save.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+from config import Config
+from services.storage.backend import get_backend
+from tracing import span
+from utils import safe_key
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+class CityStore:
+    PREFIX = "index/cities/"
+    VERSION_KEY = "index/cities.version"
+
+    def __init__(self, backend, cities_dir: str):
+        self.backend = backend
+        self.cities_dir = cities_dir
+        self._lock = threading.RLock()
+        self._data_version = None
+        self._checked_at = 0.0
+        self.version = 0  # shared write counter; lets callers invalidate derived caches
+        self._load()
+        if not self._cities and os.path.isdir(cities_dir):
+            # first run on an existing data/ tree: index it once
+            self.rebuild()
+
+    # -- loading -------------------------------------------------------
+    def _shared_version(self) -> int:
+        raw = self.backend.get(self.VERSION_KEY)
+        return int(raw) if raw else 0
+
+    def _load(self):
+        with self._lock:
+            version = self._shared_version()
+            cities, aliases = {}, {}
+            for skey in self.backend.keys(self.PREFIX):
+                try:
+                    rec = json.loads(self.backend.get(skey) or b"null")
+                except ValueError:
+                    continue
+                if not rec:
+                    continue
+                cities[rec["key"]] = rec
+                for alias in rec.pop("aliases", [rec["key"]]):
+                    aliases[alias] = rec["key"]
+            self._cities = cities
+            self._aliases = aliases
+            self._sorted_aliases = sorted(aliases)
+            self.version = self._data_version = version
+
+    def _maybe_reload(self):
+        """Pick up writes made by other processes (one small backend read, at most twice a second)."""
+        now = time.monotonic()
+        if now - self._checked_at < 0.5:
+            return
+        self._checked_at = now
+        try:
+            version = self._shared_version()
+        except Exception:
+            return
+        if version != self._data_version:
+            self._load()
+
+    # -- writes --------------------------------------------------------
+    def _bump(self, reload: bool):
+        self.backend.incr(self.VERSION_KEY)
+        if reload:
+            self._load()
+
+    def index_folder(self, folder: str, reload: bool = True):
+        """(Re)index one city folder from its meta.json and image files."""
+        key = os.path.basename(os.path.normpath(folder))
+        meta = {}
+        try:
+            meta = json.load(open(os.path.join(folder, "meta.json"), "r", encoding="utf-8"))
+        except Exception:
+            pass
+        try:
+            files = sorted(os.listdir(folder))
+        except OSError:
+            return None
+        images = [os.path.join(folder, fn) for fn in files
+                  if fn.lower().endswith(IMAGE_EXTS) and fn.lower() != "map.png"]
+        city = meta.get("city") or key
+        aliases = {key, safe_key(city)} | {safe_key(a) for a in meta.get("aliases", [])}
+        aliases.discard("")
+        rec = {
+            "key": key, "city": city, "folder": folder, "meta": meta,
+            "lat": meta.get("lat"), "lon": meta.get("lon"), "saved_at": meta.get("saved_at"),
+            "images": images, "aliases": sorted(aliases),
+        }
+        with self._lock:
+            self.backend.set(f"{self.PREFIX}{key}.json", json.dumps(rec, ensure_ascii=False).encode("utf-8"))
+            self._bump(reload)
+        return self._cities.get(key)
+
+    def remove(self, key: str):
+        with self._lock:
+            self.backend.delete(f"{self.PREFIX}{key}.json")
+            self._bump(reload=True)
+
+    def rebuild(self):
+        """Re-index every folder under ``cities_dir`` (one-off migration / repair)."""
+        with self._lock:
+            for skey in self.backend.keys(self.PREFIX):
+                self.backend.delete(skey)
+            if os.path.isdir(self.cities_dir):
+                for fn in sorted(os.listdir(self.cities_dir)):
+                    p = os.path.join(self.cities_dir, fn)
+                    if os.path.isdir(p):
+                        self.index_folder(p, reload=False)
+            self._bump(reload=True)
+
+    # -- reads ---------------------------------------------------------
+    def current_version(self) -> int:
+        """Version of the index, after picking up any external writes."""
+        self._maybe_reload()
+        return self.version
+
+    def get(self, key: str):
+        self._maybe_reload()
+        return self._cities.get(key)
+
+    def all(self) -> list:
+        self._maybe_reload()
+        return [self._cities[k] for k in sorted(self._cities)]
+
+    def keys(self) -> list:
+        self._maybe_reload()
+        return sorted(self._cities)
+
+    def find(self, query: str):
+        """Exact key, alias, then alias-prefix match. Returns a record or None."""
+        if not query:
+            return None
+        with span("citystore.find") as s:
+            rec = self._find(query)
+            if rec is None:
+                s.set("miss")
+            return rec
+
+    def _find(self, query: str):
+        self._maybe_reload()
+        key = safe_key(query)
+        if not key:
+            return None
+        if key in self._cities:
+            return self._cities[key]
+        if key in self._aliases:
+            return self._cities.get(self._aliases[key])
+        i = bisect.bisect_left(self._sorted_aliases, key)
+        if i < len(self._sorted_aliases) and self._sorted_aliases[i].startswith(key):
+            return self._cities.get(self._aliases[self._sorted_aliases[i]])
+        return None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_city_store() -> CityStore:
+    """Process-wide store, loaded once and shared by every session."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CityStore(get_backend(), Config.CITIES_DIR)
+        return _store
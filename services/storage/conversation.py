@@ -0,0 +1,197 @@
+# services/storage/conversation.py
+"""Per-session conversation log.
+
+Each browser session gets its own append-only list ``sessions/<id>.jsonl``
+in the storage backend (a JSONL file under ``data/sessions`` by default).
+A message is one appended item, so concurrent sessions never rewrite (or
+clobber) each other's history and a message costs O(1) writes no matter how
+long the chat is. Only the last ``window`` messages are kept in memory;
+older ones are paged in on request. :meth:`Conversation.sync` picks up
+records another replica appended for the same session.
+
+Record kinds: ``{"role": ..., "content": ..., "ts": ...}`` for messages,
+``{"type": "state", "last_city": ...}`` for session state changes and
+``{"type": "request", "id": ...}`` for handled request ids (so a replayed
+speech query is answered once, even after a reload or on another replica).
+
+The session id travels in the page URL (``?sid=``), so on its own it would
+let anyone with a copied link read and extend the chat. Each session is
+therefore bound to the sha256 of an owner key that the browser keeps in a
+cookie, never in the URL: :meth:`ConversationStore.authorize` only opens a
+session for the browser holding that key. Sessions created before owner
+keys existed are bound to the first browser that opens them.
+"""
+import hashlib
+import hmac
+import json
+import re
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from config import Config
+from services.storage.backend import get_backend
+
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def valid_session_id(sid) -> bool:
+    return bool(sid) and bool(SESSION_ID_RE.match(str(sid)))
+
+
+def new_owner_key() -> str:
+    return secrets.token_hex(16)
+
+
+def valid_owner_key(key) -> bool:
+    return bool(key) and bool(SESSION_ID_RE.match(str(key)))
+
+
+class Conversation:
+    """One session's log: bounded in-memory window + append-only backend list."""
+
+    def __init__(self, backend, key: str, window: int = 50):
+        self.backend = backend
+        self.key = key
+        self.window = window
+        self.messages = deque(maxlen=window)
+        self.total = 0  # messages in the backend
+        self.last_city = None
+        self.requests = OrderedDict()  # recently handled request ids
+        self._seen = 0  # records (messages + state) applied so far
+        self._lock = threading.Lock()
+        self.sync()
+
+    def _records(self, start: int = 0):
+        for raw in self.backend.lrange(self.key, start):
+            try:
+                yield json.loads(raw)
+            except ValueError:
+                yield {}  # torn last line after a crash
+
+    def sync(self):
+        """Apply records appended since the last call (by this or another process)."""
+        with self._lock:
+            if self.backend.llen(self.key) != self._seen:
+                self._catch_up()
+
+    def _catch_up(self):
+        for rec in self._records(self._seen):
+            self._apply(rec)
+
+    def _apply(self, rec: dict):
+        self._seen += 1
+        if rec.get("type") == "state":
+            self.last_city = rec.get("last_city", self.last_city)
+        elif rec.get("type") == "request":
+            self.requests[rec.get("id")] = True
+            while len(self.requests) > 256:
+                self.requests.popitem(last=False)
+        elif "role" in rec:
+            self.messages.append({"role": rec["role"], "content": rec.get("content", "")})
+            self.total += 1
+
+    def _append(self, rec: dict):
+        """Append ``rec``, then apply the log up to it, so records another replica
+        appended in between land in the same order as in the backend."""
+        self.backend.append(self.key, json.dumps(rec, ensure_ascii=False).encode("utf-8"))
+        self._catch_up()
+
+    def add(self, role: str, content: str):
+        with self._lock:
+            self._append({"role": role, "content": content, "ts": time.time()})
+
+    def set_last_city(self, city):
+        with self._lock:
+            self._catch_up()
+            if city == self.last_city:
+                return
+            self._append({"type": "state", "last_city": city, "ts": time.time()})
+
+    def claim(self, request_id: str) -> bool:
+        """True the first time ``request_id`` is seen in this session, False for replays."""
+        with self._lock:
+            self._catch_up()
+            if request_id in self.requests:
+                return False
+            self._append({"type": "request", "id": request_id, "ts": time.time()})
+            return True
+
+    def recent(self, limit: int = None) -> list:
+        msgs = list(self.messages)
+        return msgs if limit is None else msgs[-limit:]
+
+    def page(self, end: int, limit: int) -> list:
+        """Messages ``[end - limit, end)`` by absolute index (0 = oldest), read from the backend."""
+        start = max(0, end - limit)
+        out = []
+        i = 0
+        for rec in self._records():
+            if "role" not in rec:
+                continue
+            if start <= i < end:
+                out.append({"role": rec["role"], "content": rec.get("content", "")})
+            i += 1
+            if i >= end:
+                break
+        return out
+
+
+class ConversationStore:
+    """Process-wide registry of open conversations (LRU-bounded)."""
+
+    def __init__(self, backend, window: int = 50, max_open: int = 256):
+        self.backend = backend
+        self.window = window
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def authorize(self, session_id: str, owner_key: str) -> bool:
+        """True if ``owner_key`` owns the session; a session with no owner yet is bound to it."""
+        if not valid_session_id(session_id) or not valid_owner_key(owner_key):
+            return False
+        digest = hashlib.sha256(owner_key.encode("utf-8")).hexdigest()
+        key = f"sessions/{session_id}.owner"
+        try:
+            stored = self.backend.get(key)
+            if stored is None:
+                self.backend.set(key, digest.encode("utf-8"))
+                return True
+        except Exception:
+            return False  # can't check: don't open the log
+        return hmac.compare_digest(stored.decode("utf-8"), digest)
+
+    def get(self, session_id: str) -> Conversation:
+        if not valid_session_id(session_id):
+            raise ValueError(f"invalid session id: {session_id!r}")
+        with self._lock:
+            conv = self._open.get(session_id)
+            if conv is None:
+                conv = Conversation(self.backend, f"sessions/{session_id}.jsonl", self.window)
+                self._open[session_id] = conv
+                while len(self._open) > self.max_open:
+                    self._open.popitem(last=False)
+                self._open.move_to_end(session_id)
+                return conv
+            self._open.move_to_end(session_id)
+        conv.sync()  # the session may have been served by another replica meanwhile
+        return conv
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> ConversationStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConversationStore(get_backend(), window=Config.CHAT_WINDOW)
+        return _store
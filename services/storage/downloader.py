@@ -0,0 +1,283 @@
+# services/storage/downloader.py
+"""Concurrent "Download for offline" pipeline.
+
+Geocoding, the Unsplash search and every image download run on a shared
+thread pool over one pooled HTTP session. Progress callbacks are invoked
+from the calling thread only, so they may safely touch Streamlit elements.
+
+A city folder is resumable: ``meta.json`` records the image URLs before any
+image is fetched and ``complete`` once everything landed, so a re-run only
+downloads the files that are still missing. Refreshes are incremental: each
+image's fetch time is kept in ``meta.json`` and only images older than
+``REFRESH_AFTER`` are revalidated. Saved images are deduplicated and the
+storage quota enforced after every save (see ``services.storage.quota``).
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+from PIL import Image
+
+from config import Config
+from connectivity import get_monitor
+from httpclient import RateLimited, get_http_client, validators_of
+from services.geo.geocoding import geocode_city
+from services.geo.maps import city_map_image
+from services.geo.tiles import prefetch_tiles
+from services.storage.bundle import get_bundle
+from services.storage.citystore import get_city_store
+from services.storage.quota import get_storage_manager
+from services.storage.thumbnails import make_derivatives
+from tracing import span
+from utils import safe_key
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=Config.DOWNLOAD_WORKERS, thread_name_prefix="download")
+    return _executor
+
+
+def fetch_unsplash_urls(city: str, n: int = 3):
+    """Return list of Unsplash image URLs (requires UNSPLASH_ACCESS_KEY)."""
+    if not Config.UNSPLASH_ACCESS_KEY:
+        return []
+    with span("unsplash.search") as s:
+        monitor = get_monitor()
+        if not monitor.available("unsplash"):
+            s.set("unavailable")
+            return []
+        try:
+            r = get_http_client().get(
+                Config.UNSPLASH_API_URL,
+                params={"query": city, "per_page": n, "client_id": Config.UNSPLASH_ACCESS_KEY},
+                timeout=8,
+            )
+            r.raise_for_status()
+            results = r.json().get("results", [])
+            monitor.record_success("unsplash")
+            return [it["urls"]["regular"] for it in results[:n] if "urls" in it]
+        except RateLimited as e:
+            s.fail(e, outcome="rate_limited")  # our own request budget, not an upstream fault
+            monitor.release("unsplash")  # a half-open trial was never made
+            return []
+        except Exception as e:
+            monitor.record_failure("unsplash", str(e))
+            s.fail(e)
+            return []
+
+
+def download_image(url: str, dest_path: str, validators: dict = None):
+    """Download an image by URL to dest_path.
+
+    Returns ``{"status", "validators"}`` on success and None on failure. With
+    ``validators`` from an earlier download the request is conditional: a
+    304 leaves the existing file untouched. The file is written under a
+    temporary name and renamed into place, so an interrupted download never
+    leaves a truncated image behind.
+    """
+    tmp = dest_path + ".part"
+    with span("image.download") as s:
+        try:
+            r = get_http_client().get(url, timeout=12, validators=validators)
+            if r.status_code == 304 and os.path.exists(dest_path):
+                s.set("not_modified")
+                return {"status": 304, "validators": validators_of(r) or validators}
+            r.raise_for_status()
+            img = Image.open(BytesIO(r.content)).convert("RGB")
+            img.save(tmp, format="JPEG", quality=85)
+            os.replace(tmp, dest_path)
+            return {"status": r.status_code, "validators": validators_of(r)}
+        except Exception as e:
+            s.fail(e)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return None
+
+
+def _download_with_thumbs(url: str, dest_path: str, validators: dict = None):
+    """download_image() plus gallery thumbnails, all on the worker thread."""
+    result = download_image(url, dest_path, validators)
+    if result and result["status"] != 304 and not get_storage_manager().dedupe(dest_path):
+        make_derivatives(dest_path)
+    return result
+
+
+def read_meta(folder: str) -> dict:
+    try:
+        return json.load(open(os.path.join(folder, "meta.json"), "r", encoding="utf-8"))
+    except Exception:
+        return {}
+
+
+def write_meta(folder: str, meta: dict):
+    path = os.path.join(folder, "meta.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def is_stale(meta: dict, max_age: float = None) -> bool:
+    """True if a saved city was last refreshed more than ``max_age`` seconds ago."""
+    max_age = Config.REFRESH_AFTER if max_age is None else max_age
+    return time.time() - (meta.get("saved_at") or 0) > max_age
+
+
+def _noop(done, total, message):
+    pass
+
+
+def download_city(city: str, info: str = None, spots=None, online: bool = True,
+                  n_images: int = None, progress=None, root: str = None, refresh: bool = False,
+                  max_age: float = None) -> dict:
+    """Save ``city`` under ``<root>/<safe_key(city)>``; resumes a partial folder.
+
+    With ``refresh`` the images already on disk that were fetched more than
+    ``max_age`` seconds ago (default ``REFRESH_AFTER``; 0 for all of them)
+    are revalidated with conditional GETs (ETag / Last-Modified kept in
+    ``meta.json``) and only re-saved when they changed.
+
+    ``progress(done, total, message)`` is called after every finished step.
+    Returns a summary dict with the folder, coordinates and image counts.
+    """
+    progress = progress or _noop
+    n_images = n_images or Config.DOWNLOAD_IMAGES_PER_CITY
+    root = root or Config.CITIES_DIR
+    max_age = Config.REFRESH_AFTER if max_age is None else max_age
+    key = safe_key(city)
+    folder = os.path.join(root, key)
+    os.makedirs(folder, exist_ok=True)
+
+    meta = read_meta(folder)
+    old_coords = (meta.get("lat"), meta.get("lon"))
+    meta.update({
+        "city": city,
+        "info": info or meta.get("info") or f"{city.title()} — saved offline.",
+        "spots": spots if spots is not None else meta.get("spots", []),
+        "complete": False,
+    })
+    pool = get_executor()
+
+    # geocoding and the Unsplash search are independent: run them together
+    geo_future = pool.submit(geocode_city, city)
+    urls = meta.get("image_urls") or []
+    url_future = None
+    if not urls and online and Config.UNSPLASH_ACCESS_KEY:
+        url_future = pool.submit(fetch_unsplash_urls, city, n_images)
+    if url_future is not None:
+        urls = url_future.result()
+    meta["image_urls"] = urls
+    lat, lon = geo_future.result()
+    if lat is None and meta.get("lat") is not None:
+        lat, lon = meta["lat"], meta["lon"]
+    meta["lat"], meta["lon"] = lat, lon
+    write_meta(folder, meta)
+
+    # images still missing from a previous (interrupted) run, plus the stale ones on refresh
+    validators = meta.setdefault("validators", {})
+    fetched_at = meta.setdefault("fetched_at", {})
+    now = time.time()
+    todo = []
+    for i, url in enumerate(urls, start=1):
+        dest = os.path.join(folder, f"img_{i}.jpg")
+        name = os.path.basename(dest)
+        have = os.path.exists(dest) and os.path.getsize(dest) > 0
+        due = refresh and now - fetched_at.get(name, meta.get("saved_at") or 0) > max_age
+        if not have or due:
+            todo.append((url, dest, validators.get(name) if have else None))
+    total = len(todo) + 2
+    done = 1
+    progress(done, total, f"{city}: located" if lat is not None else f"{city}: coordinates unavailable")
+
+    fetched = unchanged = 0
+    if online and todo:
+        futures = {pool.submit(_download_with_thumbs, *item): item[1] for item in todo}
+        for fut in as_completed(futures):
+            done += 1
+            result = fut.result()
+            if result:
+                validators[os.path.basename(futures[fut])] = result["validators"]
+                fetched_at[os.path.basename(futures[fut])] = time.time()
+                if result["status"] == 304:
+                    unchanged += 1
+                else:
+                    fetched += 1
+            progress(done, total, f"{city}: image {done - 1}/{len(todo)}")
+
+    # map tiles for the city's bounding box (tiles shared with nearby cities are skipped)
+    tile_stats = {"wanted": 0, "cached": 0, "fetched": 0}
+    if lat is not None:
+        tile_stats = prefetch_tiles(
+            lat, lon,
+            progress=lambda i, n: progress(done, total, f"{city}: map tiles {i}/{n}"),
+        )
+    map_path = os.path.join(folder, "map.png")
+    if not os.path.exists(map_path) or (lat is not None and (lat, lon) != old_coords) or (refresh and todo):
+        city_map_image(city, lat, lon, dest_path=map_path)
+    saved = sum(1 for fn in os.listdir(folder) if fn.startswith("img_") and fn.endswith(".jpg"))
+    meta["complete"] = saved >= len(urls)
+    meta["saved_at"] = time.time()
+    write_meta(folder, meta)
+    get_city_store().index_folder(folder)
+    evicted = get_storage_manager().enforce(keep={key})
+    get_bundle()  # one-row delta for this city in the offline bundle
+    progress(total, total, f"{city}: saved")
+    return {
+        "city": city,
+        "key": key,
+        "folder": folder,
+        "lat": lat,
+        "lon": lon,
+        "images": saved,
+        "fetched": fetched,
+        "unchanged": unchanged,
+        "tiles": tile_stats,
+        "complete": meta["complete"],
+        "evicted": evicted["cities"],
+    }
+
+
+def prefetch_cities(cities, online: bool = True, progress=None) -> list:
+    """Download several cities in one job.
+
+    ``cities`` is an iterable of (name, info, spots). Cities are processed
+    one after another, each with its own requests fanned out on the pool, so
+    the pool is never oversubscribed by nested waits. Cities already saved
+    completely and refreshed within ``REFRESH_AFTER`` are skipped.
+    """
+    progress = progress or _noop
+    cities = list(cities)
+    results = []
+    for idx, (name, info, spots) in enumerate(cities):
+        rec = get_city_store().get(safe_key(name))
+        if rec and rec["meta"].get("complete") and not is_stale(rec["meta"]):
+            results.append({"city": name, "key": rec["key"], "folder": rec["folder"],
+                            "images": len(rec["images"]), "complete": True, "skipped": True})
+            progress(idx + 1, len(cities), f"{name}: up to date")
+            continue
+
+        def city_progress(done, total, message, idx=idx):
+            progress(idx + done / max(total, 1), len(cities), message)
+        results.append(download_city(name, info, spots, online=online, progress=city_progress))
+    return results
+
+
+def refresh_stale(online: bool = True, max_age: float = None, progress=None) -> list:
+    """Incrementally refresh every saved city not refreshed within ``max_age`` seconds."""
+    progress = progress or _noop
+    stale = [rec for rec in get_city_store().all() if is_stale(rec["meta"], max_age)]
+    results = []
+    for idx, rec in enumerate(stale):
+        def city_progress(done, total, message, idx=idx):
+            progress(idx + done / max(total, 1), len(stale), message)
+        results.append(download_city(rec["city"], online=online, progress=city_progress,
+                                     refresh=True, max_age=max_age))
+    return results
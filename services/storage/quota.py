@@ -0,0 +1,288 @@
+# services/storage/quota.py
+"""Disk quota for offline data: usage accounting, LRU eviction, image
+deduplication and compaction.
+
+Saved city folders and cached TTS clips count towards ``STORAGE_QUOTA_BYTES``
+(0 disables the quota). After every download :meth:`StorageManager.enforce`
+evicts the least recently used cities and clips, oldest first, until usage
+fits again; the city just saved is never evicted by its own download.
+
+- Cities are "used" when their saved images are shown; :meth:`touch_city`
+  records that in the storage backend (``index/used/<key>``), throttled so a
+  rerun does not write on every render. Clips use the TTS cache's own
+  last-used times.
+- Downloaded images are hashed (sha256 of the saved JPEG) and an image
+  identical to one already saved becomes a hard link to it, thumbnails
+  included; the bytes are only freed when the last city using them goes.
+  On filesystems without hard links the copy is simply kept.
+- Folder sizes are measured once per saved-city index version and audio
+  sizes come from the TTS cache's own accounting, so showing usage does not
+  walk the disk on every rerun; hard-linked files are counted once.
+- :meth:`compact` removes what interrupted downloads and evictions leave
+  behind: ``.part``/``.tmp`` files, thumbnails of deleted images, folders
+  with nothing saved in them and dead dedup entries.
+
+Map tiles (``tiles.mbtiles``) are shared by nearby cities and not counted.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from config import Config
+from services.storage.backend import get_backend
+from services.storage.bundle import get_bundle
+from services.storage.citystore import IMAGE_EXTS, get_city_store
+from services.storage.thumbnails import THUMB_DIR, derivative_path
+from services.tts import get_tts_cache
+from tracing import span
+
+LEFTOVER_EXTS = (".part", ".tmp")
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _files(folder: str) -> list:
+    """``(path, stat)`` for every file in a city folder, thumbnails included."""
+    out = []
+    for sub in (folder, os.path.join(folder, THUMB_DIR)):
+        try:
+            entries = list(os.scandir(sub))
+        except OSError:
+            continue
+        for e in entries:
+            try:
+                if e.is_file(follow_symlinks=False):
+                    out.append((e.path, e.stat(follow_symlinks=False)))
+            except OSError:
+                continue
+    return out
+
+
+def _link(src: str, dest: str) -> bool:
+    """Atomically replace ``dest`` with a hard link to ``src``."""
+    tmp = dest + ".link.tmp"
+    try:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        os.link(src, tmp)
+        os.replace(tmp, dest)
+        return True
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+
+class StorageManager:
+    USED_PREFIX = "index/used/"
+    HASH_PREFIX = "index/images/"
+
+    def __init__(self, backend, city_store, cities_dir: str, quota_bytes: int = 0, touch_every: float = 60.0):
+        self.backend = backend
+        self.city_store = city_store
+        self.cities_dir = cities_dir
+        self.quota_bytes = quota_bytes
+        self.touch_every = touch_every
+        self._lock = threading.RLock()
+        self._touched = {}  # key -> monotonic time of the last recorded use
+        self._sizes = {}  # key -> (bytes on disk, bytes freed by deleting it)
+        self._cities_total = 0
+        self._sizes_version = None
+
+    # -- usage ---------------------------------------------------------
+    def touch_city(self, key: str):
+        """Record that a saved city was used (at most once per ``touch_every`` seconds)."""
+        now = time.monotonic()
+        if now - self._touched.get(key, -self.touch_every) < self.touch_every:
+            return
+        self._touched[key] = now
+        try:
+            self.backend.set(f"{self.USED_PREFIX}{key}", str(time.time()).encode())
+        except Exception:
+            pass
+
+    def last_used(self, rec: dict) -> float:
+        try:
+            raw = self.backend.get(f"{self.USED_PREFIX}{rec['key']}")
+        except Exception:
+            raw = None
+        return max(float(raw) if raw else 0.0, rec.get("saved_at") or 0.0)
+
+    def city_sizes(self) -> dict:
+        """key -> (bytes on disk, bytes deleting it would free); remeasured when the index changes."""
+        with self._lock:
+            version = self.city_store.current_version()
+            if version != self._sizes_version:
+                sizes, seen, total = {}, set(), 0
+                for rec in self.city_store.all():
+                    size = own = 0
+                    for _, st in _files(rec["folder"]):
+                        size += st.st_size
+                        if st.st_nlink <= 1:
+                            own += st.st_size
+                        if (st.st_dev, st.st_ino) not in seen:
+                            seen.add((st.st_dev, st.st_ino))
+                            total += st.st_size
+                    sizes[rec["key"]] = (size, own)
+                self._sizes, self._cities_total, self._sizes_version = sizes, total, version
+            return self._sizes
+
+    def usage(self) -> dict:
+        """Bytes used by saved cities and cached audio, against the quota."""
+        with self._lock:
+            sizes = self.city_sizes()
+            audio, clips = get_tts_cache().usage() or (0, 0)
+            return {
+                "cities": self._cities_total, "audio": audio, "total": self._cities_total + audio,
+                "quota": self.quota_bytes, "city_count": len(sizes), "clip_count": clips,
+            }
+
+    # -- eviction ------------------------------------------------------
+    def evict_city(self, key: str):
+        """Delete a saved city's folder and index record."""
+        rec = self.city_store.get(key)
+        if rec is None:
+            return
+        shutil.rmtree(rec["folder"], ignore_errors=True)
+        self.city_store.remove(key)
+        try:
+            self.backend.delete(f"{self.USED_PREFIX}{key}")
+        except Exception:
+            pass
+
+    def enforce(self, keep=()) -> dict:
+        """Evict least recently used cities and clips until usage fits the quota."""
+        stats = {"cities": [], "clips": 0, "freed": 0}
+        if not self.quota_bytes:
+            return stats
+        with self._lock, span("storage.enforce") as s:
+            used = self.usage()["total"]
+            if used <= self.quota_bytes:
+                s.set("within_quota")
+                return stats
+            sizes = self.city_sizes()
+            candidates = [(self.last_used(rec), "city", rec["key"], sizes.get(rec["key"], (0, 0))[1])
+                          for rec in self.city_store.all() if rec["key"] not in keep]
+            tts = get_tts_cache()
+            candidates += [(last or 0.0, "clip", skey, size)
+                           for skey, size, last in self.backend.usage(tts.PREFIX) or []]
+            for _, kind, key, size in sorted(candidates):
+                if used <= self.quota_bytes:
+                    break
+                if kind == "city":
+                    self.evict_city(key)
+                    stats["cities"].append(key)
+                else:
+                    tts.discard(key)
+                    stats["clips"] += 1
+                used -= size
+                stats["freed"] += size
+            if used > self.quota_bytes:
+                s.set("over_quota")  # only protected cities left
+        if stats["cities"]:
+            get_bundle()  # evicted cities drop out of the offline bundle
+        return stats
+
+    # -- deduplication -------------------------------------------------
+    def dedupe(self, path: str) -> bool:
+        """Hard-link ``path`` (and its thumbnails) to an identical saved image, if there is one.
+
+        Returns True when ``path`` now shares storage with another copy.
+        """
+        try:
+            digest = file_digest(path)
+            st = os.stat(path)
+        except OSError:
+            return False
+        hkey = f"{self.HASH_PREFIX}{digest}"
+        rel = os.path.relpath(path, self.cities_dir)
+        with self._lock:
+            raw = self.backend.get(hkey)
+            other = os.path.join(self.cities_dir, raw.decode("utf-8")) if raw else None
+            try:
+                ost = os.stat(other) if other else None
+            except OSError:
+                ost = None
+            if ost is not None and (ost.st_dev, ost.st_ino) == (st.st_dev, st.st_ino):
+                return True
+            # the entry may be stale (that image was re-downloaded since): check the bytes
+            if ost is None or ost.st_size != st.st_size or file_digest(other) != digest:
+                self.backend.set(hkey, rel.encode("utf-8"))
+                return False
+            if not _link(other, path):
+                return False
+        width = Config.THUMB_WIDTH
+        for ext in ("jpg", "webp"):
+            src = derivative_path(other, width, ext)
+            if os.path.exists(src):
+                os.makedirs(os.path.dirname(derivative_path(path, width, ext)), exist_ok=True)
+                _link(src, derivative_path(path, width, ext))
+        return True
+
+    # -- compaction ----------------------------------------------------
+    def compact(self, min_age: float = 3600.0) -> dict:
+        """Remove leftovers of interrupted downloads and evictions; returns counts and bytes freed.
+
+        Temporary files younger than ``min_age`` seconds may belong to a
+        download in progress and are kept.
+        """
+        stats = {"files": 0, "folders": 0, "hashes": 0, "freed": 0}
+        now = time.time()
+        with self._lock, span("storage.compact"):
+            try:
+                folders = [e.path for e in os.scandir(self.cities_dir) if e.is_dir()]
+            except OSError:
+                folders = []
+            for folder in folders:
+                try:
+                    names = set(os.listdir(folder))
+                except OSError:
+                    continue
+                sources = {os.path.splitext(n)[0] for n in names if n.lower().endswith(IMAGE_EXTS)}
+                for path, st in _files(folder):
+                    name = os.path.basename(path)
+                    leftover = name.endswith(LEFTOVER_EXTS) and now - st.st_mtime > min_age
+                    orphan = (os.path.dirname(path).endswith(THUMB_DIR)
+                              and name.rsplit("_", 1)[0] not in sources)
+                    if leftover or orphan:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            continue
+                        stats["files"] += 1
+                        if st.st_nlink <= 1:
+                            stats["freed"] += st.st_size
+                if "meta.json" not in names and not sources:
+                    shutil.rmtree(folder, ignore_errors=True)
+                    if self.city_store.get(os.path.basename(folder)):
+                        self.city_store.remove(os.path.basename(folder))
+                    stats["folders"] += 1
+            for hkey in self.backend.keys(self.HASH_PREFIX):
+                raw = self.backend.get(hkey)
+                if not raw or not os.path.exists(os.path.join(self.cities_dir, raw.decode("utf-8"))):
+                    self.backend.delete(hkey)
+                    stats["hashes"] += 1
+        return stats
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_storage_manager() -> StorageManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = StorageManager(get_backend(), get_city_store(), Config.CITIES_DIR,
+                                      quota_bytes=Config.STORAGE_QUOTA_BYTES)
+        return _manager
@@ -0,0 +1,166 @@
+# services/storage/thumbnails.py
+"""Gallery thumbnails.
+
+Saved images get resized JPEG + WebP derivatives under ``<city>/thumbs/`` at
+download time; the gallery then serves encoded thumbnail bytes from an
+in-memory LRU, so render cost no longer depends on the source image size.
+Transient Unsplash images (city not saved) are fetched in parallel at
+thumbnail width and kept in the same LRU.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from PIL import Image, features
+
+from config import Config
+from httpclient import get_http_client
+from tracing import span
+
+WEBP_OK = features.check("webp")
+THUMB_DIR = "thumbs"
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="thumbs")
+
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buf = BytesIO()
+    if fmt == "WEBP":
+        img.save(buf, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def _resize(img: Image.Image, width: int) -> Image.Image:
+    img = img.convert("RGB")
+    if img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+    return img
+
+
+def derivative_path(src_path: str, width: int, ext: str) -> str:
+    folder, name = os.path.split(src_path)
+    stem = os.path.splitext(name)[0]
+    return os.path.join(folder, THUMB_DIR, f"{stem}_{width}.{ext}")
+
+
+def make_derivatives(src_path: str, width: int = None, quality: int = 80) -> dict:
+    """Write JPEG (and WebP when supported) thumbnails next to ``src_path``."""
+    width = width or Config.THUMB_WIDTH
+    out = {}
+    try:
+        with Image.open(src_path) as im:
+            im.draft("RGB", (width, width))
+            thumb = _resize(im, width)
+    except Exception:
+        return out
+    os.makedirs(os.path.join(os.path.dirname(src_path), THUMB_DIR), exist_ok=True)
+    formats = [("jpg", "JPEG")] + ([("webp", "WEBP")] if WEBP_OK else [])
+    for ext, fmt in formats:
+        path = derivative_path(src_path, width, ext)
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(_encode(thumb, fmt, quality))
+            os.replace(tmp, path)
+            out[ext] = path
+        except OSError:
+            continue
+    return out
+
+
+class ThumbnailCache:
+    """LRU of encoded thumbnail bytes, bounded by total size."""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._data.get(key)
+            if data is not None:
+                self._data.move_to_end(key)
+            return data
+
+    def put(self, key, data: bytes):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._data[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._data) > 1:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+
+
+_cache = ThumbnailCache(max_bytes=Config.THUMB_CACHE_MAX_BYTES)
+
+
+def get_thumbnail(src_path: str, width: int = None):
+    """Thumbnail bytes for a saved image (memory -> disk derivative -> build it)."""
+    width = width or Config.THUMB_WIDTH
+    try:
+        mtime = os.path.getmtime(src_path)
+    except OSError:
+        return None
+    key = (src_path, mtime, width)
+    data = _cache.get(key)
+    if data is not None:
+        return data
+    ext = "webp" if WEBP_OK else "jpg"
+    path = derivative_path(src_path, width, ext)
+    if not (os.path.exists(path) and os.path.getmtime(path) >= mtime):
+        path = make_derivatives(src_path, width).get(ext)
+    if not path:
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    _cache.put(key, data)
+    return data
+
+
+def _sized_url(url: str, width: int) -> str:
+    """Ask the Unsplash/imgix CDN for a pre-scaled image."""
+    parts = urlsplit(url)
+    if "unsplash.com" not in parts.netloc:
+        return url
+    query = dict(parse_qsl(parts.query))
+    query.update({"w": str(width), "q": "75", "fm": "webp" if WEBP_OK else "jpg"})
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _fetch_one(url: str, width: int):
+    key = ("url", url, width)
+    with span("image.thumbnail") as s:
+        data = _cache.get(key)
+        if data is not None:
+            s.set("cache_hit")
+            return data
+        try:
+            r = get_http_client().get(_sized_url(url, width), timeout=8)
+            r.raise_for_status()
+            with Image.open(BytesIO(r.content)) as im:
+                data = _encode(_resize(im, width), "WEBP" if WEBP_OK else "JPEG", 80)
+        except Exception as e:
+            s.fail(e)
+            return None
+        _cache.put(key, data)
+        return data
+
+
+def fetch_thumbnails(urls, width: int = None) -> list:
+    """Fetch remote images in parallel; returns thumbnail bytes (failures dropped)."""
+    width = width or Config.THUMB_WIDTH
+    results = list(_executor.map(lambda u: _fetch_one(u, width), urls))
+    return [r for r in results if r]
@@ -0,0 +1,264 @@
+# services/tts.py
+"""Text-to-speech helpers (gTTS): a content-addressed audio cache and
+sentence-level synthesis of a streamed reply so audio is ready as soon as the
+text finishes.
+"""
+import glob
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from config import Config
+from httpclient import get_http_client
+from services.storage.backend import get_backend
+from tracing import span
+
+# split after ., ! or ? followed by whitespace, or on blank lines
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+# markdown that gTTS would otherwise read out: emphasis, code ticks, list bullets
+MARKDOWN = re.compile(r"\*\*|__|`|^\s*[-*]\s+", re.MULTILINE)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tts")
+
+
+def synthesize(text: str, lang: str = "en"):
+    """Return MP3 bytes for ``text`` or None on failure."""
+    if not text or not text.strip():
+        return None
+    with span("tts.synthesize") as s:
+        try:
+            if Config.TTS_URL:
+                return _synthesize_http(text, lang)
+            from gtts import gTTS  # imported on first synthesis, not at app start
+
+            buf = BytesIO()
+            gTTS(text=text, lang=lang).write_to_fp(buf)
+            return buf.getvalue()
+        except Exception as e:
+            s.fail(e)
+            return None
+
+
+def _synthesize_http(text: str, lang: str):
+    """MP3 bytes from the ``TTS_URL`` endpoint (self-hosted TTS or a benchmark stand-in)."""
+    r = get_http_client().get(Config.TTS_URL, params={"text": text, "lang": lang}, timeout=15)
+    r.raise_for_status()
+    return r.content or None
+
+
+class TTSCache:
+    """MP3 clips in the storage backend keyed by sha256(lang, text), bounded to ``max_bytes``.
+
+    Least recently used clips are evicted first (hits refresh the last-used
+    time); backends that evict by themselves (Redis) are left to do so.
+    A small in-memory LRU sits in front so repeated playback skips storage.
+    """
+
+    PREFIX = "tts/"
+
+    def __init__(self, backend, max_bytes: int = 50 * 1024 * 1024, mem_items: int = 64):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.mem_items = mem_items
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        usage = backend.usage(self.PREFIX)
+        self._sizes = None if usage is None else {k: size for k, size, _ in usage}
+        self._total = sum(self._sizes.values()) if self._sizes else 0
+
+    @staticmethod
+    def key(text: str, lang: str) -> str:
+        return hashlib.sha256(f"{lang}\0{text.strip()}".encode("utf-8")).hexdigest()[:32]
+
+    def _skey(self, key: str) -> str:
+        return f"{self.PREFIX}{key}.mp3"
+
+    def get(self, text: str, lang: str):
+        key = self.key(text, lang)
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key]
+        try:
+            data = self.backend.get(self._skey(key))
+        except Exception:
+            return None
+        if data is None:
+            return None
+        try:
+            self.backend.touch(self._skey(key))
+        except Exception:
+            pass  # only the eviction order suffers
+        self._remember(key, data)
+        return data
+
+    def put(self, text: str, lang: str, data: bytes):
+        key = self.key(text, lang)
+        try:
+            self.backend.set(self._skey(key), data)
+        except Exception:
+            return
+        self._remember(key, data)
+        if self._sizes is not None:
+            with self._lock:
+                self._total += len(data) - self._sizes.get(self._skey(key), 0)
+                self._sizes[self._skey(key)] = len(data)
+            self._evict()
+
+    def usage(self):
+        """(bytes, clips) as tracked by this process, or None if the backend evicts by itself."""
+        with self._lock:
+            return None if self._sizes is None else (self._total, len(self._sizes))
+
+    def discard(self, skey: str):
+        """Delete one clip by storage key (used by the storage quota)."""
+        self.backend.delete(skey)
+        with self._lock:
+            if self._sizes is not None:
+                self._total -= self._sizes.pop(skey, 0)
+            self._mem.pop(skey[len(self.PREFIX):-len(".mp3")], None)
+
+    def _remember(self, key: str, data: bytes):
+        with self._lock:
+            self._mem[key] = data
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.mem_items:
+                self._mem.popitem(last=False)
+
+    def _evict(self):
+        with self._lock:
+            if self._total <= self.max_bytes:
+                return
+            # re-read sizes and last-used times: other processes write here too
+            usage = sorted(self.backend.usage(self.PREFIX), key=lambda u: u[2] or 0)
+            self._sizes = {k: size for k, size, _ in usage}
+            self._total = sum(self._sizes.values())
+            for skey, size, _ in usage:
+                if self._total <= self.max_bytes:
+                    break
+                self.backend.delete(skey)
+                self._total -= self._sizes.pop(skey, 0)
+                self._mem.pop(skey[len(self.PREFIX):-len(".mp3")], None)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache() -> TTSCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TTSCache(get_backend(), max_bytes=Config.TTS_CACHE_MAX_BYTES)
+            # clips written by older versions were never reused
+            for stale in glob.glob(os.path.join(Config.DATA_DIR, "tts_*.mp3")):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        return _cache
+
+
+def speech_text(text: str) -> str:
+    """``text`` as it is spoken (and cached): chat markdown removed."""
+    return MARKDOWN.sub("", text or "").strip()
+
+
+def synthesize_cached(text: str, lang: str = "en"):
+    """Cached synthesize(): a hit needs no network at all."""
+    text = speech_text(text)
+    if not text:
+        return None
+    with span("tts") as s:
+        cache = get_tts_cache()
+        data = cache.get(text, lang)
+        if data is not None:
+            s.set("cache_hit")
+            return data
+        data = synthesize(text, lang)
+        if data:
+            cache.put(text, lang, data)
+        else:
+            s.set("error")  # reason is on the tts.synthesize span
+        return data
+
+
+_inflight = {}  # cache key -> Future of a synthesis still running
+_inflight_lock = threading.Lock()
+
+
+def synthesize_async(text: str, lang: str = "en"):
+    """synthesize_cached() on the TTS pool; a text already being synthesized shares that future."""
+    key = TTSCache.key(speech_text(text), lang)
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        if fut is not None:
+            return fut
+        fut = _inflight[key] = _executor.submit(synthesize_cached, text, lang)
+
+    def done(_):
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    fut.add_done_callback(done)
+    return fut
+
+
+def prerender(texts, lang: str = "en") -> int:
+    """Synthesize ``texts`` into the cache in parallel; returns how many are available."""
+    futures = [synthesize_async(t, lang) for t in texts if t]
+    return sum(1 for f in futures if f.result())
+
+
+def cached_speech(texts, lang: str = "en"):
+    """The clips for ``texts`` joined into one MP3 if every one is cached, else None (never synthesizes)."""
+    cache = get_tts_cache()
+    clips = [cache.get(speech_text(t), lang) for t in texts if speech_text(t)]
+    return b"".join(clips) if clips and all(c is not None for c in clips) else None
+
+
+class StreamingSpeaker:
+    """Pass text chunks through while synthesizing finished sentences in the background.
+
+    Sentences are batched until at least ``min_chars`` long so gTTS is not
+    called once per three-word fragment. ``texts`` lists the batches in
+    order; play them with :func:`cached_speech` once they are cached.
+    """
+
+    def __init__(self, lang: str = "en", min_chars: int = 80):
+        self.lang = lang
+        self.min_chars = min_chars
+        self.texts = []
+        self._buf = ""
+        self._pending = ""
+
+    def tee(self, chunks):
+        for chunk in chunks:
+            if chunk:
+                self._buf += chunk
+                self._flush(final=False)
+            yield chunk
+        self._flush(final=True)
+
+    def _submit(self, text: str):
+        if text.strip():
+            self.texts.append(text.strip())
+            synthesize_async(text.strip(), self.lang)
+
+    def _flush(self, final: bool):
+        parts = SENTENCE_BOUNDARY.split(self._buf)
+        if final:
+            complete, self._buf = parts, ""
+        else:
+            complete, self._buf = parts[:-1], parts[-1]
+        for sentence in complete:
+            self._pending = f"{self._pending} {sentence}".strip()
+            if len(self._pending) >= self.min_chars:
+                self._submit(self._pending)
+                self._pending = ""
+        if final:
+            self._submit(self._pending)
+            self._pending = ""
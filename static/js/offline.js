@@ -30,14 +30,54 @@ class OfflineManager {
     }
 
     async loadOfflineData() {
+        // The app exports the offline bundle as bundle.json (full) and
+        // bundle.delta.json (cities changed by the latest version). A cached
+        // copy one version behind is patched with the delta instead of
+        // downloading the whole bundle again.
+        const defaults = this.getDefaultOfflineData();
         try {
-            const response = await fetch('/data/offline_data.json');
-            this.offlineData = await response.json();
-            console.log('Offline data loaded');
+            let bundle = await this.getCachedData('bundle');
+            const delta = await this.fetchJSON('/data/bundle.delta.json');
+            if (bundle && delta && delta.version !== bundle.version) {
+                bundle = delta.base === bundle.version ? this.applyDelta(bundle, delta) : null;
+            }
+            if (!bundle) {
+                bundle = await this.fetchJSON('/data/bundle.json');
+            }
+            if (!bundle) {
+                throw new Error('bundle unavailable');
+            }
+            await this.cacheData('bundle', bundle);
+            this.offlineData = {
+                ...defaults,
+                version: bundle.version,
+                destinations: { ...defaults.destinations, ...bundle.destinations }
+            };
+            console.log(`Offline bundle v${bundle.version} loaded`);
         } catch (error) {
             console.error('Failed to load offline data:', error);
-            this.offlineData = this.getDefaultOfflineData();
+            const cached = await this.getCachedData('bundle');
+            this.offlineData = cached
+                ? { ...defaults, version: cached.version, destinations: { ...defaults.destinations, ...cached.destinations } }
+                : defaults;
+        }
+    }
+
+    async fetchJSON(url) {
+        try {
+            const response = await fetch(url, { cache: 'no-cache' });
+            return response.ok ? await response.json() : null;
+        } catch (error) {
+            return null;
+        }
+    }
+
+    applyDelta(bundle, delta) {
+        const destinations = { ...bundle.destinations, ...delta.destinations };
+        for (const key of delta.removed || []) {
+            delete destinations[key];
         }
+        return { version: delta.version, destinations };
     }
 
     getDefaultOfflineData() {
@@ -1,292 +1,271 @@
 # streamlit_app.py
 import os
-import re
-import json
 import time
-import requests
+import hashlib
+import uuid
+import importlib.util
 import streamlit as st
-from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
-from gtts import gTTS
+from PIL import Image
 from dotenv import load_dotenv
 
-# Optional imports (graceful fallback)
-try:
-    from openai import OpenAI
-except Exception:
-    OpenAI = None
-
-try:
-    import folium
-    from streamlit_folium import st_folium
-    FOLIUM_OK = True
-except Exception:
-    FOLIUM_OK = False
+from config import Config
+from connectivity import get_monitor
+from services.ai import cache_stats, gpt_reply_stream
+from services.geo.cityner import detect_city, get_matcher
+from services.geo.geocoding import get_geocode_cache
+from services.geo.itinerary import describe_itinerary, is_itinerary_query, parse_days, plan_itinerary
+from services.geo.maps import make_placeholder_map_image, render_route_map, render_static_map
+from services.geo.poi import describe_nearby, get_poi_index, is_nearby_query, parse_radius_km
+from services.geo.tiles import tile_url_template
+from services.jobs import ACTIVE, get_job_queue
+from services.retrieval import answer_offline, overview
+from services.storage.bundle import get_bundle
+from services.storage.citystore import get_city_store
+from services.storage.conversation import get_conversation_store, new_owner_key, new_session_id, valid_owner_key
+from services.storage.downloader import is_stale
+from services.storage.quota import get_storage_manager
+from services.storage.thumbnails import fetch_thumbnails, get_thumbnail
+from services.tts import StreamingSpeaker, cached_speech
+from tracing import finish_request, get_metrics, span, start_metrics_server, start_request
+from utils import safe_key
+
+# Optional imports (graceful fallback). folium + streamlit_folium cost about a
+# second to import, so only check they are installed here and import them
+# when a map is actually drawn.
+FOLIUM_OK = all(importlib.util.find_spec(m) is not None for m in ("folium", "streamlit_folium"))
 
 load_dotenv()
 
 # -----------------------
 # CONFIG / PATHS
 # -----------------------
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-UNSPLASH_ACCESS_KEY = os.getenv("UNSPLASH_ACCESS_KEY", "")
-DATA_DIR = "data"
-CITIES_DIR = os.path.join(DATA_DIR, "cities")
-os.makedirs(CITIES_DIR, exist_ok=True)
-os.makedirs(DATA_DIR, exist_ok=True)
+OPENAI_API_KEY = Config.OPENAI_API_KEY or ""
+UNSPLASH_ACCESS_KEY = Config.UNSPLASH_ACCESS_KEY
+DATA_DIR = Config.DATA_DIR
+CITIES_DIR = Config.CITIES_DIR
+OWNER_COOKIE = "tourguide_owner"  # browser-held key that owns its ?sid= sessions
+
+
+@st.cache_resource(show_spinner=False)
+def bootstrap():
+    """One-time process setup; Streamlit reruns reuse the result instead of redoing it."""
+    os.makedirs(CITIES_DIR, exist_ok=True)
+    get_monitor()  # starts the background network prober
+    get_bundle()  # compiles data/bundle.sqlite (+ JSON exports) if missing or stale
+    if Config.METRICS_PORT:
+        start_metrics_server(Config.METRICS_PORT, host=Config.METRICS_HOST)
+    return {"city_store": get_city_store(), "conversations": get_conversation_store(), "jobs": get_job_queue(),
+            "storage": get_storage_manager()}
+
+
+services = bootstrap()
+trace = start_request("rerun")  # spans on this thread are collected for the debug panel
 
 # Streamlit page
 st.set_page_config(page_title="AI Tour Guide", layout="wide")
 st.title("🌍 AI Tour Guide — Interactive, Online + Offline Ready")
 
 # -----------------------
-# OFFLINE SAMPLE DATABASE
+# OFFLINE KNOWLEDGE (built-in + offline_data.json + saved meta, one versioned bundle)
 # -----------------------
-OFFLINE_CITIES = {
-    "bengaluru": {
-        "info": "Bengaluru — the tech capital of India, known for gardens, cafés, and a lively startup scene.",
-        "spots": ["Cubbon Park", "Lalbagh Botanical Garden", "Vidhana Soudha", "Church Street"]
-    },
-    "mysuru": {
-        "info": "Mysuru — royal city famous for the Mysore Palace, Dasara festival, and sandalwood crafts.",
-        "spots": ["Mysore Palace", "Chamundi Hills", "Brindavan Gardens"]
-    },
-    "mangaluru": {
-        "info": "Mangaluru — coastal city known for beaches, temples and seafood.",
-        "spots": ["Panambur Beach", "Kadri Manjunatha Temple", "St. Aloysius Chapel"]
-    },
-    "udupi": {
-        "info": "Udupi — temple town famous for Krishna Matha and coastal cuisine.",
-        "spots": ["Sri Krishna Matha", "Malpe Beach", "St. Mary's Island"]
-    },
-    "coorg": {
-        "info": "Coorg (Kodagu) — hill station known for coffee estates and waterfalls.",
-        "spots": ["Abbey Falls", "Dubare Elephant Camp", "Raja's Seat"]
-    },
-    "chikmagalur": {
-        "info": "Chikmagalur — coffee country and trekking destination.",
-        "spots": ["Mullayanagiri", "Hebbe Falls", "Baba Budangiri"]
-    },
-    "hampi": {
-        "info": "Hampi — UNESCO World Heritage site with ruins of the Vijayanagara Empire.",
-        "spots": ["Virupaksha Temple", "Vittala Temple", "Matanga Hill"]
-    },
-    "gokarna": {
-        "info": "Gokarna — relaxed beaches and spiritual temples.",
-        "spots": ["Om Beach", "Kudle Beach", "Mahabaleshwar Temple"]
-    }
-}
+bundle = get_bundle()
 
 # -----------------------
 # UTILITIES
 # -----------------------
-def safe_key(s: str) -> str:
-    """Normalize a city name into a safe folder key."""
-    return "".join(c for c in s.lower().strip().replace(" ", "") if (c.isalnum() or c in "-"))
-
-def is_online(timeout: float = 2.0) -> bool:
-    """Quick network check."""
-    try:
-        requests.get("https://www.google.com", timeout=timeout)
-        return True
-    except Exception:
-        return False
-
-def make_placeholder_map_image(city: str, lat=None, lon=None, dest_path: str = None, w=900, h=480) -> Image.Image:
-    """Create a simple placeholder 'map' image and optionally save it."""
-    img = Image.new("RGB", (w, h), (245, 245, 245))
-    draw = ImageDraw.Draw(img)
-    try:
-        font = ImageFont.truetype("DejaVuSans.ttf", 22)
-    except Exception:
-        font = None
-    draw.text((20, 20), f"{city.title()}", fill=(30, 30, 30), font=font)
-    if lat is not None and lon is not None:
-        draw.text((20, 60), f"Coordinates: {lat:.5f}, {lon:.5f}", fill=(80, 80, 80), font=font)
-    # grid background to resemble a map
-    for x in range(20, w - 20, 60):
-        draw.line(((x, 120), (x, h - 20)), fill=(230, 230, 230))
-    for y in range(120, h - 20, 60):
-        draw.line(((20, y), (w - 20, y)), fill=(230, 230, 230))
-    if dest_path:
-        try:
-            img.save(dest_path)
-        except Exception:
-            pass
-    return img
-
-def geocode_city(city: str):
-    """Return (lat, lon) using Nominatim. Returns (None, None) on failure."""
-    try:
-        r = requests.get(
-            "https://nominatim.openstreetmap.org/search",
-            params={"q": city, "format": "json", "limit": 1},
-            headers={"User-Agent": "ai-tour-guide"},
-            timeout=8,
-        )
-        r.raise_for_status()
-        data = r.json()
-        if data:
-            return float(data[0]["lat"]), float(data[0]["lon"])
-    except Exception:
-        return None, None
-    return None, None
-
-def fetch_unsplash_urls(city: str, n: int = 3):
-    """Return list of Unsplash image URLs (requires UNSPLASH_ACCESS_KEY)."""
-    if not UNSPLASH_ACCESS_KEY:
-        return []
-    try:
-        r = requests.get(
-            "https://api.unsplash.com/search/photos",
-            params={"query": city, "per_page": n, "client_id": UNSPLASH_ACCESS_KEY},
-            timeout=8,
-        )
-        r.raise_for_status()
-        results = r.json().get("results", [])
-        return [it["urls"]["regular"] for it in results[:n] if "urls" in it]
-    except Exception:
-        return []
-
-def download_image(url: str, dest_path: str) -> bool:
-    """Download an image by URL to dest_path. Return True on success."""
-    try:
-        r = requests.get(url, timeout=12)
-        r.raise_for_status()
-        img = Image.open(BytesIO(r.content)).convert("RGB")
-        img.save(dest_path, format="JPEG", quality=85)
-        return True
-    except Exception:
-        return False
-
-def gpt_reply(city: str, user_text: str, model: str = "gpt-3.5-turbo"):
-    """Call OpenAI ChatCompletion (if available). Returns string or None."""
-    if not OPENAI_API_KEY or OpenAI is None:
-        return None
-    try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        prompt = (
-            f"You are a knowledgeable local tour guide. The user asked: '{user_text}'. "
-            f"Provide 3 concise, actionable recommendations for {city}. Include food, attractions, and a hidden gem. End with a short follow-up question."
-        )
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=400,
-            temperature=0.8,
-        )
-        try:
-            return resp.choices[0].message.content.strip()
-        except Exception:
-            try:
-                return resp.choices[0].text.strip()
-            except Exception:
-                return str(resp)
-    except Exception:
-        return None
-
-def speak(text: str, lang: str = "en"):
-    """Use gTTS to synthesize speech and play audio (best-effort)."""
-    if not text:
+def is_online() -> bool:
+    """Cached network status from the shared background prober (non-blocking)."""
+    return get_monitor().is_online()
+
+def reply_audio():
+    """The last reply's speech once its tts_prerender job lands; polls while it runs, then reruns the page once."""
+    speech = st.session_state.get("speech")
+    if not speech:
         return
-    try:
-        tts = gTTS(text=text, lang=lang)
-        tmp = os.path.join(DATA_DIR, f"tts_{int(time.time())}.mp3")
-        tts.save(tmp)
-        st.audio(open(tmp, "rb").read())
-    except Exception:
-        # Ignore TTS errors silently to avoid breaking UI
-        pass
-
-def load_context():
-    ctx_path = os.path.join(DATA_DIR, "context.json")
-    if os.path.exists(ctx_path):
+    job = jobs.get(speech["job"]) if speech["job"] else None
+    if job and job["status"] in ACTIVE:
+        st.caption("Preparing audio…")
+        return
+    if st.session_state.pop("speech_pending", False):
+        st.session_state["reply_ready"] = True
+        st.rerun()  # stops the polling; the page redraws with the audio
+    audio = cached_speech(speech["texts"], speech["lang"])
+    if audio:
+        st.audio(audio, format="audio/mp3")
+
+def speak(texts: list, lang: str = "en"):
+    """Play speech for the reply: straight from the TTS cache, else once a background job synthesized it."""
+    texts = [t for t in texts if t and t.strip()]
+    if not texts:
+        return
+    with span("speak") as s:
         try:
-            return json.load(open(ctx_path, "r", encoding="utf-8"))
-        except Exception:
-            return {}
-    return {}
-
-def save_context(ctx: dict):
-    ctx_path = os.path.join(DATA_DIR, "context.json")
-    json.dump(ctx, open(ctx_path, "w", encoding="utf-8"), indent=2, ensure_ascii=False)
+            audio = cached_speech(texts, lang)
+            if audio is None and not is_online():
+                s.set("no_audio")  # synthesis needs the network
+                return
+            job_id = None
+            if audio is None:
+                job_id = jobs.submit("tts_prerender", {"texts": texts, "lang": lang})
+                s.set("queued")
+            else:
+                s.set("cache_hit")
+            st.session_state["speech"] = {"job": job_id, "texts": texts, "lang": lang}
+            st.session_state["speech_pending"] = job_id is not None
+        except Exception as e:
+            # keep the UI going; the reason shows up in the debug panel
+            s.fail(e)
+            return
+    st.fragment(reply_audio, run_every=1.0 if job_id else None)()
 
 # -----------------------
-# DIAGNOSTIC SIDEBAR: absolute paths & saved folders
+# DEBUG SIDEBAR: per-stage timings and failures (filled in at the end of the run)
 # -----------------------
-st.sidebar.markdown("### Debug & Offline Storage")
-abs_data_dir = os.path.abspath(DATA_DIR)
-st.sidebar.write("App cwd:", os.getcwd())
-st.sidebar.write("data absolute path:", abs_data_dir)
-cities_root = os.path.join(abs_data_dir, "cities")
-st.sidebar.write("cities root:", cities_root)
-if os.path.exists(cities_root):
-    saved = sorted([d for d in os.listdir(cities_root) if os.path.isdir(os.path.join(cities_root, d))])
-    if not saved:
-        st.sidebar.info("No saved city folders (use 'Download for offline').")
-    else:
-        st.sidebar.markdown("Saved city folders:")
-        for f in saved:
-            p = os.path.join(cities_root, f)
-            try:
-                files = sorted(os.listdir(p))
-                st.sidebar.write(f"- {f} — {', '.join(files) if files else '(empty)'}")
-            except Exception as e:
-                st.sidebar.write(f"- {f} — read error: {e}")
-else:
-    st.sidebar.warning("No data/cities folder exists yet. Use the Download tool to create one.")
+city_store = services["city_store"]
+debug_panel = st.sidebar.expander("Debug: timings & errors")
+with debug_panel:
+    st.caption(f"Data: {os.path.abspath(DATA_DIR)}")
+    if st.button("Re-index saved cities"):
+        city_store.rebuild()
 
 # -----------------------
 # SIDEBAR: controls (download / list)
 # -----------------------
 online = is_online()
 st.sidebar.markdown("---")
-st.sidebar.markdown(f"*Network status:* {'🟢 Online' if online else '🔴 Offline'}")
+
+def service_health():
+    """Network badge and per-service health; "Re-check network" reruns only this fragment."""
+    st.markdown(f"*Network status:* {'🟢 Online' if is_online() else '🔴 Offline'}")
+    with st.expander("Service health"):
+        for name, h in get_monitor().status().items():
+            if name == "internet":
+                continue
+            badge = "🟢" if h["reachable"] and h["state"] == "closed" else ("🟡" if h["reachable"] else "🔴")
+            st.write(f"{badge} {name} — {h['state']}" + (f" ({h['last_error']})" if h["last_error"] else ""))
+        rc = cache_stats()
+        st.write(f"Reply cache — {rc['size']} entries, {rc['hits']} hits / {rc['misses']} misses, {rc['coalesced']} coalesced")
+        if st.button("Re-check network"):
+            get_monitor().refresh()
+            st.rerun(scope="fragment")
+
+with st.sidebar:
+    st.fragment(service_health)()
 voice_lang = st.sidebar.selectbox("TTS language", ["en", "hi", "kn"], index=0)
 
 st.sidebar.markdown("---")
+# downloads run on the background job queue; this session only tracks job ids
+jobs = services["jobs"]
+my_jobs = st.session_state.setdefault("jobs", [])
+JOB_LABELS = {"download_city": "Download", "prefetch_cities": "Download all",
+              "refresh_stale": "Refresh", "storage_cleanup": "Free space"}
+
+def track_job(job_id: str):
+    if job_id not in my_jobs:
+        my_jobs.append(job_id)
+
 dl_city = st.sidebar.text_input("Download city for offline (exact name):", value="")
 if st.sidebar.button("Download for offline"):
     if not dl_city.strip():
         st.sidebar.error("Enter a city name to download.")
     else:
-        k = safe_key(dl_city)
-        folder = os.path.join(CITIES_DIR, k)
-        os.makedirs(folder, exist_ok=True)
-        # meta.json
-        meta = {
-            "city": dl_city,
-            "info": OFFLINE_CITIES.get(k, {}).get("info", f"{dl_city.title()} — saved offline."),
-            "spots": OFFLINE_CITIES.get(k, {}).get("spots", []),
-            "saved_at": time.time()
-        }
-        try:
-            json.dump(meta, open(os.path.join(folder, "meta.json"), "w", encoding="utf-8"), indent=2, ensure_ascii=False)
-        except Exception:
-            pass
-        saved_images = 0
-        if online and UNSPLASH_ACCESS_KEY:
-            urls = fetch_unsplash_urls(dl_city, n=4)
-            for i, url in enumerate(urls, start=1):
-                dest = os.path.join(folder, f"img_{i}.jpg")
-                if download_image(url, dest):
-                    saved_images += 1
-        # geocode + placeholder map
-        lat, lon = (None, None)
-        if online:
-            lat, lon = geocode_city(dl_city)
-        map_path = os.path.join(folder, "map.png")
-        make_placeholder_map_image(dl_city, lat or 0.0, lon or 0.0, dest_path=map_path)
-        st.sidebar.success(f"Saved {dl_city} offline — images: {saved_images} — folder: {folder}")
+        known = bundle.city(dl_city) or {}
+        # downloading a saved city again revalidates its images instead of skipping them
+        refresh = "saved" in known.get("sources", [])
+        track_job(jobs.submit(
+            "download_city",
+            {"city": dl_city, "info": known.get("info"), "spots": known.get("spots", []), "lang": voice_lang,
+             "refresh": refresh},
+            key=safe_key(dl_city),
+        ))
+if st.sidebar.button("Download all built-in cities"):
+    builtin = [bundle.city(k) for k in bundle.keys(source="builtin")]
+    track_job(jobs.submit(
+        "prefetch_cities",
+        {"cities": [{"city": c["key"], "info": c["info"], "spots": c["spots"]} for c in builtin], "lang": voice_lang},
+        key="builtin",
+    ))
+
+def mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f} MB"
+
+def job_summary(job: dict) -> str:
+    r = job["result"] or {}
+    if job["kind"] == "download_city":
+        note = "" if r.get("complete") else " (incomplete — run again to resume)"
+        if r.get("unchanged"):
+            note += f" ({r['unchanged']} unchanged)"
+        if r.get("evicted"):
+            note += f" — removed to stay within the storage quota: {', '.join(r['evicted'])}"
+        return f"Saved {r.get('city')} offline — images: {r.get('images')} — folder: {r.get('folder')}{note}"
+    if job["kind"] == "refresh_stale":
+        return f"Refreshed {r.get('cities')} cities — {r.get('fetched')} images updated, {r.get('unchanged')} unchanged"
+    if job["kind"] == "storage_cleanup":
+        removed = f" — removed {', '.join(r['cities'])}" if r.get("cities") else ""
+        return f"Freed {mb(r.get('freed', 0))} ({r.get('files')} leftover files, {r.get('clips')} audio clips){removed}"
+    skipped = f" ({r['skipped']} already up to date)" if r.get("skipped") else ""
+    return f"Saved {r.get('cities')} cities — images: {r.get('images')}{skipped}"
+
+def job_panel():
+    """This session's downloads; polls while any is running, then reruns the page once."""
+    running = False
+    for job_id in list(my_jobs):
+        job = jobs.get(job_id)
+        if job is None or job["kind"] not in JOB_LABELS:
+            continue
+        label = JOB_LABELS[job["kind"]]
+        if job["status"] in ACTIVE:
+            running = True
+            st.progress(job["progress"] or 0.0, text=f"{label}: {job['message']}")
+        elif job["status"] == "done":
+            st.success(job_summary(job))
+        else:
+            st.error(f"{label} failed: {job['error']}")
+    if st.session_state.get("jobs_running") and not running:
+        st.session_state["jobs_running"] = False
+        st.rerun()  # refresh saved-city lists now that a job finished
+    st.session_state["jobs_running"] = running
+    if my_jobs and not running and st.button("Clear finished jobs"):
+        my_jobs.clear()
+        st.rerun()
+
+any_running = any((jobs.get(j) or {}).get("status") in ACTIVE for j in my_jobs)
+with st.sidebar:
+    st.fragment(job_panel, run_every=1.0 if any_running else None)()
 
 st.sidebar.markdown("---")
 st.sidebar.markdown("### Saved offline cities")
-folders = sorted([d for d in os.listdir(CITIES_DIR) if os.path.isdir(os.path.join(CITIES_DIR, d))]) if os.path.exists(CITIES_DIR) else []
-if not folders:
+storage = services["storage"]
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def saved_city_listing(version: int) -> list:
+    """(key, bytes, saved_at) per saved city; rebuilt only when the city store's version moves."""
+    sizes = storage.city_sizes()
+    return [(rec["key"], sizes.get(rec["key"], (0, 0))[0], rec["saved_at"]) for rec in city_store.all()]
+
+saved = saved_city_listing(city_store.current_version())
+if not saved:
     st.sidebar.info("No saved cities. Use Download for offline.")
 else:
-    for f in folders:
-        st.sidebar.write("•", f)
+    for key, size, _ in saved:
+        st.sidebar.write("•", key, f"({mb(size)})")
+
+def storage_panel():
+    """Usage against the quota; the buttons queue jobs, then rerun the page so the job panel polls."""
+    use = storage.usage()
+    if use["quota"]:
+        st.progress(min(1.0, use["total"] / use["quota"]), text=f"{mb(use['total'])} of {mb(use['quota'])}")
+    st.caption(f"Cities: {mb(use['cities'])} ({use['city_count']}) · Audio: {mb(use['audio'])} ({use['clip_count']} clips)")
+    stale = sum(1 for _, _, saved_at in saved if is_stale({"saved_at": saved_at}))
+    if stale and st.button(f"Refresh stale cities ({stale})"):
+        track_job(jobs.submit("refresh_stale", {}, key="stale"))
+        st.rerun()
+    if st.button("Free space now"):
+        track_job(jobs.submit("storage_cleanup", {}, key="cleanup"))
+        st.rerun()
+
+with st.sidebar.expander("Storage"):
+    st.fragment(storage_panel)()
 
 # -----------------------
 # SPEECH BUTTON (populates query param 'q')
@@ -304,9 +283,26 @@ st.components.v1.html(
       r.lang = 'en-IN';
       r.onresult = (ev) => {
         const text = ev.results[0][0].transcript;
-        const url = new URL(window.location);
+        // submit through the chat box: one ordinary rerun, no page reload
+        try {
+          const doc = window.parent.document;
+          const box = doc.querySelector('[data-testid="stChatInputTextArea"]');
+          const send = doc.querySelector('[data-testid="stChatInputSubmitButton"]');
+          if (box && send) {
+            const setValue = Object.getOwnPropertyDescriptor(window.parent.HTMLTextAreaElement.prototype, 'value').set;
+            setValue.call(box, text);
+            box.dispatchEvent(new Event('input', {bubbles: true}));
+            setTimeout(() => send.click(), 50);
+            return;
+          }
+        } catch (e) {}
+        // fallback: reload with ?q= and a one-time id so the query is answered once
+        let loc = window.location;
+        try { loc = window.parent.location; } catch (e) {}
+        const url = new URL(loc.href);
         url.searchParams.set('q', text);
-        window.location = url.toString();
+        url.searchParams.set('qid', Date.now().toString(36) + Math.random().toString(36).slice(2, 8));
+        loc.href = url.toString();
       };
       r.start();
     };
@@ -317,109 +313,174 @@ st.components.v1.html(
 )
 
 # -----------------------
-# PERSISTENT CONTEXT
+# PER-SESSION CONVERSATION (append-only log, survives page reloads via ?sid=)
 # -----------------------
-context = load_context()
-if "chat" not in context:
-    context["chat"] = []
-if "last_city" not in context:
-    context["last_city"] = None
+# ?sid= alone would let anyone with a copied link read and extend the chat, so a
+# session also needs this browser's owner key, kept in a cookie and never in the URL
+def owner_cookie():
+    try:
+        return st.context.cookies.get(OWNER_COOKIE)
+    except Exception:
+        return None  # no browser connection (bare or test runs)
+
+owner_key = st.session_state.get("owner_key") or owner_cookie()
+if not valid_owner_key(owner_key):
+    owner_key = new_owner_key()
+st.session_state["owner_key"] = owner_key
+if owner_cookie() != owner_key:
+    st.components.v1.html(
+        """<script>
+  const secure = window.location.protocol === 'https:' ? '; Secure' : '';
+  document.cookie = '%s=%s; path=/; max-age=31536000; SameSite=Strict' + secure;
+</script>""" % (OWNER_COOKIE, owner_key),
+        height=0,
+    )
+session_id = st.session_state.get("session_id")
+if session_id is None:
+    session_id = st.query_params.get("sid")
+    if not services["conversations"].authorize(session_id, owner_key):
+        session_id = new_session_id()  # someone else's (or no) session: start a fresh one
+        services["conversations"].authorize(session_id, owner_key)
+st.session_state["session_id"] = session_id
+if st.query_params.get("sid") != session_id:
+    st.query_params["sid"] = session_id
+conversation = services["conversations"].get(session_id)
 
 # -----------------------
 # QUERY PARAMS (speech)
 # -----------------------
 params = st.query_params
-speech_q = params.get("q", [""])[0] if "q" in params else ""
+
+def take_speech_query():
+    """The ``?q=`` speech query and its request id; the params are cleared so a rerun doesn't see them again.
+
+    Without a ``qid`` the id is the text hashed with this page load's id, so
+    the same question spoken after a reload is answered again.
+    """
+    q = params.get("q", "")
+    if not q:
+        return "", None
+    page_load = st.session_state.setdefault("page_load", uuid.uuid4().hex[:16])
+    qid = params.get("qid") or hashlib.sha256(f"{page_load}\0{q}".encode("utf-8")).hexdigest()[:16]
+    params.pop("q", None)
+    params.pop("qid", None)
+    return q, f"speech:{qid}"
+
+speech_q, speech_id = take_speech_query()
 
 # -----------------------
 # RENDER EXISTING CHAT
 # -----------------------
-for msg in context.get("chat", []):
-    with st.chat_message(msg["role"]):
-        st.markdown(msg["content"])
+def chat_history():
+    """Newest page of the chat; older pages are read from storage on request (reruns only this fragment)."""
+    chat_pages = st.session_state.get("chat_pages", 1)
+    shown = min(conversation.total, Config.CHAT_PAGE_SIZE * chat_pages)
+    if conversation.total > shown:
+        if st.button(f"Show older messages ({conversation.total - shown} more)"):
+            st.session_state["chat_pages"] = chat_pages + 1
+            st.rerun(scope="fragment")
+    if shown <= len(conversation.messages):
+        history = conversation.recent(shown) if shown else []
+    else:
+        history = conversation.page(conversation.total, shown)
+    for msg in history:
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+
+st.fragment(chat_history)()
 
 # -----------------------
 # CHAT INPUT (avoid value= to support older Streamlit)
 # -----------------------
 user_input = st.chat_input("Ask anything about a place (e.g., 'Tell me about Mysuru')...")
 
-# If chat_input empty but we have a speech query, use it once and clear query params
-if not user_input and speech_q:
+# If chat_input empty but we have a speech query, use it; its id is only claimed
+# when it is answered, and replays of an answered id are dropped
+if not user_input and speech_q and conversation.claim(speech_id):
     user_input = speech_q
-    try:
-        st.experimental_set_query_params()
-    except Exception:
-        pass
 
 # -----------------------
-# ROBUST SAVED FOLDER LOOKUP
+# SAVED FOLDER LOOKUP
 # -----------------------
 def find_saved_city_folder(query: str):
-    """Try exact key, substring match, and meta.json city field to locate saved folder."""
-    if not query:
-        return None
-    key = safe_key(query)
-    root = os.path.join(DATA_DIR, "cities")
-    if not os.path.isdir(root):
-        return None
-    # exact key
-    candidate = os.path.join(root, key)
-    if os.path.isdir(candidate):
-        return candidate
-    # substring in folder names
-    for fn in os.listdir(root):
-        if key in fn:
-            p = os.path.join(root, fn)
-            if os.path.isdir(p):
-                return p
-    # meta.json city field match
-    for fn in os.listdir(root):
-        p = os.path.join(root, fn)
-        meta = os.path.join(p, "meta.json")
-        if os.path.exists(meta):
-            try:
-                m = json.load(open(meta, "r", encoding="utf-8"))
-                meta_city = m.get("city", "")
-                if key in safe_key(meta_city):
-                    return p
-            except Exception:
-                continue
-    return None
+    """Look up a saved city folder by key, alias or key prefix (indexed, no directory scan)."""
+    rec = get_city_store().find(query)
+    return rec["folder"] if rec else None
+
+def offline_answer(city_for_answer: str, question: str = "") -> str:
+    """Offline reply: passages matching the question from the local index, else the city's info."""
+    answer = answer_offline(city_for_answer, question)
+    if answer:
+        return answer
+    entry = bundle.city(city_for_answer)
+    if entry and entry.get("info"):
+        return entry["info"]
+    if entry and "saved" in entry["sources"]:
+        return f"{city_for_answer.title()} — basic offline info."
+    return f"{city_for_answer.title()} — no online AI available and not saved offline."
+
+def nearby_answer(text: str, city: str) -> str:
+    """'What's near me' from the POI index: browser GPS (?lat=&lon=) if sent, else the city centre."""
+    try:
+        lat, lon = float(params.get("lat")), float(params.get("lon"))
+        label = "you"
+    except (TypeError, ValueError):
+        if not city:
+            return "Share your location or name a city first (e.g., 'What's near me in Hampi')."
+        hit, (lat, lon) = get_geocode_cache().get(safe_key(city))
+        if not hit and online:
+            # looked up by the city_media job (shared with the gallery below), never inline
+            jobs.submit("city_media", {"city": city}, key=safe_key(city), reuse_for=Config.CITY_MEDIA_REUSE)
+            return f"I'm still locating {city.title()} — ask again in a moment."
+        if lat is None or lon is None:
+            return f"I don't have coordinates for {city.title()} yet."
+        label = city.title()
+    index = get_poi_index()
+    radius_km = parse_radius_km(text)
+    if radius_km:
+        results = index.within(lat, lon, radius_km)
+    else:
+        results = index.nearest(lat, lon, Config.NEARBY_RESULTS + 1)
+    # don't list the city we're standing in as a place near itself
+    results = [r for r in results if not (r["category"] == "city" and r["distance_km"] < 1.0)]
+    limit = Config.NEARBY_RESULTS * 2 if radius_km else Config.NEARBY_RESULTS
+    return describe_nearby(results[:limit], label)
+
+def itinerary_answer(text: str, city: str) -> str:
+    """Day routes over the city's offline places, from browser GPS if sent, else the city centre."""
+    if not city:
+        return "Name a city to plan a route (e.g., 'Plan a 2-day trip in Mysuru')."
+    try:
+        start = (float(params.get("lat")), float(params.get("lon")), "your location")
+    except (TypeError, ValueError):
+        start = None
+    plan = plan_itinerary(city, start=start, days=parse_days(text))
+    if plan is None:
+        return f"I don't have places with coordinates for {city.title()} yet."
+    st.session_state["itinerary"] = plan  # drawn on the map view below
+    return describe_itinerary(plan, city.title())
 
 # -----------------------
 # HANDLE USER MESSAGE
 # -----------------------
 if user_input:
+    st.session_state.pop("speech", None)  # the previous reply's audio is not replayed
     # append user message
-    context.setdefault("chat", []).append({"role": "user", "content": user_input})
-    save_context(context)
+    conversation.add("user", user_input)
     with st.chat_message("user"):
         st.markdown(user_input)
 
     # basic detection
     lower = user_input.lower().strip()
     greetings = ["hi", "hello", "hey", "namaste", "good morning", "good evening"]
-    detected_city = None
-    # check known offline city words first
-    for k in list(OFFLINE_CITIES.keys()):
-        if k in lower:
-            detected_city = k
-            break
-    # try explicit pattern "in <city>"
-    if not detected_city:
-        m = re.search(r"\b(?:in|at|around)\s+([a-z\s]+)", lower)
-        if m:
-            detected_city = m.group(1).strip()
-
-    # if still not detected, try to find saved folder by substring match
-    if not detected_city:
-        # attempt to find any saved folder name within the user input
-        for f in folders:
-            if f in lower:
-                detected_city = f
-                break
+    # gazetteer match over built-in, bundled and saved city names (+ variants),
+    # falling back to a trimmed "in/at/around <place>" capture
+    with span("detect_city"):
+        detected_city = detect_city(lower, get_matcher(bundle))
 
     assistant_text = ""
+    reply_stream = None
+    spoken_text = None
 
     # greeting
     if any(lower == g or lower.startswith(g + " ") for g in greetings) and len(lower.split()) <= 3:
@@ -427,125 +488,211 @@ if user_input:
             "👋 Hey! I'm your AI Tour Guide. You can ask about a city (e.g., 'Tell me about Mysuru'), "
             "ask for food places, or say 'Download for offline' in the sidebar to save a city."
         )
+    elif is_nearby_query(lower):
+        # answered locally from the spatial index, online or not
+        city_for_answer = detected_city or conversation.last_city
+        if detected_city:
+            conversation.set_last_city(safe_key(detected_city))
+        assistant_text = nearby_answer(lower, city_for_answer)
+    elif is_itinerary_query(lower):
+        # planned locally over the offline places, online or not
+        city_for_answer = detected_city or conversation.last_city
+        if city_for_answer:
+            conversation.set_last_city(safe_key(city_for_answer))
+        assistant_text = itinerary_answer(lower, city_for_answer)
     else:
-        # If we have detected_city or last city in context, use that
-        city_for_answer = detected_city or context.get("last_city")
+        # If we have detected_city or the session's last city, use that
+        city_for_answer = detected_city or conversation.last_city
         # If nothing, ask user to clarify
         if not city_for_answer:
             assistant_text = "I couldn't detect a city. Try: 'Tell me about Mysuru' or 'Places to see in Udupi'."
         else:
             # Normalize key
             city_key = safe_key(city_for_answer)
-            context["last_city"] = city_key
-            save_context(context)
-            # Try online GPT if available
-            reply = None
-            if online and OPENAI_API_KEY and OpenAI is not None:
-                reply = gpt_reply(city_for_answer, user_input)
-            if reply:
-                assistant_text = reply
+            conversation.set_last_city(city_key)
+            # Try online GPT if available (streamed; rendered below)
+            if online and OPENAI_API_KEY:
+                reply_stream = gpt_reply_stream(city_for_answer, user_input)
             else:
-                # prefer saved meta.json if exists
-                saved_folder = find_saved_city_folder(city_for_answer)
-                if saved_folder:
-                    meta_path = os.path.join(saved_folder, "meta.json")
-                    if os.path.exists(meta_path):
-                        try:
-                            meta = json.load(open(meta_path, "r", encoding="utf-8"))
-                            assistant_text = meta.get("info") or meta.get("city") or f"{city_for_answer.title()} — info saved offline."
-                        except Exception:
-                            assistant_text = f"{city_for_answer.title()} — saved offline (meta unreadable)."
-                    else:
-                        # fallback to built-in offline DB if present
-                        assistant_text = OFFLINE_CITIES.get(city_key, {}).get("info", f"{city_for_answer.title()} — basic offline info.")
-                else:
-                    # no saved folder — fallback to built-in DB
-                    assistant_text = OFFLINE_CITIES.get(city_key, {}).get("info", f"{city_for_answer.title()} — no online AI available and not saved offline.")
+                assistant_text = offline_answer(city_for_answer, user_input)
+                spoken_text = overview(city_for_answer)
 
     # display assistant message
     with st.chat_message("assistant"):
-        st.markdown(assistant_text)
-        # speak (best-effort)
+        streamed = ""
+        if reply_stream is not None:
+            # render tokens as they arrive; TTS starts on each finished sentence
+            speaker = StreamingSpeaker(lang=voice_lang)
+            try:
+                streamed = st.write_stream(speaker.tee(reply_stream))
+            except Exception:
+                streamed = ""
+            if isinstance(streamed, str) and streamed.strip():
+                assistant_text = streamed
+                # clips were started sentence by sentence; the job waits for (or redoes) the rest
+                speak(speaker.texts, lang=voice_lang)
+            else:
+                assistant_text = offline_answer(city_for_answer, user_input)
+                spoken_text = overview(city_for_answer)
+        if not streamed:
+            st.markdown(assistant_text)
+            # speak (best-effort); offline replies read only the overview, which downloads pre-render
+            try:
+                speak([spoken_text or assistant_text], lang=voice_lang)
+            except Exception:
+                pass
+
+    # append assistant to the session log
+    conversation.add("assistant", assistant_text)
+
+# -----------------------
+# AUDIO, IMAGES AND MAP for the reply: shown with it, and once more when a background job lands
+# -----------------------
+reply_ready = st.session_state.pop("reply_ready", False)
+if reply_ready and not user_input and st.session_state.get("speech"):
+    speech_job = jobs.get(st.session_state["speech"]["job"] or "")
+    speech_pending = bool(speech_job) and speech_job["status"] in ACTIVE
+    st.session_state["speech_pending"] = speech_pending
+    st.fragment(reply_audio, run_every=1.0 if speech_pending else None)()
+show_media = bool(user_input) or reply_ready
+last_city = conversation.last_city if show_media else None
+if last_city:
+    st.markdown("---")
+    st.markdown(f"### 📸 Images — {last_city.title()}")
+    saved_rec = get_city_store().find(last_city)
+    saved_folder = saved_rec["folder"] if saved_rec else None
+    shown_any = False
+    # show saved images if folder exists
+    if saved_rec:
+        storage.touch_city(saved_rec["key"])  # least recently viewed cities are evicted first
+        image_files = saved_rec["images"]
+        if image_files:
+            cols = st.columns(min(3, len(image_files)))
+            for i, path in enumerate(image_files):
+                thumb = get_thumbnail(path)
+                if thumb:
+                    with cols[i % len(cols)]:
+                        st.image(thumb, width='stretch')
+                    shown_any = True
+    NO_IMAGES = ("No images available for this city (saved offline or Unsplash). "
+                 "Use 'Download for offline' in the sidebar to save images and a placeholder map.")
+    # Unsplash images and coordinates for unsaved cities come from a background
+    # job; whatever is cached shows now and a fragment picks the result up when it lands
+    geo_hit, (lat, lon) = get_geocode_cache().get(safe_key(last_city))
+    media_id = None
+    if online and (not shown_any or not geo_hit):
+        media_id = jobs.submit("city_media", {"city": last_city}, key=safe_key(last_city),
+                               reuse_for=Config.CITY_MEDIA_REUSE)
+        media = jobs.get(media_id)
+        if media and media["status"] == "done" and not geo_hit:
+            lat, lon = media["result"]["lat"], media["result"]["lon"]
+
+    def media_gallery():
+        """Gallery from the city_media job; polls while it runs, then reruns the page once."""
+        job = jobs.get(media_id)
+        if job and job["status"] in ACTIVE:
+            st.caption("Locating…" if shown_any else "Looking for images…")
+            return
+        if st.session_state.pop("media_pending", False):
+            st.session_state["reply_ready"] = True
+            st.rerun()  # stops the polling; the page redraws with the images and the coordinates
+        if shown_any:
+            return
+        thumbs = fetch_thumbnails(job["result"]["urls"]) if job and job["status"] == "done" else []
+        if thumbs:
+            cols = st.columns(len(thumbs))
+            for i, thumb in enumerate(thumbs):
+                with cols[i % len(cols)]:
+                    st.image(thumb, width='stretch')
+        else:
+            st.info(NO_IMAGES)
+
+    pending = bool(media_id) and (jobs.get(media_id) or {}).get("status") in ACTIVE
+    st.session_state["media_pending"] = pending
+    if media_id and (pending or not shown_any):
+        st.fragment(media_gallery, run_every=1.0 if pending else None)()
+    elif not shown_any:
+        st.info(NO_IMAGES)
+
+    # Map display: folium over the local tile cache when online,
+    # otherwise a static map stitched from cached tiles (or the saved map.png)
+    st.markdown(f"### 🗺 Map — {last_city.title()}")
+    map_path = os.path.join(saved_folder, "map.png") if saved_folder else None
+    route = st.session_state.get("itinerary")
+    if route and route["city"] != safe_key(last_city):
+        route = None
+    shown_map = False
+    if online and FOLIUM_OK and lat and lon:
         try:
-            speak(assistant_text, lang=voice_lang)
+            import folium
+            from streamlit_folium import st_folium
+
+            m = folium.Map(location=[lat, lon], zoom_start=12, tiles=tile_url_template(), attr=Config.TILE_ATTRIBUTION)
+            folium.Marker([lat, lon], tooltip=last_city.title()).add_to(m)
+            if route:
+                start = [route["start"]["lat"], route["start"]["lon"]]
+                colours = ["blue", "green", "orange", "purple"]
+                n = 0
+                for d, day in enumerate(route["days"]):
+                    stops = [[p["lat"], p["lon"]] for p in day["stops"]]
+                    folium.PolyLine([start] + stops, color=colours[d % len(colours)], weight=4).add_to(m)
+                    for p in day["stops"]:
+                        n += 1
+                        folium.Marker([p["lat"], p["lon"]], tooltip=f"{n}. {p['name']}").add_to(m)
+                m.fit_bounds([start] + [[p["lat"], p["lon"]] for day in route["days"] for p in day["stops"]])
+            # returned_objects=[]: panning/zooming the map doesn't rerun the script
+            st_folium(m, width=700, height=420, returned_objects=[])
+            shown_map = True
         except Exception:
-            pass
-
-    # append assistant to context
-    context.setdefault("chat", []).append({"role": "assistant", "content": assistant_text})
-    save_context(context)
-
-    # After responding, try to show images and map for last_city
-    last_city = context.get("last_city")
-    if last_city:
-        st.markdown("---")
-        st.markdown(f"### 📸 Images — {last_city.title()}")
-        saved_folder = find_saved_city_folder(last_city)
-        shown_any = False
-        # show saved images if folder exists
-        if saved_folder:
-            image_files = sorted([fn for fn in os.listdir(saved_folder) if fn.lower().endswith((".jpg", ".jpeg", ".png")) and fn.lower() != "map.png"])
-            if image_files:
-                cols = st.columns(min(3, len(image_files)))
-                for i, fn in enumerate(image_files):
-                    path = os.path.join(saved_folder, fn)
-                    try:
-                        with cols[i % len(cols)]:
-                            st.image(Image.open(path), width='stretch')
-                        shown_any = True
-                    except Exception:
-                        continue
-        # if none saved and online, fetch Unsplash temporarily
-        if not shown_any and online:
-            urls = fetch_unsplash_urls(last_city, n=3)
-            if urls:
-                cols = st.columns(len(urls))
-                for i, url in enumerate(urls):
-                    try:
-                        r = requests.get(url, timeout=8)
-                        r.raise_for_status()
-                        img = Image.open(BytesIO(r.content))
-                        with cols[i % len(cols)]:
-                            st.image(img, width='stretch')
-                        shown_any = True
-                    except Exception:
-                        continue
-        if not shown_any:
-            st.info("No images available for this city (saved offline or Unsplash). Use 'Download for offline' in the sidebar to save images and a placeholder map.")
-
-        # Map display (prefer folium when online)
-        st.markdown(f"### 🗺 Map — {last_city.title()}")
-        lat, lon = (None, None)
-        if online:
-            lat, lon = geocode_city(last_city)
-        # If online and folium available and coords present -> interactive map
-        if online and FOLIUM_OK and lat and lon:
+            shown_map = False
+    if not shown_map and route:
+        img = render_route_map(
+            f"{last_city.title()} — route from {route['start']['name']}",
+            (route["start"]["lat"], route["start"]["lon"]),
+            [[(p["lat"], p["lon"]) for p in day["stops"]] for day in route["days"]],
+        )
+        st.image(img, width='stretch')
+        shown_map = True
+    if not shown_map:
+        img = render_static_map(last_city, lat, lon) if lat is not None and lon is not None else None
+        if img is None and map_path and os.path.exists(map_path):
             try:
-                m = folium.Map(location=[lat, lon], zoom_start=12, tiles="CartoDB Positron")
-                folium.Marker([lat, lon], tooltip=last_city.title()).add_to(m)
-                st_folium(m, width=700, height=420)
+                img = Image.open(map_path)
             except Exception:
-                # fallback to saved map or placeholder
-                map_path = os.path.join(saved_folder, "map.png") if saved_folder else None
-                if map_path and os.path.exists(map_path):
-                    st.image(map_path, width='stretch')
-                else:
-                    placeholder = make_placeholder_map_image(last_city, lat or 0.0, lon or 0.0)
-                    st.image(placeholder, width='stretch')
-        else:
-            # offline or folium not available -> show saved map if exists else placeholder
-            map_path = os.path.join(saved_folder, "map.png") if saved_folder else None
-            if map_path and os.path.exists(map_path):
-                try:
-                    st.image(Image.open(map_path), width='stretch')
-                except Exception:
-                    st.info("Saved map exists but could not be displayed.")
-            else:
-                placeholder = make_placeholder_map_image(last_city, lat or 0.0, lon or 0.0)
-                st.image(placeholder, width='stretch')
+                img = None
+        if img is None:
+            img = make_placeholder_map_image(last_city, lat, lon)
+        st.image(img, width='stretch')
 
 # -----------------------
 # FOOTER
 # -----------------------
 st.markdown("---")
 st.caption("AI Tour Guide — Interactive, dynamic, and offline-ready. Use the sidebar to download cities for offline access.")
+
+# -----------------------
+# DEBUG PANEL CONTENTS
+# -----------------------
+trace.name = "message" if user_input else "rerun"
+finish_request(trace)
+with debug_panel:
+    st.markdown(f"**This run** ({trace.name}) — {trace.duration * 1e3:.0f} ms")
+    if trace.spans:
+        st.table([
+            {"stage": sp.stage, "ms": round(sp.duration * 1e3, 1), "outcome": sp.outcome, "error": sp.error}
+            for sp in trace.spans
+        ])
+    metrics = get_metrics()
+    st.markdown("**Since start** (this process)")
+    st.table([
+        {"stage": stage, "count": m["count"], "p50 ms": round(m["p50"] * 1e3, 1), "p95 ms": round(m["p95"] * 1e3, 1),
+         "outcomes": ", ".join(f"{o}={n}" for o, n in sorted(m["outcomes"].items()))}
+        for stage, m in metrics.snapshot().items()
+    ])
+    if metrics.errors:
+        st.markdown("**Recent failures**")
+        for at, stage, reason in list(metrics.errors)[-10:][::-1]:
+            st.caption(f"{time.strftime('%H:%M:%S', time.localtime(at))} {stage}: {reason}")
+    st.download_button("Prometheus metrics", metrics.prometheus(), file_name="metrics.txt", mime="text/plain")
+    if Config.METRICS_PORT:
+        st.caption(f"Scrape endpoint: http://{Config.METRICS_HOST}:{Config.METRICS_PORT}/metrics")
@@ -0,0 +1,207 @@
+# tracing.py
+"""Per-stage latency tracing with a Prometheus-style export.
+
+Slow or failing stages (network probe, city detection, OpenAI, TTS, image
+fetches, geocoding, saved-city lookups) are wrapped in :func:`span`::
+
+    with span("geocode") as s:
+        ...
+        s.set("cache_hit")          # outcome label
+        ...
+        s.fail(e)                   # outcome "error" + reason, nothing raised
+
+Every span feeds the process-wide :class:`Metrics` (duration histogram and
+outcome counters per stage, plus the last failure reasons). Spans opened
+while a request trace is active (:func:`start_request` on the script
+thread) are also collected into that trace, so the debug panel can show
+where one rerun spent its time. Work on background threads only counts
+towards the aggregate metrics.
+
+:meth:`Metrics.prometheus` renders the text exposition format; with
+``METRICS_PORT`` set, :func:`start_metrics_server` serves it on
+``/metrics`` (bound to ``METRICS_HOST``).
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Span:
+    __slots__ = ("stage", "started", "duration", "outcome", "error")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.started = time.time()
+        self.duration = 0.0
+        self.outcome = "ok"
+        self.error = ""
+
+    def set(self, outcome: str):
+        self.outcome = outcome
+
+    def fail(self, reason, outcome: str = "error"):
+        """Mark the span failed with a reason (an exception or a message)."""
+        self.outcome = outcome
+        self.error = (str(reason) or type(reason).__name__)[:200]
+
+
+class Trace:
+    """Spans recorded on one thread between start_request() and finish_request()."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.duration = 0.0
+        self.spans = []
+
+
+class Metrics:
+    """Thread-safe histograms and outcome counters per stage."""
+
+    def __init__(self, buckets=BUCKETS, recent: int = 200, errors: int = 50):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._hist = {}  # stage -> [bucket counts..., sum, count]
+        self._outcomes = {}  # (stage, outcome) -> count
+        self._recent = {}  # stage -> deque of recent durations (for percentiles in the panel)
+        self._recent_size = recent
+        self.errors = deque(maxlen=errors)  # (time, stage, reason)
+
+    def observe(self, stage: str, seconds: float, outcome: str = "ok", error: str = ""):
+        with self._lock:
+            hist = self._hist.get(stage)
+            if hist is None:
+                hist = self._hist[stage] = [0] * len(self.buckets) + [0.0, 0]
+                self._recent[stage] = deque(maxlen=self._recent_size)
+            for i, le in enumerate(self.buckets):
+                if seconds <= le:
+                    hist[i] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+            self._recent[stage].append(seconds)
+            self._outcomes[(stage, outcome)] = self._outcomes.get((stage, outcome), 0) + 1
+            if error:
+                self.errors.append((time.time(), stage, error))
+
+    def snapshot(self) -> dict:
+        """stage -> {count, mean, p50, p95, outcomes} for display."""
+        out = {}
+        with self._lock:
+            for stage, hist in sorted(self._hist.items()):
+                recent = sorted(self._recent[stage])
+                out[stage] = {
+                    "count": hist[-1],
+                    "mean": hist[-2] / hist[-1],
+                    "p50": recent[len(recent) // 2],
+                    "p95": recent[min(len(recent) - 1, int(len(recent) * 0.95))],
+                    "outcomes": {o: n for (s, o), n in self._outcomes.items() if s == stage},
+                }
+        return out
+
+    def prometheus(self, prefix: str = "tourguide") -> str:
+        lines = [
+            f"# HELP {prefix}_stage_duration_seconds Time spent per stage.",
+            f"# TYPE {prefix}_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage, hist in sorted(self._hist.items()):
+                for le, n in zip(self.buckets, hist):
+                    lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {n}')
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist[-1]}')
+                lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {hist[-2]:.6f}')
+                lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {hist[-1]}')
+            lines += [
+                f"# HELP {prefix}_stage_outcomes_total Stage results by outcome (ok, cache_hit, error, ...).",
+                f"# TYPE {prefix}_stage_outcomes_total counter",
+            ]
+            for (stage, outcome), n in sorted(self._outcomes.items()):
+                lines.append(f'{prefix}_stage_outcomes_total{{stage="{stage}",outcome="{outcome}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+_metrics = Metrics()
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage; exceptions are recorded as failures and re-raised."""
+    s = Span(stage)
+    t = time.perf_counter()
+    try:
+        yield s
+    except Exception as e:
+        s.fail(e)
+        raise
+    finally:
+        s.duration = time.perf_counter() - t
+        _metrics.observe(stage, s.duration, s.outcome, s.error)
+        trace = _trace.get()
+        if trace is not None:
+            trace.spans.append(s)
+
+
+def observe(stage: str, seconds: float, outcome: str = "ok"):
+    """Record a duration measured elsewhere (e.g. time to first streamed chunk)."""
+    _metrics.observe(stage, seconds, outcome)
+    trace = _trace.get()
+    if trace is not None:
+        s = Span(stage)
+        s.duration, s.outcome = seconds, outcome
+        trace.spans.append(s)
+
+
+def start_request(name: str) -> Trace:
+    """Collect spans opened on this thread until :func:`finish_request`."""
+    trace = Trace(name)
+    _trace.set(trace)
+    return trace
+
+
+def finish_request(trace: Trace) -> Trace:
+    trace.duration = time.time() - trace.started
+    _metrics.observe(f"request.{trace.name}", trace.duration)
+    _trace.set(None)
+    return trace
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = _metrics.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Serve ``/metrics`` for Prometheus scrapes; returns the bound port or None."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError:
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server.server_address[1]
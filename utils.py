@@ -0,0 +1,8 @@
+# utils.py
+"""Small helpers shared by the app and its service modules."""
+
+
+def safe_key(s: str) -> str:
+    """Normalize a city name into a safe folder key."""
+    return "".join(c for c in s.lower().strip().replace(" ", "") if (c.isalnum() or c in "-"))
+